@@ -3,22 +3,57 @@ import boto3
 import json
 import tempfile
 import time
+import math
+import threading
+import zipfile
+import tarfile
+import subprocess
+import io
+import base64
+import hashlib
+import hmac
+import sqlite3
+import glob
+import re
+import queue
+import uuid
+import secrets
+import random
+import socket
+import sys
+import marshal
+import cProfile
+import pstats
+import tracemalloc
+import contextvars
+import urllib.request
+from contextlib import contextmanager
+from collections import deque, Counter
+from concurrent.futures import ThreadPoolExecutor, Future, as_completed
 import numpy as np
 import logging
 from flask import Flask, render_template, request, redirect, url_for, session, flash, Response, stream_with_context, jsonify
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
 from werkzeug.utils import secure_filename
+from itsdangerous import Signer, BadSignature
 from functools import wraps
-from pydub import AudioSegment
-import sagemaker
-from sagemaker.serializers import NumpySerializer
-from sagemaker.deserializers import StringDeserializer
+from botocore.config import Config as BotoConfig
+
+try:
+    import soundfile
+except ImportError:
+    soundfile = None
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 
 app = Flask(__name__)
-app.secret_key = os.urandom(24)
 app.logger.setLevel(logging.INFO)
+# 所有副本必须使用相同的密钥, 否则会话在负载均衡后和重启后失效
+app.secret_key = os.environ.get('SECRET_KEY') or os.urandom(24)
+if not os.environ.get('SECRET_KEY'):
+    app.logger.warning("SECRET_KEY 未设置, 使用随机密钥: 重启后会话失效, 多副本之间无法共享会话")
 
 # AWS region
 region_name = os.environ.get('AWS_REGION', 'cn-northwest-1')
@@ -39,23 +74,589 @@ secretsmanager = boto3.client('secretsmanager', region_name=region_name)
 SECRET_NAME = os.environ.get('SECRET_NAME', 'whisper-app-credentials')
 ENDPOINT_NAME = os.environ.get('SAGEMAKER_ENDPOINT', 'whisper-endpoint')
 app.logger.info(f"SageMaker Endpoint Name: {ENDPOINT_NAME}")
+# 多端点路由: 逗号分隔的 "端点[/变体][:权重]" 列表, 或JSON数组 (见 parse_endpoint_targets); 设置后忽略 SAGEMAKER_ENDPOINT
+SAGEMAKER_ENDPOINTS = os.environ.get('SAGEMAKER_ENDPOINTS', '')
+# 延迟和错误率的指数加权平均系数
+ROUTER_EWMA_ALPHA = float(os.environ.get('ROUTER_EWMA_ALPHA', '0.2'))
+# 错误率超过阈值的端点暂停使用 ROUTER_COOLDOWN_SECONDS 秒 (所有端点都暂停时仍然使用)
+ROUTER_EJECT_ERROR_RATE = float(os.environ.get('ROUTER_EJECT_ERROR_RATE', '0.5'))
+ROUTER_COOLDOWN_SECONDS = float(os.environ.get('ROUTER_COOLDOWN_SECONDS', '30'))
+# 每个分段最多尝试的端点数 (调用失败时换一个端点重试)
+ROUTER_MAX_ATTEMPTS = int(os.environ.get('ROUTER_MAX_ATTEMPTS', '2'))
+# 推理后端: endpoint (默认, SageMaker端点), local (本地CPU推理) 或 auto (短音频本地推理, 长音频调用端点)
+INFERENCE_BACKEND = os.environ.get('INFERENCE_BACKEND', 'endpoint')
+# auto 模式下本地推理的最大音频时长 (秒)
+LOCAL_MAX_SECONDS = float(os.environ.get('LOCAL_MAX_SECONDS', '60'))
+# 本地推理模型: faster-whisper 模型名 (tiny/base/small/...) 或 CTranslate2 模型目录
+LOCAL_MODEL = os.environ.get('LOCAL_MODEL', 'base')
+# 本地推理的量化类型 (int8, int8_float32, float32)
+LOCAL_COMPUTE_TYPE = os.environ.get('LOCAL_COMPUTE_TYPE', 'int8')
+# 每次本地推理使用的CPU线程数 (0为自动) 和同时进行的本地推理数
+LOCAL_CPU_THREADS = int(os.environ.get('LOCAL_CPU_THREADS', '0'))
+LOCAL_CONCURRENCY = int(os.environ.get('LOCAL_CONCURRENCY', '1'))
+LOCAL_BEAM_SIZE = int(os.environ.get('LOCAL_BEAM_SIZE', '5'))
+# 模型分级路由: 从快到准排列的模型档位, 每个档位是一组端点 (与 SAGEMAKER_ENDPOINTS 格式相同) 或本地模型;
+# 设置后忽略 SAGEMAKER_ENDPOINTS 和 INFERENCE_BACKEND (见 parse_model_tiers)
+MODEL_TIERS = os.environ.get('MODEL_TIERS', '')
+# 未指定质量的任务使用的档位 (默认中间一档, 两档时为较准的一档)
+MODEL_TIER_DEFAULT = os.environ.get('MODEL_TIER_DEFAULT', '')
+# 未指定质量时不超过该时长的音频使用最快的档位 (秒)
+MODEL_TIER_SHORT_SECONDS = float(os.environ.get('MODEL_TIER_SHORT_SECONDS', '60'))
+# 档位积压 (等待中和调用中的音频秒数) 达到该值时, 新任务降级到更快的档位
+MODEL_TIER_MAX_BACKLOG_SECONDS = float(os.environ.get('MODEL_TIER_MAX_BACKLOG_SECONDS', '1800'))
+# 预热: 启动时向每个端点 (和本地模型) 发送一小段合成音频; WARMUP_IDLE_SECONDS 大于0时,
+# 端点空闲超过该时间后再次预热, 保持容器内模型已加载、连接池中的连接可用
+WARMUP_ON_STARTUP = os.environ.get('WARMUP_ON_STARTUP', '1') == '1'
+WARMUP_IDLE_SECONDS = float(os.environ.get('WARMUP_IDLE_SECONDS', '0'))
+# 每次预热同时发送的请求数, 即保持可用的连接数
+WARMUP_CONNECTIONS = int(os.environ.get('WARMUP_CONNECTIONS', '1'))
+WARMUP_AUDIO_SECONDS = float(os.environ.get('WARMUP_AUDIO_SECONDS', '1'))
+# 任务的第一次端点调用距该端点上一次调用超过该时间 (或进程启动后从未调用) 时记为冷调用
+WARMUP_COLD_SECONDS = float(os.environ.get('WARMUP_COLD_SECONDS', '300'))
 
-# 初始化 SageMaker Predictor
+# Whisper 的 initial_prompt 最多 n_text_ctx // 2 - 1 = 223 个token, 超出部分会被模型截掉
+PROMPT_TOKEN_BUDGET = int(os.environ.get('PROMPT_TOKEN_BUDGET', '200'))
+# 滚动上下文从上一段转录结果尾部最多携带的字符数
+ROLLING_CONTEXT_CHARS = int(os.environ.get('ROLLING_CONTEXT_CHARS', '200'))
+
+# 所有请求共享的分段调度线程数, 即对SageMaker端点的最大并发调用数
+SEGMENT_WORKERS = int(os.environ.get('SEGMENT_WORKERS', '4'))
+# 批量转录时同时解码/汇总的文件数
+BATCH_FILE_WORKERS = int(os.environ.get('BATCH_FILE_WORKERS', '2'))
+# 单个转录任务同时在途的分段数上限 (批量任务使用 SEGMENT_WORKERS)
+JOB_MAX_IN_FLIGHT = int(os.environ.get('JOB_MAX_IN_FLIGHT', '2'))
+
+# 解码后端: ffmpeg (默认, 支持所有ffmpeg可解码的格式) 或 pydub
+AUDIO_DECODER = os.environ.get('AUDIO_DECODER', 'ffmpeg')
+# 支持上传的音频格式
+SUPPORTED_FORMATS = ['.mp3', '.m4a', '.wav', '.flac', '.ogg', '.opus', '.webm']
+# Whisper expects 16 kHz, mono channel, ≤30s
+SAMPLE_RATE = 16000
+CHUNK_SECONDS = 30
+
+# SAGEMAKER_ENDPOINT=mock 时使用本地模拟端点, 每次调用的模拟延迟 (毫秒) 和模拟带宽 (Mbps, 0表示不限)
+MOCK_ENDPOINT_LATENCY_MS = float(os.environ.get('MOCK_ENDPOINT_LATENCY_MS', '200'))
+MOCK_ENDPOINT_BANDWIDTH_MBPS = float(os.environ.get('MOCK_ENDPOINT_BANDWIDTH_MBPS', '0'))
+# 请求未指定语言时模拟端点额外的语言检测耗时 (毫秒)
+MOCK_ENDPOINT_DETECT_MS = float(os.environ.get('MOCK_ENDPOINT_DETECT_MS', '0'))
+
+# 发送到端点的音频编码: float16 (原始格式), int16, flac (无损), opus (高码率有损)
+# 端点不支持所选编码时自动回退到 float16
+PAYLOAD_ENCODING = os.environ.get('PAYLOAD_ENCODING', 'float16')
+OPUS_BITRATE = os.environ.get('OPUS_BITRATE', '96k')
+# 编码被端点拒绝后回退到 float16 的时间 (秒), 之后重新尝试所选编码
+PAYLOAD_REPROBE_SECONDS = float(os.environ.get('PAYLOAD_REPROBE_SECONDS', '600'))
+
+# 转录结果存储: sqlite (默认), disk (每个任务一个JSON文件) 或 none (不保存)
+TRANSCRIPT_STORE = os.environ.get('TRANSCRIPT_STORE', 'sqlite')
+# sqlite 时为数据库文件, disk 时为目录, 未设置时按后端使用各自的默认位置
+TRANSCRIPT_STORE_PATH = os.environ.get('TRANSCRIPT_STORE_PATH') or os.path.join(
+    tempfile.gettempdir(), 'whisper_transcripts' if TRANSCRIPT_STORE == 'disk' else 'whisper_transcripts.db')
+
+# 全文检索索引: fts5 (SQLite FTS5, 默认) 或 none
+SEARCH_INDEX = os.environ.get('SEARCH_INDEX', 'fts5')
+SEARCH_INDEX_PATH = os.environ.get('SEARCH_INDEX_PATH', os.path.join(tempfile.gettempdir(), 'whisper_search.db'))
+
+# 声学指纹索引: sqlite (默认), memory 或 none; 相似度 (1 - 误码率) 不低于阈值的分段直接复用已有转录
+FINGERPRINT_INDEX = os.environ.get('FINGERPRINT_INDEX', 'sqlite')
+FINGERPRINT_INDEX_PATH = os.environ.get('FINGERPRINT_INDEX_PATH', os.path.join(tempfile.gettempdir(), 'whisper_fingerprints.db'))
+FINGERPRINT_MATCH_THRESHOLD = float(os.environ.get('FINGERPRINT_MATCH_THRESHOLD', '0.8'))
+
+# 静音分段检测: 每20ms一帧, RMS电平高于 SILENCE_THRESHOLD_DBFS 的帧为有效帧,
+# 有效帧占比低于 SILENCE_MIN_ACTIVE_RATIO 的分段视为静音, 不调用端点
+SKIP_SILENT_SEGMENTS = os.environ.get('SKIP_SILENT_SEGMENTS', '1') == '1'
+SILENCE_THRESHOLD_DBFS = float(os.environ.get('SILENCE_THRESHOLD_DBFS', '-45'))
+SILENCE_MIN_ACTIVE_RATIO = float(os.environ.get('SILENCE_MIN_ACTIVE_RATIO', '0.02'))
+# 与前一段完全相同的分段 (循环播放的音频) 不调用端点
+SKIP_DUPLICATE_SEGMENTS = os.environ.get('SKIP_DUPLICATE_SEGMENTS', '1') == '1'
+
+# 快速首段: 先转录开头 FAST_START_SECONDS 秒并作为临时结果推送, 完整的第一段完成后替换
+FAST_START_SECONDS = float(os.environ.get('FAST_START_SECONDS', '8'))
+
+# 语言: DEFAULT_LANGUAGE 为空时由端点在第一段有语音的分段上检测, 之后的分段固定使用检测到的语言
+# (PIN_LANGUAGE=0 时每段都由端点各自检测)
+DEFAULT_LANGUAGE = os.environ.get('DEFAULT_LANGUAGE', '')
+PIN_LANGUAGE = os.environ.get('PIN_LANGUAGE', '1') == '1'
+
+# 分布式模式: WORK_QUEUE 为 local (进程内, 用于测试) 或 redis 时, 分段调用经共享队列分发到所有副本的工作线程
+WORK_QUEUE = os.environ.get('WORK_QUEUE', 'none')
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+# 所有副本共享的目录 (如EFS), 存放上传文件和待转录的分段音频
+SPOOL_DIR = os.environ.get('SPOOL_DIR', os.path.join(tempfile.gettempdir(), 'whisper_spool'))
+# 每个副本从队列取分段并调用端点的工作线程数
+QUEUE_WORKERS = int(os.environ.get('QUEUE_WORKERS', str(SEGMENT_WORKERS)))
+# 分布式模式下单个任务同时在途的分段数 (在途分段由所有副本的工作线程处理)
+QUEUE_JOB_MAX_IN_FLIGHT = int(os.environ.get('QUEUE_JOB_MAX_IN_FLIGHT', '8'))
+# 等待分段结果的超时时间 (秒), 超时的分段记为失败, 重新提交任务时补转
+QUEUE_RESULT_TIMEOUT = float(os.environ.get('QUEUE_RESULT_TIMEOUT', '600'))
+# 工作线程领取任务后在此时间 (秒) 内没有写回结果 (副本崩溃或被终止), 任务重新放回队列由其他工作线程领取
+QUEUE_TASK_VISIBILITY_SECONDS = float(os.environ.get('QUEUE_TASK_VISIBILITY_SECONDS', '120'))
+
+# 异步推理 (超长录音): SageMaker异步推理端点名称, 为空时不启用, mock 为本地模拟的异步端点
+ASYNC_ENDPOINT = os.environ.get('ASYNC_ENDPOINT', '')
+# 分段请求体的对象存储: s3 (默认, 可通过 ASYNC_S3_ENDPOINT_URL 使用MinIO等兼容服务) 或 local (本地目录, 开发和测试用)
+ASYNC_OBJECT_STORE = os.environ.get('ASYNC_OBJECT_STORE', 's3')
+ASYNC_S3_BUCKET = os.environ.get('ASYNC_S3_BUCKET', '')
+ASYNC_S3_PREFIX = os.environ.get('ASYNC_S3_PREFIX', 'whisper-async/')
+ASYNC_S3_ENDPOINT_URL = os.environ.get('ASYNC_S3_ENDPOINT_URL', '')
+ASYNC_LOCAL_STORE_DIR = os.environ.get('ASYNC_LOCAL_STORE_DIR', os.path.join(tempfile.gettempdir(), 'whisper_async'))
+# 完成通知: 订阅端点成功/失败SNS主题的SQS队列URL (mock 为进程内队列), 为空时轮询结果位置
+ASYNC_NOTIFICATION_QUEUE_URL = os.environ.get('ASYNC_NOTIFICATION_QUEUE_URL', '')
+ASYNC_POLL_INTERVAL = float(os.environ.get('ASYNC_POLL_INTERVAL', '5'))
+# 同时运行的异步任务数和每个任务同时提交的分段数
+ASYNC_JOB_WORKERS = int(os.environ.get('ASYNC_JOB_WORKERS', '2'))
+ASYNC_MAX_IN_FLIGHT = int(os.environ.get('ASYNC_MAX_IN_FLIGHT', '32'))
+# 等待单个分段结果的超时时间 (秒), 异步端点的队列可能很长
+ASYNC_RESULT_TIMEOUT = float(os.environ.get('ASYNC_RESULT_TIMEOUT', '3600'))
+# 解码完成前就失败的异步任务的状态保留时间 (秒), 之后从内存中删除
+ASYNC_FAILED_TTL_SECONDS = float(os.environ.get('ASYNC_FAILED_TTL_SECONDS', '3600'))
+# 本地模拟异步端点的实例数 (同时处理的请求数)
+MOCK_ASYNC_CONCURRENCY = int(os.environ.get('MOCK_ASYNC_CONCURRENCY', '2'))
+
+# 流量记录: 匿名的请求元数据 (JSONL) 追加写入该文件, 供 loadgen.py 回放; 为空时不记录
+TRAFFIC_LOG = os.environ.get('TRAFFIC_LOG', '')
+
+# 链路追踪: 导出器 log (每个span一行JSON日志), memory (进程内保存, 测试和调试用),
+# otlp (OTLP/HTTP JSON 发送到 OpenTelemetry Collector); 为空时不追踪
+TRACE_EXPORTER = os.environ.get('TRACE_EXPORTER', '')
+# 采样比例: 按trace_id决定, 同一任务在所有副本上的采样结果相同
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', '0.1'))
+TRACE_OTLP_ENDPOINT = os.environ.get('TRACE_OTLP_ENDPOINT', 'http://localhost:4318/v1/traces')
+TRACE_SERVICE_NAME = os.environ.get('TRACE_SERVICE_NAME', 'whisper-webui')
+TRACE_MEMORY_MAX_SPANS = int(os.environ.get('TRACE_MEMORY_MAX_SPANS', '10000'))
+
+# /api/capacity 的访问令牌 (Authorization: Bearer <token>), 供自动扩缩容适配器抓取; 为空时与 /metrics 一样不需要认证
+CAPACITY_TOKEN = os.environ.get('CAPACITY_TOKEN', '')
+
+# 管理员用户 (逗号分隔的用户名), 只有管理员可以使用性能分析接口; 为空时不启用管理接口
+ADMIN_USERS = {name.strip() for name in os.environ.get('ADMIN_USERS', '').split(',') if name.strip()}
+# 单次性能分析的最长时间 (秒) 和调用栈采样间隔 (毫秒)
+PROFILE_MAX_SECONDS = float(os.environ.get('PROFILE_MAX_SECONDS', '600'))
+PROFILE_SAMPLE_INTERVAL_MS = float(os.environ.get('PROFILE_SAMPLE_INTERVAL_MS', '10'))
+
+# 会话存储: sqlite (默认), memory, redis (多副本共享, 使用 REDIS_URL) 或 cookie (Flask默认的签名cookie)
+SESSION_STORE = os.environ.get('SESSION_STORE', 'sqlite')
+SESSION_STORE_PATH = os.environ.get('SESSION_STORE_PATH', os.path.join(tempfile.gettempdir(), 'whisper_sessions.db'))
+SESSION_LIFETIME_SECONDS = int(os.environ.get('SESSION_LIFETIME_SECONDS', str(7 * 24 * 3600)))
+
+DEFAULT_HOTWORDS_CONFIG = {'method': 'prompt_injection', 'words': [], 'boost_factor': 1.5}
+
+class MockPredictor:
+    """本地模拟端点, 用于无AWS环境的开发和基准测试 (SAGEMAKER_ENDPOINT=mock)
+
+    每次调用耗时 = 固定延迟 + 请求体大小 / 模拟带宽 (+ 请求未指定语言时的语言检测耗时)。
+    """
+
+    def __init__(self, latency_ms=MOCK_ENDPOINT_LATENCY_MS, bandwidth_mbps=MOCK_ENDPOINT_BANDWIDTH_MBPS,
+                 detect_ms=MOCK_ENDPOINT_DETECT_MS, error_rate=0.0, endpoint_name='mock'):
+        self.latency = latency_ms / 1000.0
+        self.bandwidth = bandwidth_mbps * 1000000 / 8
+        self.detect = detect_ms / 1000.0
+        self.error_rate = error_rate
+        self.endpoint_name = endpoint_name
+
+    def predict(self, data, initial_args=None):
+        if self.error_rate and random.random() < self.error_rate:
+            time.sleep(self.latency / 2)
+            raise Exception(f"mock endpoint {self.endpoint_name} failed")
+        language = None
+        if isinstance(data, (bytes, bytearray)):
+            size = len(data)
+            if (initial_args or {}).get('ContentType') == 'application/json':
+                language = json.loads(data).get('language')
+        elif isinstance(data, np.ndarray):
+            size = data.nbytes
+        else:
+            size = sum(v.nbytes if isinstance(v, np.ndarray) else len(json.dumps(v)) for v in data.values())
+            language = data.get('language')
+        delay = self.latency + (size / self.bandwidth if self.bandwidth else 0)
+        time.sleep(delay if language else delay + self.detect)
+        endpoint_warmer.touch(self.endpoint_name)
+        return json.dumps({'text': f"[mock {size} bytes]", 'language': language or 'zh'})
+
+class PayloadSerializer:
+    """已编码的请求体 (bytes) 原样发送, 由调用方通过 initial_args 指定 ContentType; 其余数据按npy序列化
+
+    与 sagemaker.serializers.NumpySerializer 的输出相同 (字典序列化为npy对象数组)。
+    """
+
+    CONTENT_TYPE = 'application/x-npy'
+
+    def serialize(self, data):
+        if isinstance(data, (bytes, bytearray)):
+            return bytes(data)
+        buffer = io.BytesIO()
+        np.save(buffer, data if isinstance(data, np.ndarray) else np.array(data))
+        return buffer.getvalue()
+
+class StringDeserializer:
+    """把响应体解码为字符串"""
+
+    ACCEPT = 'application/json'
+
+    def __init__(self, encoding='utf-8'):
+        self.encoding = encoding
+
+    def deserialize(self, stream, content_type=None):
+        try:
+            return stream.read().decode(self.encoding)
+        finally:
+            stream.close()
+
+class EndpointClient:
+    """直接通过 sagemaker-runtime 的 invoke_endpoint 调用端点, 接口与 sagemaker.Predictor.predict 相同"""
+
+    def __init__(self, endpoint_name, runtime_client, serializer=None, deserializer=None):
+        self.endpoint_name = endpoint_name
+        self.runtime = runtime_client
+        self.serializer = serializer or PayloadSerializer()
+        self.deserializer = deserializer or StringDeserializer()
+
+    def predict(self, data, initial_args=None):
+        request_args = {
+            'EndpointName': self.endpoint_name,
+            'ContentType': self.serializer.CONTENT_TYPE,
+            'Accept': self.deserializer.ACCEPT,
+            'Body': self.serializer.serialize(data)
+        }
+        request_args.update(initial_args or {})
+        response = self.runtime.invoke_endpoint(**request_args)
+        endpoint_warmer.touch(self.endpoint_name)
+        return self.deserializer.deserialize(response['Body'], response.get('ContentType'))
+
+_runtime_clients = {}
+_runtime_client_lock = threading.Lock()
+
+def get_runtime_client(region=None):
+    """进程内共享的 sagemaker-runtime 客户端 (每个区域一个, boto3客户端线程安全), 连接池覆盖所有调度线程"""
+    region = region or region_name
+    with _runtime_client_lock:
+        if region not in _runtime_clients:
+            _runtime_clients[region] = boto3.client('sagemaker-runtime', region_name=region, config=BotoConfig(
+                max_pool_connections=max(10, SEGMENT_WORKERS + QUEUE_WORKERS),
+                retries={'max_attempts': 3, 'mode': 'standard'},
+                # 空闲连接上发送TCP keepalive, 避免被NAT网关或负载均衡静默断开
+                tcp_keepalive=True
+            ))
+        return _runtime_clients[region]
+
+# ---------------------------------------------------------------------------
+# 多端点路由
+# 每个分段按各端点观测到的延迟和错误率 (指数加权平均) 选择端点, 权重越高、越快、越少出错的端点被选中的概率越大;
+# 调用失败时换一个端点重试。带热词的任务可以发送到专用的端点或变体。
+# ---------------------------------------------------------------------------
+
+class EndpointTarget:
+    """路由目标: 一个端点 (或端点的一个生产变体) 及其统计"""
+
+    def __init__(self, name, client, weight=1.0, variant=None, hotwords=False, region=None):
+        self.name = name
+        self.client = client
+        self.weight = weight
+        self.variant = variant
+        self.hotwords = hotwords
+        self.region = region
+        self.label = f"{name}/{variant}" if variant else name
+        self.latency = None
+        self.error_rate = 0.0
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.ejected_until = 0.0
+
+    def predict(self, data, initial_args=None):
+        if not self.variant:
+            return self.client.predict(data, initial_args)
+        response = self.client.predict(data, dict(initial_args or {}, TargetVariant=self.variant))
+        endpoint_warmer.touch(self.label)
+        return response
+
+    def stats(self):
+        return {
+            'endpoint': self.name,
+            'variant': self.variant,
+            'region': self.region,
+            'weight': self.weight,
+            'hotwords': self.hotwords,
+            'ewma_latency_ms': round(self.latency * 1000, 1) if self.latency is not None else None,
+            'error_rate': round(self.error_rate, 4),
+            'in_flight': self.in_flight,
+            'requests': self.requests,
+            'errors': self.errors,
+            'ejected': self.ejected_until > time.time()
+        }
+
+def parse_endpoint_targets(config):
+    """解析 SAGEMAKER_ENDPOINTS
+
+    逗号分隔形式: "whisper-a:3,whisper-b/variant-1:1"
+    JSON形式: [{"name": "whisper-a", "weight": 3, "region": "cn-north-1"},
+               {"name": "whisper-a", "variant": "hotwords", "hotwords": true},
+               {"name": "mock-slow", "mock_latency_ms": 800, "mock_error_rate": 0.1}]
+    名称以 mock 开头的端点使用本地模拟端点。
+    """
+    config = config.strip()
+    if config.startswith('['):
+        entries = json.loads(config)
+    else:
+        entries = []
+        for item in filter(None, (part.strip() for part in config.split(','))):
+            name, _, weight = item.partition(':')
+            name, _, variant = name.partition('/')
+            entries.append({'name': name, 'variant': variant or None, 'weight': float(weight or 1)})
+    targets = []
+    for entry in entries:
+        name = entry['name']
+        weight = float(entry.get('weight', 1))
+        if not weight > 0 or math.isinf(weight):
+            raise ValueError(f"SAGEMAKER_ENDPOINTS: weight of {name} must be a positive number, got {entry.get('weight')}")
+        if name.startswith('mock'):
+            client = MockPredictor(entry.get('mock_latency_ms', MOCK_ENDPOINT_LATENCY_MS),
+                                   error_rate=entry.get('mock_error_rate', 0.0), endpoint_name=name)
+        else:
+            client = EndpointClient(name, get_runtime_client(entry.get('region')))
+        targets.append(EndpointTarget(name, client, weight, entry.get('variant'),
+                                      bool(entry.get('hotwords')), entry.get('region')))
+    if not targets:
+        raise ValueError("SAGEMAKER_ENDPOINTS is empty")
+    return targets
+
+class EndpointRouter:
+    """按延迟和错误率在多个端点之间分配分段"""
+
+    def __init__(self, targets, alpha=ROUTER_EWMA_ALPHA, max_attempts=ROUTER_MAX_ATTEMPTS, name='router'):
+        self.targets = targets
+        self.name = name
+        self.alpha = alpha
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+
+    def for_job(self, hotwords_config=None, duration=None):
+        """带热词的任务优先使用标记为 hotwords 的目标, 其余任务使用未标记的目标 (没有对应目标时使用全部)"""
+        hotwords = bool((hotwords_config or {}).get('words'))
+        pool = [target for target in self.targets if target.hotwords == hotwords] or self.targets
+        return RoutedPredictor(self, pool, 'hotwords' if hotwords and pool is not self.targets else 'default')
+
+    def _score(self, target, default_latency, now):
+        latency = target.latency if target.latency is not None else default_latency
+        score = target.weight / (latency * (1 + target.in_flight)) * (1 - target.error_rate) ** 2
+        return score if target.ejected_until <= now else 0.0
+
+    def choose(self, pool, exclude=()):
+        """按得分加权随机选择目标; 未观测过的端点使用已观测端点的平均延迟"""
+        now = time.time()
+        with self._lock:
+            candidates = [target for target in pool if target not in exclude] or list(pool)
+            observed = [target.latency for target in candidates if target.latency is not None]
+            default_latency = sum(observed) / len(observed) if observed else 1.0
+            scores = [self._score(target, default_latency, now) for target in candidates]
+            if not any(scores):
+                # 所有候选端点都已暂停, 按权重选择 (权重也都为0时均匀选择)
+                scores = [target.weight for target in candidates]
+            target = random.choices(candidates, weights=scores if sum(scores) > 0 else None)[0]
+            target.in_flight += 1
+            return target
+
+    def record(self, target, seconds, error=False):
+        with self._lock:
+            target.in_flight -= 1
+            target.requests += 1
+            if error:
+                target.errors += 1
+            else:
+                target.latency = seconds if target.latency is None else (
+                    self.alpha * seconds + (1 - self.alpha) * target.latency)
+            target.error_rate = self.alpha * (1.0 if error else 0.0) + (1 - self.alpha) * target.error_rate
+            if error and target.error_rate >= ROUTER_EJECT_ERROR_RATE:
+                target.ejected_until = time.time() + ROUTER_COOLDOWN_SECONDS
+                app.logger.warning(f"端点 {target.label} 错误率 {target.error_rate:.2f}, 暂停 {ROUTER_COOLDOWN_SECONDS:.0f} 秒")
+            stats = target.stats()
+        metrics.inc('whisper_endpoint_requests_total', endpoint=target.label, outcome='error' if error else 'ok')
+        metrics.set('whisper_endpoint_error_rate', stats['error_rate'], endpoint=target.label)
+        if stats['ewma_latency_ms'] is not None:
+            metrics.set('whisper_endpoint_latency_ewma_seconds', stats['ewma_latency_ms'] / 1000, endpoint=target.label)
+
+    def stats(self):
+        with self._lock:
+            return [target.stats() for target in self.targets]
+
+class RoutedPredictor:
+    """绑定到一组路由目标的 predictor, 每次 predict 单独选择端点"""
+
+    def __init__(self, router, pool, pool_name):
+        self.router = router
+        self.pool = pool
+        self.endpoint_name = f"{router.name}:{pool_name}"
+
+    def predict(self, data, initial_args=None):
+        tried = []
+        while True:
+            target = self.router.choose(self.pool, exclude=tried)
+            tried.append(target)
+            current_span().set_attributes(target=target.label, attempts=len(tried))
+            started = time.time()
+            try:
+                response = target.predict(data, initial_args)
+            except Exception as e:
+                self.router.record(target, time.time() - started, error=True)
+                if len(tried) >= min(self.router.max_attempts, len(self.pool)) or is_payload_rejection(e):
+                    raise
+                app.logger.warning(f"端点 {target.label} 调用失败, 换一个端点重试: {str(e)}")
+                continue
+            self.router.record(target, time.time() - started)
+            return response
+
+endpoint_router = None
+_endpoint_router_lock = threading.Lock()
+
+def get_endpoint_router():
+    """配置了 SAGEMAKER_ENDPOINTS 时返回进程内共享的路由器, 否则返回None"""
+    global endpoint_router
+    if not SAGEMAKER_ENDPOINTS:
+        return None
+    with _endpoint_router_lock:
+        if endpoint_router is None:
+            endpoint_router = EndpointRouter(parse_endpoint_targets(SAGEMAKER_ENDPOINTS))
+            app.logger.info(f"多端点路由: {[target.label for target in endpoint_router.targets]}")
+        return endpoint_router
+
+# ---------------------------------------------------------------------------
+# 本地CPU推理后端
+# 短音频的网络往返和端点排队比推理本身还慢, 本地用量化的Whisper模型 (faster-whisper / CTranslate2) 直接转录;
+# 也可以在没有AWS环境时开发和测试。predict_audio 对提供 transcribe 方法的后端直接传入PCM, 不做请求体编码。
+# ---------------------------------------------------------------------------
+
+class LocalWhisperPredictor:
+    """本地CPU推理后端, 首次转录时加载模型 (需要安装 faster-whisper)
+
+    支持与端点相同的字段: language、initial_prompt (热词和滚动上下文),
+    logit_bias 的热词作为 faster-whisper 的 hotwords 提示。返回与端点相同格式的JSON。
+    """
+
+    local = True
+
+    def __init__(self, model=LOCAL_MODEL, compute_type=LOCAL_COMPUTE_TYPE, cpu_threads=LOCAL_CPU_THREADS,
+                 concurrency=LOCAL_CONCURRENCY, beam_size=LOCAL_BEAM_SIZE):
+        self.model_name = model
+        self.compute_type = compute_type
+        self.cpu_threads = cpu_threads
+        self.concurrency = concurrency
+        self.beam_size = beam_size
+        self.endpoint_name = f"local:{model}"
+        self._model = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(concurrency)
+
+    def load(self):
+        with self._lock:
+            if self._model is None:
+                from faster_whisper import WhisperModel
+                started = time.time()
+                self._model = WhisperModel(self.model_name, device='cpu', compute_type=self.compute_type,
+                                           cpu_threads=self.cpu_threads, num_workers=self.concurrency)
+                app.logger.info(f"本地模型 {self.model_name} ({self.compute_type}) 加载耗时 {time.time() - started:.1f}s")
+            return self._model
+
+    def transcribe(self, pcm, fields=None):
+        fields = fields or {}
+        options = {
+            'beam_size': self.beam_size,
+            'language': fields.get('language'),
+            'initial_prompt': fields.get('initial_prompt'),
+            # 分段之间的上下文由 initial_prompt 携带
+            'condition_on_previous_text': False,
+            'word_timestamps': True
+        }
+        if fields.get('logit_bias'):
+            options['hotwords'] = ' '.join(fields['logit_bias'])
+        model = self.load()
+        with self._slots:
+            segments, info = model.transcribe(pcm.astype(np.float32) / 32768.0, **options)
+            segments = list(segments)
+        endpoint_warmer.touch(self.endpoint_name)
+        return json.dumps({
+            'text': ''.join(segment.text for segment in segments).strip(),
+            'language': info.language,
+            'words': [{'word': word.word, 'start': word.start, 'end': word.end}
+                      for segment in segments for word in (segment.words or [])]
+        }, ensure_ascii=False)
+
+    def predict(self, data, initial_args=None):
+        """兼容端点接口: 接受 float16 音频数组或带 audio 字段的字典"""
+        fields = dict(data) if isinstance(data, dict) else {}
+        audio = fields.pop('audio', data)
+        return self.transcribe((np.asarray(audio, dtype=np.float32) * 32768.0).astype(np.int16), fields)
+
+class BackendRouter:
+    """按音频时长选择推理后端: 不超过 local_max_seconds 的音频本地推理, 其余调用端点
+
+    时长未知 (如快速首段在解码完成之前) 时使用端点。
+    """
+
+    def __init__(self, local, remote, local_max_seconds=LOCAL_MAX_SECONDS):
+        self.local = local
+        self.remote = remote
+        self.local_max_seconds = local_max_seconds
+        self.endpoint_name = getattr(remote, 'endpoint_name', ENDPOINT_NAME)
+
+    def for_job(self, hotwords_config=None, duration=None):
+        if duration is not None and duration <= self.local_max_seconds:
+            return self.local
+        return select_predictor(self.remote, hotwords_config)
+
+    def predict(self, data, initial_args=None):
+        return self.remote.predict(data, initial_args)
+
+_local_predictor = None
+_local_predictor_lock = threading.Lock()
+
+def get_local_predictor():
+    """进程内共享的本地推理后端 (模型只加载一次)"""
+    global _local_predictor
+    with _local_predictor_lock:
+        if _local_predictor is None:
+            _local_predictor = LocalWhisperPredictor()
+        return _local_predictor
+
+def select_predictor(predictor, hotwords_config=None, duration=None):
+    """路由器按任务的热词配置和音频时长选择目标, 普通 predictor 原样返回"""
+    for_job = getattr(predictor, 'for_job', None)
+    return for_job(hotwords_config, duration) if for_job else predictor
+
+def select_tier(predictor, duration=None, quality=None, capacity=None):
+    """分级路由时按时长、请求的质量和积压选择模型档位 (ModelTier), 否则返回None"""
+    choose_tier = getattr(predictor, 'choose_tier', None)
+    return choose_tier(duration, quality, capacity) if choose_tier else None
+
+# 初始化推理后端
 def get_predictor():
+    if MODEL_TIERS:
+        try:
+            return get_model_tier_router()
+        except Exception as e:
+            app.logger.error(f"Error creating model tier router: {str(e)}")
+            return None
+    if INFERENCE_BACKEND == 'local':
+        return get_local_predictor()
+    remote = get_endpoint_predictor()
+    if INFERENCE_BACKEND == 'auto' and remote:
+        return BackendRouter(get_local_predictor(), remote)
+    return remote
+
+# 初始化 SageMaker Predictor
+def get_endpoint_predictor():
     try:
-        # 确保使用正确的区域名称
-        boto_session = boto3.Session(region_name=region_name)
-        sagemaker_session = sagemaker.session.Session(boto_session=boto_session)
-        
-        app.logger.info(f"Initializing SageMaker predictor with endpoint: {ENDPOINT_NAME} in region: {region_name}")
-        
-        predictor = sagemaker.Predictor(
-            endpoint_name=ENDPOINT_NAME,
-            serializer=NumpySerializer(),
-            deserializer=StringDeserializer("utf-8"),
-            sagemaker_session=sagemaker_session
-        )
-        return predictor
+        router = get_endpoint_router()
+        if router:
+            return router
+    except Exception as e:
+        app.logger.error(f"Error creating endpoint router: {str(e)}")
+        return None
+    if ENDPOINT_NAME == 'mock':
+        return MockPredictor()
+    try:
+        app.logger.info(f"Initializing SageMaker endpoint client: {ENDPOINT_NAME} in region: {region_name}")
+        return EndpointClient(ENDPOINT_NAME, get_runtime_client())
     except Exception as e:
         app.logger.error(f"Error creating predictor: {str(e)}")
         # 记录更多调试信息
@@ -63,6 +664,475 @@ def get_predictor():
         app.logger.error(f"Endpoint name: {ENDPOINT_NAME}")
         return None
 
+# ---------------------------------------------------------------------------
+# 模型分级路由
+# 几秒的语音备忘录和几小时的庭审录音原本都由同一个模型转录。配置 MODEL_TIERS 后按音频时长、请求的质量
+# 和各档位当前的积压为每个任务选择模型档位 (如小模型端点、大模型端点或本地模型), 积压过多时降级到更快的档位。
+# ---------------------------------------------------------------------------
+
+# 与档位名称无关的质量参数: fast 为最快的档位, accurate 为最准的档位
+QUALITY_LEVELS = ('fast', 'accurate')
+
+class ModelTier:
+    """一个模型档位"""
+
+    def __init__(self, name, predictor, max_backlog_seconds=MODEL_TIER_MAX_BACKLOG_SECONDS):
+        self.name = name
+        self.predictor = predictor
+        self.max_backlog_seconds = max_backlog_seconds
+        # 积压按 CapacityTracker 中的端点名称统计: 路由器每个目标池一个名称, 其他 predictor 使用 endpoint_name
+        if isinstance(predictor, EndpointRouter):
+            self.labels = {f"{predictor.name}:default", f"{predictor.name}:hotwords"}
+        else:
+            self.labels = {getattr(predictor, 'endpoint_name', name)}
+
+    def backlog_seconds(self, snapshot):
+        """本副本上该档位等待中和调用中的音频秒数"""
+        return sum(values['backlog_audio_seconds'] for label, values in snapshot.items() if label in self.labels)
+
+def parse_model_tiers(config):
+    """解析 MODEL_TIERS, 档位从快到准排列
+
+    逗号分隔形式: "fast=whisper-small,accurate=whisper-large" (local:模型名 表示本地模型)
+    JSON形式: [{"tier": "fast", "local_model": "base"},
+               {"tier": "standard", "endpoints": "whisper-turbo-a:2,whisper-turbo-b"},
+               {"tier": "accurate", "endpoints": [{"name": "whisper-large-v3"}], "max_backlog_seconds": 600}]
+    endpoints 与 SAGEMAKER_ENDPOINTS 格式相同 (字符串或列表), 每个档位使用单独的路由器。
+    """
+    config = config.strip()
+    if config.startswith('['):
+        entries = json.loads(config)
+    else:
+        entries = []
+        for item in filter(None, (part.strip() for part in config.split(','))):
+            name, _, backend = item.partition('=')
+            if backend.startswith('local:'):
+                entries.append({'tier': name, 'local_model': backend[len('local:'):]})
+            else:
+                entries.append({'tier': name, 'endpoints': backend})
+    tiers = []
+    for entry in entries:
+        name = entry['tier']
+        if entry.get('local_model'):
+            model = entry['local_model']
+            predictor = get_local_predictor() if model == LOCAL_MODEL else LocalWhisperPredictor(model=model)
+        else:
+            endpoints = entry['endpoints']
+            targets = parse_endpoint_targets(endpoints if isinstance(endpoints, str) else json.dumps(endpoints))
+            predictor = EndpointRouter(targets, name=name)
+        tiers.append(ModelTier(name, predictor,
+                               float(entry.get('max_backlog_seconds', MODEL_TIER_MAX_BACKLOG_SECONDS))))
+    if not tiers:
+        raise ValueError("MODEL_TIERS is empty")
+    if len({tier.name for tier in tiers}) != len(tiers):
+        raise ValueError("MODEL_TIERS contains duplicate tier names")
+    return tiers
+
+class ModelTierRouter:
+    """按音频时长、请求的质量和积压为任务选择模型档位
+
+    quality 为 fast、accurate、档位名称, 或 None (自动: 不超过 short_seconds 的音频使用最快的档位, 其余使用默认档位)。
+    选中的档位积压达到其上限时依次降级到更快的档位, 最快的档位不再降级。
+    """
+
+    def __init__(self, tiers, default=MODEL_TIER_DEFAULT, short_seconds=MODEL_TIER_SHORT_SECONDS):
+        self.tiers = tiers
+        self.short_seconds = short_seconds
+        self.endpoint_name = 'tiers'
+        self.default = self.index(default) if default else len(tiers) // 2
+        self._decisions = Counter()
+        self._lock = threading.Lock()
+
+    def index(self, name):
+        for i, tier in enumerate(self.tiers):
+            if tier.name == name:
+                return i
+        raise ValueError(f"unknown model tier: {name}")
+
+    def tier(self, name):
+        return self.tiers[self.index(name)]
+
+    def resolve(self, quality):
+        """质量参数对应的档位序号"""
+        if quality in QUALITY_LEVELS and quality not in {tier.name for tier in self.tiers}:
+            return 0 if quality == 'fast' else len(self.tiers) - 1
+        return self.index(quality)
+
+    def choose_tier(self, duration=None, quality=None, capacity=None):
+        """为任务选择档位并记录决策, 返回 ModelTier"""
+        if quality:
+            index, reason = self.resolve(quality), 'requested'
+        elif duration is not None and duration <= self.short_seconds:
+            index, reason = 0, 'short'
+        else:
+            index, reason = self.default, 'default'
+        snapshot = (capacity or capacity_tracker).snapshot()
+        chosen = index
+        while chosen > 0 and self.tiers[chosen].backlog_seconds(snapshot) >= self.tiers[chosen].max_backlog_seconds:
+            chosen -= 1
+        tier = self.tiers[chosen]
+        if chosen != index:
+            requested = self.tiers[index]
+            app.logger.info(f"档位 {requested.name} 积压 {requested.backlog_seconds(snapshot):.0f}s, 降级到 {tier.name}")
+            reason = 'backlog'
+        metrics.inc('whisper_model_tier_jobs_total', tier=tier.name, quality=quality or 'auto', reason=reason)
+        if duration:
+            metrics.inc('whisper_model_tier_audio_seconds_total', round(duration, 3), tier=tier.name)
+        with self._lock:
+            self._decisions[(tier.name, reason)] += 1
+        return tier
+
+    def for_job(self, hotwords_config=None, duration=None):
+        """还没有选择档位时 (快速首段在解码完成之前) 使用最快的档位"""
+        return select_predictor(self.tiers[0].predictor, hotwords_config, duration)
+
+    def predict(self, data, initial_args=None):
+        return select_predictor(self.tiers[self.default].predictor).predict(data, initial_args)
+
+    def stats(self):
+        snapshot = capacity_tracker.snapshot()
+        with self._lock:
+            decisions = dict(self._decisions)
+        return [{
+            'tier': tier.name,
+            'default': i == self.default,
+            'backends': sorted(tier.labels),
+            'backlog_audio_seconds': round(tier.backlog_seconds(snapshot), 3),
+            'max_backlog_seconds': tier.max_backlog_seconds,
+            'jobs': {reason: count for (name, reason), count in decisions.items() if name == tier.name}
+        } for i, tier in enumerate(self.tiers)]
+
+model_tier_router = None
+_model_tier_router_lock = threading.Lock()
+
+def get_model_tier_router():
+    """配置了 MODEL_TIERS 时返回进程内共享的分级路由器, 否则返回None"""
+    global model_tier_router
+    if not MODEL_TIERS:
+        return None
+    with _model_tier_router_lock:
+        if model_tier_router is None:
+            model_tier_router = ModelTierRouter(parse_model_tiers(MODEL_TIERS))
+            app.logger.info(f"模型分级路由: {[tier.name for tier in model_tier_router.tiers]}, "
+                            f"默认 {model_tier_router.tiers[model_tier_router.default].name}")
+        return model_tier_router
+
+# ---------------------------------------------------------------------------
+# 端点预热
+# 一段时间没有请求后, 第一次调用要等待新建HTTPS连接, 推理容器也可能要先加载模型。
+# 启动时 (以及端点空闲超过 WARMUP_IDLE_SECONDS 后) 发送一小段合成音频预热, 并统计每个任务第一次端点调用
+# 在冷/热状态下的延迟, 用于权衡预热间隔和调用成本。
+# ---------------------------------------------------------------------------
+
+def warmup_targets(predictor):
+    """predictor 背后实际的端点 [(名称, 可传给 predict_audio 的对象)], 预热和冷热判断都以此为单位
+
+    异步推理端点 (按队列扩缩容) 不预热; 分布式模式下端点调用由队列工作线程执行, 预热本副本的 predictor。
+    """
+    if predictor is None or isinstance(predictor, AsyncEndpointClient):
+        return []
+    if isinstance(predictor, EndpointRouter):
+        return [(target.label, target) for target in predictor.targets]
+    if isinstance(predictor, RoutedPredictor):
+        return [(target.label, target) for target in predictor.pool]
+    if isinstance(predictor, BackendRouter):
+        return warmup_targets(predictor.local) + warmup_targets(predictor.remote)
+    if isinstance(predictor, ModelTierRouter):
+        return [target for tier in predictor.tiers for target in warmup_targets(tier.predictor)]
+    label = getattr(predictor, 'label', None) or getattr(predictor, 'endpoint_name', ENDPOINT_NAME)
+    return [(label, predictor)]
+
+def warmup_audio(seconds=WARMUP_AUDIO_SECONDS):
+    """低电平的正弦波加噪声 (不是纯静音, 避免被推理代码提前跳过), 返回int16 PCM"""
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    rng = np.random.default_rng(0)
+    signal = 0.05 * np.sin(2 * np.pi * 220 * t) + 0.005 * rng.standard_normal(len(t))
+    return (signal * 32767).astype(np.int16)
+
+class EndpointWarmer:
+    """记录每个端点最近一次成功调用的时间, 预热空闲的端点, 统计任务第一次调用的冷/热延迟"""
+
+    def __init__(self, predictor_factory=None, idle_seconds=WARMUP_IDLE_SECONDS, cold_seconds=WARMUP_COLD_SECONDS,
+                 connections=WARMUP_CONNECTIONS, max_samples=200):
+        self.predictor_factory = predictor_factory or get_predictor
+        self.idle_seconds = idle_seconds
+        self.cold_seconds = cold_seconds
+        self.connections = max(1, connections)
+        self._last_activity = {}
+        self._warmups = {}
+        self._first_calls = {}
+        self._samples = deque(maxlen=max_samples)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._started = False
+
+    def touch(self, label):
+        """端点调用成功后调用"""
+        self._last_activity[label] = time.time()
+
+    def idle_for(self, predictor):
+        """predictor 背后最近使用过的端点已空闲的秒数; 从未调用过时返回 inf, 无法判断 (如异步端点) 时返回 None"""
+        labels = [label for label, _ in warmup_targets(predictor)]
+        if not labels:
+            return None
+        last = max((self._last_activity.get(label, 0) for label in labels), default=0)
+        return time.time() - last if last else float('inf')
+
+    def record_first_call(self, endpoint, idle, seconds):
+        """记录一个任务第一次端点调用的延迟; idle 为调用前端点已空闲的秒数"""
+        state = 'cold' if idle >= self.cold_seconds else 'warm'
+        metrics.inc('whisper_first_call_seconds_sum', round(seconds, 3), endpoint=endpoint, state=state)
+        metrics.inc('whisper_first_call_seconds_count', endpoint=endpoint, state=state)
+        with self._lock:
+            stats = self._first_calls.setdefault(endpoint, {'warm': [0, 0.0], 'cold': [0, 0.0]})
+            stats[state][0] += 1
+            stats[state][1] += seconds
+            self._samples.append({'endpoint': endpoint, 'at': round(time.time(), 3), 'state': state,
+                                  'idle_seconds': None if idle == float('inf') else round(idle, 1),
+                                  'latency_seconds': round(seconds, 3)})
+
+    def warm(self, label, target, reason):
+        """向一个端点同时发送 connections 个预热请求 (本地模型只发送一个), 返回最长的延迟"""
+        pcm = warmup_audio()
+        count = 1 if getattr(target, 'local', False) else self.connections
+        
+        def call(_):
+            started = time.time()
+            predict_audio(target, pcm, fields=language_fields(DEFAULT_LANGUAGE or 'en'))
+            return time.time() - started
+        
+        try:
+            with ThreadPoolExecutor(max_workers=count, thread_name_prefix='warmup') as executor:
+                latency = max(executor.map(call, range(count)))
+        except Exception as e:
+            app.logger.warning(f"预热端点 {label} 失败: {str(e)}")
+            metrics.inc('whisper_warmup_requests_total', endpoint=label, reason=reason, outcome='error')
+            return None
+        self.touch(label)
+        metrics.inc('whisper_warmup_requests_total', endpoint=label, reason=reason, outcome='ok')
+        metrics.set('whisper_warmup_latency_seconds', round(latency, 3), endpoint=label)
+        with self._lock:
+            self._warmups[label] = {'at': round(time.time(), 3), 'reason': reason, 'latency_seconds': round(latency, 3)}
+        app.logger.info(f"预热端点 {label} ({reason}): {latency * 1000:.0f} ms")
+        return latency
+
+    def start(self, on_startup=WARMUP_ON_STARTUP):
+        """启动预热线程, 重复调用时只启动一次"""
+        if self._started or (not on_startup and self.idle_seconds <= 0):
+            return
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread(target=self._loop, args=(on_startup,), name='endpoint-warmer', daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self, on_startup):
+        try:
+            targets = warmup_targets(self.predictor_factory())
+        except Exception as e:
+            app.logger.error(f"预热: 创建predictor失败: {str(e)}")
+            return
+        if on_startup:
+            for label, target in targets:
+                self.warm(label, target, 'startup')
+        if self.idle_seconds <= 0:
+            return
+        # 检查间隔为空闲阈值的四分之一, 端点最多比阈值多空闲这么久
+        while not self._stop.wait(max(1.0, min(self.idle_seconds / 4, 60.0))):
+            now = time.time()
+            for label, target in targets:
+                if now - self._last_activity.get(label, 0) >= self.idle_seconds:
+                    self.warm(label, target, 'idle')
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            first_calls = {endpoint: {state: {'count': count, 'mean_seconds': round(total / count, 3) if count else None}
+                                      for state, (count, total) in states.items()}
+                           for endpoint, states in self._first_calls.items()}
+            return {
+                'idle_seconds': self.idle_seconds,
+                'cold_seconds': self.cold_seconds,
+                'connections': self.connections,
+                'last_activity_age_seconds': {label: round(now - at, 1) for label, at in self._last_activity.items()},
+                'warmups': dict(self._warmups),
+                'first_calls': first_calls,
+                'recent_first_calls': list(self._samples)
+            }
+
+# ---------------------------------------------------------------------------
+# 服务端会话
+# cookie 中只保存签名后的会话ID, 会话内容 (临时文件、热词配置等) 保存在服务端,
+# 使用共享存储 (redis) 时任意副本都可以处理任意会话的请求。
+# ---------------------------------------------------------------------------
+
+class MemorySessionBackend:
+    """进程内的会话存储 (单副本开发和测试用)"""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, sid):
+        with self._lock:
+            item = self._data.get(sid)
+        if not item or item[1] < time.time():
+            return None
+        return json.loads(item[0])
+
+    def save(self, sid, data, ttl):
+        now = time.time()
+        with self._lock:
+            self._data[sid] = (json.dumps(data, ensure_ascii=False), now + ttl)
+            if len(self._data) % 100 == 0:
+                self._data = {k: v for k, v in self._data.items() if v[1] >= now}
+
+    def delete(self, sid):
+        with self._lock:
+            self._data.pop(sid, None)
+
+class SQLiteSessionBackend:
+    """基于SQLite的会话存储, 重启后会话仍然有效"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._saves = 0
+        self._conn().execute("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                sid TEXT PRIMARY KEY,
+                data TEXT,
+                expires REAL
+            )
+        """)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, sid):
+        row = self._conn().execute('SELECT data FROM sessions WHERE sid = ? AND expires >= ?',
+                                   (sid, time.time())).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, sid, data, ttl):
+        now = time.time()
+        with self._conn() as conn:
+            conn.execute('INSERT OR REPLACE INTO sessions (sid, data, expires) VALUES (?, ?, ?)',
+                         (sid, json.dumps(data, ensure_ascii=False), now + ttl))
+            self._saves += 1
+            if self._saves % 100 == 0:
+                conn.execute('DELETE FROM sessions WHERE expires < ?', (now,))
+
+    def delete(self, sid):
+        with self._conn() as conn:
+            conn.execute('DELETE FROM sessions WHERE sid = ?', (sid,))
+
+class RedisSessionBackend:
+    """基于Redis的会话存储, 多副本共享"""
+
+    def __init__(self, url, prefix='whisper:session:'):
+        import redis
+        self.redis = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, sid):
+        data = self.redis.get(self.prefix + sid)
+        return json.loads(data) if data else None
+
+    def save(self, sid, data, ttl):
+        self.redis.setex(self.prefix + sid, ttl, json.dumps(data, ensure_ascii=False))
+
+    def delete(self, sid):
+        self.redis.delete(self.prefix + sid)
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """服务端会话, 内容修改时标记 modified"""
+
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.previous_sid = None
+
+    def regenerate(self):
+        """更换会话ID (登录成功时), 防止会话固定; 旧ID的服务端记录在保存会话时删除"""
+        if not self.new:
+            self.previous_sid = self.sid
+        self.sid = secrets.token_urlsafe(16)
+        self.modified = True
+
+class ServerSideSessionInterface(SessionInterface):
+    """cookie 中保存签名的会话ID (约40字节), 会话内容保存在 backend 中"""
+
+    def __init__(self, backend, lifetime=SESSION_LIFETIME_SECONDS):
+        self.backend = backend
+        self.lifetime = lifetime
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt='whisper-session')
+
+    def open_session(self, app, request):
+        cookie = request.cookies.get(app.config['SESSION_COOKIE_NAME'])
+        if cookie:
+            try:
+                sid = self._signer(app).unsign(cookie).decode('ascii')
+            except BadSignature:
+                sid = None
+            if sid:
+                try:
+                    data = self.backend.get(sid)
+                except Exception as e:
+                    app.logger.error(f"读取会话失败: {str(e)}")
+                    data = None
+                if data is not None:
+                    return ServerSideSession(data, sid=sid)
+        return ServerSideSession(sid=secrets.token_urlsafe(16), new=True)
+
+    def save_session(self, app, session, response):
+        name = app.config['SESSION_COOKIE_NAME']
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.previous_sid:
+            self.backend.delete(session.previous_sid)
+            session.previous_sid = None
+        if not session:
+            if session.modified:
+                self.backend.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+        if not session.modified:
+            return
+        self.backend.save(session.sid, dict(session), self.lifetime)
+        response.set_cookie(
+            name, self._signer(app).sign(session.sid).decode('ascii'),
+            max_age=self.lifetime,
+            httponly=self.get_cookie_httponly(app),
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+            domain=domain, path=path
+        )
+
+SESSION_BACKENDS = {
+    'memory': lambda: MemorySessionBackend(),
+    'sqlite': lambda: SQLiteSessionBackend(SESSION_STORE_PATH),
+    'redis': lambda: RedisSessionBackend(REDIS_URL),
+}
+
+if SESSION_STORE != 'cookie':
+    app.session_interface = ServerSideSessionInterface(SESSION_BACKENDS[SESSION_STORE]())
+    app.logger.info(f"会话存储: {SESSION_STORE}")
+
 def get_credentials():
     """Retrieve credentials from AWS Secrets Manager"""
     try:
@@ -92,6 +1162,89 @@ def process_hotwords_config(request):
         app.logger.error(f"处理热词配置时出错: {str(e)}")
         return {'method': 'prompt_injection', 'words': [], 'boost_factor': 1.5}
 
+def resolve_hotwords_config(request):
+    """请求中带有热词字段时使用请求中的配置, 否则使用 /api/hotwords 保存在会话中的配置"""
+    if 'hotwords' in request.form:
+        return process_hotwords_config(request)
+    return session.get('hotwords_config', DEFAULT_HOTWORDS_CONFIG)
+
+def parse_time_value(value):
+    """解析时间点, 支持秒数 (90 / 90.5) 或 [HH:]MM:SS[.mmm] 格式, 返回秒数"""
+    value = str(value).strip()
+    parts = value.split(':')
+    if len(parts) > 3:
+        raise ValueError(f"Invalid time value: {value}")
+    seconds = 0.0
+    for part in parts:
+        seconds = seconds * 60 + float(part)
+    if seconds < 0:
+        raise ValueError(f"Invalid time value: {value}")
+    return seconds
+
+def parse_time_ranges(params):
+    """从请求参数中解析转录时间范围, 返回按起点排序并合并重叠后的 [(start, end)] 列表
+
+    支持 start/end 两个参数 (end 可省略表示到结尾), 或 ranges 参数指定多个范围,
+    例如 "40:00-55:00,1:10:00-1:12:30" 或 JSON 数组 [[2400, 3300], [4200, null]]。
+    未指定时返回 None 表示转录整个文件。
+    """
+    ranges_param = (params.get('ranges') or '').strip()
+    start_param = (params.get('start') or '').strip()
+    end_param = (params.get('end') or '').strip()
+    
+    ranges = []
+    if ranges_param:
+        if ranges_param.startswith('['):
+            for item in json.loads(ranges_param):
+                start, end = item
+                ranges.append((float(start or 0), float(end) if end is not None else None))
+        else:
+            for item in ranges_param.split(','):
+                start, _, end = item.strip().partition('-')
+                ranges.append((parse_time_value(start or 0), parse_time_value(end) if end.strip() else None))
+    elif start_param or end_param:
+        ranges.append((parse_time_value(start_param or 0), parse_time_value(end_param) if end_param else None))
+    else:
+        return None
+    
+    merged = []
+    for start, end in sorted(ranges, key=lambda r: r[0]):
+        if end is not None and end <= start:
+            raise ValueError(f"Invalid time range: end ({end}) must be greater than start ({start})")
+        if merged and (merged[-1][1] is None or start <= merged[-1][1]):
+            last_start, last_end = merged[-1]
+            merged[-1] = (last_start, None if last_end is None or end is None else max(last_end, end))
+        else:
+            merged.append((start, end))
+    return merged
+
+def parse_bool_param(value, default=False):
+    """解析表单/查询参数中的布尔值"""
+    if value is None:
+        return default
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'on')
+
+LANGUAGE_CODE_PATTERN = re.compile(r'^[a-z]{2,3}$')
+
+def parse_language_param(value):
+    """解析语言参数 (Whisper语言代码, 如 zh、en), 空值或 auto 表示自动检测, 返回None"""
+    value = (value or '').strip().lower()
+    if not value or value == 'auto':
+        return None
+    if not LANGUAGE_CODE_PATTERN.match(value):
+        raise ValueError(f"invalid language code: {value}")
+    return value
+
+def parse_quality_param(value):
+    """解析质量参数 (fast、accurate 或 MODEL_TIERS 中的档位名称), 空值或 auto 表示按时长自动选择, 返回None"""
+    value = (value or '').strip()
+    if not value or value.lower() == 'auto':
+        return None
+    router = get_model_tier_router()
+    if value not in QUALITY_LEVELS and not (router and value in {tier.name for tier in router.tiers}):
+        raise ValueError(f"unknown quality level: {value}")
+    return value
+
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -100,6 +1253,19 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def admin_required(f):
+    """只允许 ADMIN_USERS 中的用户访问; 未配置管理员时接口不存在"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not ADMIN_USERS:
+            return jsonify({'error': 'Admin endpoints are disabled'}), 404
+        if 'logged_in' not in session:
+            return redirect(url_for('login'))
+        if session.get('username') not in ADMIN_USERS:
+            return jsonify({'error': 'Admin privileges required'}), 403
+        return f(*args, **kwargs)
+    return decorated_function
+
 @app.route('/')
 @login_required
 def index():
@@ -117,6 +1283,11 @@ def login():
             return render_template('login.html')
             
         if username in credentials and credentials[username] == password:
+            # 丢弃登录前的会话内容并更换会话ID, 登录前获得 (或被植入) 的会话ID不能用于登录后的会话
+            session.clear()
+            regenerate = getattr(session, 'regenerate', None)
+            if regenerate:
+                regenerate()
             session['logged_in'] = True
             session['username'] = username
             return redirect(url_for('index'))
@@ -147,18 +1318,45 @@ def transcribe():
         flash('No file selected', 'danger')
         return redirect(url_for('index'))
         
-    # 修改此处以支持M4A格式
-    supported_formats = ['.mp3', '.m4a']
     file_ext = os.path.splitext(file.filename.lower())[1]
     
-    if file and file_ext in supported_formats:
+    if file and file_ext in SUPPORTED_FORMATS:
         # 确定文件格式
         format_name = file_ext[1:]  # 去掉点号
         
-        # Save file to temp location
-        with tempfile.NamedTemporaryFile(delete=False, suffix=file_ext) as temp:
+        # 任务的trace从上传开始, /stream 请求在同一条trace下继续
+        span = tracer.start_trace('http.transcribe', format=format_name, owner=trace_owner(session.get('username')))
+        
+        # Save file to temp location (分布式模式下保存到共享目录, 任意副本都可以处理 /stream)
+        with span.child('upload.save') as save_span, \
+                tempfile.NamedTemporaryFile(delete=False, suffix=file_ext, dir=SPOOL_DIR if work_broker else None) as temp:
             file.save(temp.name)
             temp_filename = temp.name
+            save_span.set_attribute('upload_bytes', os.path.getsize(temp_filename))
+            
+        # 解析转录时间范围
+        try:
+            time_ranges = parse_time_ranges(request.form)
+        except (ValueError, TypeError) as e:
+            os.unlink(temp_filename)
+            span.end(e)
+            flash(f'Invalid time range: {str(e)}', 'danger')
+            return redirect(url_for('index'))
+            
+        try:
+            language = parse_language_param(request.form.get('language', DEFAULT_LANGUAGE))
+        except ValueError as e:
+            os.unlink(temp_filename)
+            span.end(e)
+            flash(f'Invalid language: {str(e)}', 'danger')
+            return redirect(url_for('index'))
+        try:
+            quality = parse_quality_param(request.form.get('quality'))
+        except ValueError as e:
+            os.unlink(temp_filename)
+            span.end(e)
+            flash(f'Invalid quality: {str(e)}', 'danger')
+            return redirect(url_for('index'))
             
         # 处理热词配置
         hotwords_config = process_hotwords_config(request)
@@ -167,6 +1365,25 @@ def transcribe():
         session['temp_filename'] = temp_filename
         session['file_format'] = format_name
         session['hotwords_config'] = hotwords_config
+        session['rolling_context'] = parse_bool_param(request.form.get('rolling_context'))
+        session['fast_start'] = parse_bool_param(request.form.get('fast_start'))
+        session['language'] = language
+        session['quality'] = quality
+        session['time_ranges'] = time_ranges
+        session['original_filename'] = secure_filename(file.filename) or file.filename
+        session['uploaded_at'] = time.time()
+        with span.child('upload.hash'):
+            session['job_id'] = compute_job_id(temp_filename, {
+                'hotwords_config': hotwords_config,
+                'rolling_context': session['rolling_context'],
+                'language': language,
+                'quality': quality,
+                'ranges': time_ranges,
+                'username': session.get('username')
+            })
+        span.set_attribute('job_id', session['job_id'])
+        span.end()
+        session['trace'] = span.context()
         
         # 明确保存会话 - 确保会话状态被持久化
         session.modified = True
@@ -179,7 +1396,7 @@ def transcribe():
         return render_template('transcribe.html')
         
     else:
-        flash('Invalid file format. Please upload MP3 or M4A files.', 'danger')
+        flash(f"Invalid file format. Supported formats: {', '.join(SUPPORTED_FORMATS)}", 'danger')
         return redirect(url_for('index'))
 
 @app.route('/stream', methods=['GET'])
@@ -195,216 +1412,2911 @@ def stream():
         app.logger.error("会话中没有找到临时文件名")
         return jsonify({"error": "No file to process"}), 400
         
-    # 检查文件是否存在
-    if not os.path.exists(temp_filename):
+    # 检查文件是否存在 (已完成的任务可以直接从存储返回, 不需要临时文件)
+    job_id = session.get('job_id')
+    job = transcript_store.get(job_id) if transcript_store and job_id else None
+    if not os.path.exists(temp_filename) and not (job and job['status'] == 'complete'):
         app.logger.error(f"临时文件不存在: {temp_filename}")
         return jsonify({"error": "Temporary file not found"}), 400
         
     app.logger.info(f"开始处理临时文件: {temp_filename}")
     
+    # 在请求上下文中读取转录选项，生成器内部不再依赖会话
+    options = {
+        'hotwords_config': session.get('hotwords_config', DEFAULT_HOTWORDS_CONFIG),
+        'rolling_context': session.get('rolling_context', False),
+        'fast_start': session.get('fast_start', False),
+        'language': session.get('language'),
+        'quality': session.get('quality'),
+        'ranges': session.get('time_ranges'),
+        'job_id': job_id,
+        'filename': session.get('original_filename'),
+        'username': session.get('username'),
+        'entry': 'stream',
+        'arrived_at': session.get('uploaded_at'),
+        'trace': tracer.resume(session.get('trace'), 'http.stream', job_id=job_id)
+    }
+    
     return Response(
-        stream_with_context(process_audio(temp_filename)),
+        stream_with_context(process_audio(temp_filename, options)),
         mimetype='text/event-stream'
     )
 
-def process_audio(file_path):
-    """Process audio file in chunks and stream results"""
+def sse_event(data):
+    """格式化为SSE (Server-Sent Events) 消息"""
+    return "data: " + json.dumps(data) + "\n\n"
+
+def process_audio(file_path, options=None):
+    """Process audio file in chunks and stream results
+
+    每个事件的推送记录为一个 sse.emit span, 包含服务器写出该事件 (客户端接收) 的时间。
+    """
+    options = options or {}
+    span = options.get('trace') or NOOP_SPAN
+    profile = request_profiler.begin('process_audio')
     try:
-        # 获取 predictor 实例
-        predictor = get_predictor()
-        if not predictor:
-            raise Exception("Failed to create SageMaker predictor")
-            
-        # 获取热词配置
-        hotwords_config = session.get('hotwords_config', {'method': 'prompt_injection', 'words': [], 'boost_factor': 1.5})
-        app.logger.info(f"使用热词配置: {hotwords_config}")
-        
-        # 确定文件格式 - 从会话中获取或从文件路径推断
-        file_format = session.get('file_format', 'mp3')
-        app.logger.info(f"加载音频文件，格式: {file_format}")
-        
-        # Load audio file with appropriate format
-        audio_full = AudioSegment.from_file(file_path, format=file_format)
-        
-        # Whisper expects 16 kHz, mono channel, ≤30s
-        audio_full = audio_full.set_channels(1).set_frame_rate(16000)
-        
-        # Set chunk size to 30 seconds (in milliseconds)
-        chunk_ms = 30000
-        segments = list(range(0, len(audio_full), chunk_ms))
-        total_segments = len(segments)
-        
-        # 初始页面设置 - 使用SSE (Server-Sent Events)格式
-        yield "data: " + json.dumps({
-            "type": "init",
-            "total_segments": total_segments,
-            "hotwords_config": hotwords_config
-        }) + "\n\n"
-        
-        # Initialize empty transcript
-        transcripts = []
-        
-        # Process each chunk
-        for i, start_ms in enumerate(segments):
-            chunk = audio_full[start_ms:start_ms + chunk_ms]
-            
-            # Convert to numpy array and normalize to [-1, 1]
-            samples = np.array(chunk.get_array_of_samples(), dtype=np.float16)
-            samples = samples / 32768.0
-            
-            app.logger.info(f"Processing chunk {i+1}/{total_segments}, length: {len(samples)} samples")
-            
-            try:
-                # 应用热词处理
-                text = predict_with_hotwords(predictor, samples, hotwords_config)
-                app.logger.info(f"Transcription result: {text[:100]}...")
-                transcripts.append(text)
-            except Exception as e:
-                app.logger.error(f"Error calling SageMaker endpoint: {str(e)}")
-                error_message = f"[Error in segment {i+1}: {str(e)}]"
-                transcripts.append(error_message)
-            
-            # 发送更新
-            current_transcript = " ".join(transcripts).strip()
-            progress = min(100, int(100 * (i + 1) / total_segments))
-            
-            yield "data: " + json.dumps({
-                "type": "progress",
-                "progress": progress,
-                "current_segment": i + 1,
-                "transcript": current_transcript
-            }) + "\n\n"
-            
-            # 添加小延迟让前端有时间处理
-            time.sleep(0.1)
+        for event in transcription_engine.run(file_path, options):
+            if event['type'] == 'segment':
+                data = sse_event({
+                    "type": "progress",
+                    "progress": event['progress'],
+                    "current_segment": event['current_segment'],
+                    "total_segments": event['total_segments'],
+                    "segment": event['segment'],
+                    "skipped": event['skipped'],
+                    "transcript": event['transcript']
+                })
+            else:
+                data = sse_event(event)
+            with span.child('sse.emit', event_type=event['type'], bytes=len(data),
+                            segment_index=event['segment']['index'] if 'segment' in event else None):
+                yield data
         
+    except Exception as e:
+        app.logger.error(f"Error in transcription: {str(e)}")
+        span.set_attribute('error', str(e))
+        # 发送错误信息
+        yield sse_event({
+            "type": "error",
+            "message": str(e)
+        })
+    
+    finally:
+        span.end()
+        if profile:
+            profile.end()
         # Clean up the temp file
-        os.unlink(file_path)
-        
-        # 发送完成信号
-        final_transcript = " ".join(transcripts).strip()
-        yield "data: " + json.dumps({
-            "type": "complete",
-            "transcript": final_transcript
-        }) + "\n\n"
-        
+        try:
+            os.unlink(file_path)
+        except:
+            pass
+
+def get_header_html():
+    """Return the HTML header part"""
+    return f"""
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <title>Whisper Language Assistant</title>
+        <meta charset="UTF-8">
+        <meta name="viewport" content="width=device-width, initial-scale=1.0">
+        <style>
+            body {{
+                font-family: Arial, sans-serif;
+                max-width: 800px;
+                margin: 0 auto;
+                padding: 20px;
+            }}
+            .header {{
+                display: flex;
+                justify-content: space-between;
+                align-items: center;
+                margin-bottom: 20px;
+            }}
+            .form-group {{
+                margin-bottom: 15px;
+            }}
+            .btn {{
+                padding: 10px 15px;
+                background-color: #4CAF50;
+                color: white;
+                border: none;
+                cursor: pointer;
+                margin-right: 10px;
+                text-decoration: none;
+                display: inline-block;
+            }}
+            .result {{
+                margin-top: 20px;
+                padding: 15px;
+                border: 1px solid #ddd;
+                border-radius: 4px;
+            }}
+            .alert {{
+                padding: 15px;
+                margin-bottom: 20px;
+                border: 1px solid transparent;
+            }}
+            .alert-danger {{
+                color: #721c24;
+                background-color: #f8d7da;
+                border-color: #f5c6cb;
+            }}
+            .alert-success {{
+                color: #155724;
+                background-color: #d4edda;
+                border-color: #c3e6cb;
+            }}
+            .progress {{
+                height: 20px;
+                background-color: #f5f5f5;
+                border-radius: 4px;
+                overflow: hidden;
+            }}
+            .progress-bar {{
+                height: 100%;
+                background-color: #4CAF50;
+                color: white;
+                text-align: center;
+                line-height: 20px;
+            }}
+        </style>
+        <script>
+            // 添加JavaScript以处理完成后的行为
+            window.onload = function() {{
+                // 检查是否是最终结果页面
+                if (document.querySelector('.alert-success')) {{
+                    // 已完成，添加返回按钮的事件处理
+                    const backBtn = document.querySelector('a[href="{url_for('index')}"]');
+                    if (backBtn) {{
+                        backBtn.addEventListener('click', function(e) {{
+                            // 使用正常的导航，而不是表单提交
+                            // 不需要阻止默认行为
+                        }});
+                    }}
+                }}
+            }};
+        </script>
+    </head>
+    <body>
+        <div class="header">
+            <h1>Whisper Language Assistant</h1>
+            <div>
+                <a href="{url_for('index')}" class="btn">Back</a>
+                <a href="{url_for('logout')}" class="btn">Logout</a>
+            </div>
+        </div>
+    """
+
+def get_footer_html():
+    """Return the HTML footer part"""
+    return """
+    </body>
+    </html>
+    """
+
+def parse_endpoint_response(response):
+    """解析端点返回结果, 返回 (text, words)
+
+    端点默认返回纯文本; 若返回JSON对象, 则取其中的 text 以及可选的词级时间戳
+    (words 或 segments[].words, 时间相对于本段音频起点, 单位秒)。
+    """
+    if isinstance(response, bytes):
+        response = response.decode('utf-8')
+    data = response
+    if isinstance(response, str):
+        stripped = response.strip()
+        if not stripped.startswith('{'):
+            return response, None
+        try:
+            data = json.loads(stripped)
+        except ValueError:
+            return response, None
+    if not isinstance(data, dict):
+        return str(data), None
+    
+    words = data.get('words')
+    if words is None and isinstance(data.get('segments'), list):
+        words = [w for seg in data['segments'] for w in (seg.get('words') or [])]
+    if words:
+        words = [{'word': w.get('word', ''), 'start': float(w['start']), 'end': float(w['end'])}
+                 for w in words if 'start' in w and 'end' in w]
+    return data.get('text', ''), words or None
+
+def response_language(response, text):
+    """端点检测到的语言: JSON结果中的 language 字段; 纯文本结果按文字判断 (只识别中日韩文字, 拉丁文字无法区分语言)"""
+    if isinstance(response, bytes):
+        response = response.decode('utf-8')
+    if isinstance(response, str) and response.strip().startswith('{'):
+        try:
+            language = json.loads(response).get('language')
+        except (ValueError, AttributeError):
+            language = None
+        if language:
+            return language
+    text = text or ''
+    if len(re.findall(r'[\u3040-\u30ff]', text)) >= 2:
+        return 'ja'
+    if len(re.findall(r'[\uac00-\ud7af]', text)) >= 2:
+        return 'ko'
+    if len(re.findall(r'[\u4e00-\u9fff]', text)) >= 4:
+        return 'zh'
+    return None
+
+def make_segment_record(index, start_ms, end_ms, text, words=None, error=False):
+    """构建带时间偏移的分段记录, 词级时间戳换算为相对整段音频的绝对时间"""
+    start = start_ms / 1000.0
+    record = {
+        'index': index,
+        'start': round(start, 3),
+        'end': round(end_ms / 1000.0, 3),
+        'text': text.strip() if text else ''
+    }
+    if words:
+        record['words'] = [{'word': w['word'], 'start': round(start + w['start'], 3), 'end': round(start + w['end'], 3)}
+                           for w in words]
+    if error:
+        record['error'] = True
+    return record
+
+def format_timestamp(seconds, decimal_marker='.'):
+    """将秒数格式化为 HH:MM:SS.mmm (SRT使用逗号作为毫秒分隔符)"""
+    total_ms = int(round(seconds * 1000))
+    hours, rem = divmod(total_ms, 3600000)
+    minutes, rem = divmod(rem, 60000)
+    secs, ms = divmod(rem, 1000)
+    return f"{hours:02d}:{minutes:02d}:{secs:02d}{decimal_marker}{ms:03d}"
+
+def write_txt(segments):
+    """逐段输出纯文本"""
+    first = True
+    for segment in segments:
+        if not segment['text']:
+            continue
+        yield segment['text'] if first else " " + segment['text']
+        first = False
+    yield "\n"
+
+def write_srt(segments):
+    """逐段输出SRT字幕"""
+    cue = 0
+    for segment in segments:
+        if not segment['text']:
+            continue
+        cue += 1
+        yield (f"{cue}\n"
+               f"{format_timestamp(segment['start'], ',')} --> {format_timestamp(segment['end'], ',')}\n"
+               f"{segment['text']}\n\n")
+
+def write_vtt(segments):
+    """逐段输出WebVTT字幕"""
+    yield "WEBVTT\n\n"
+    for segment in segments:
+        if not segment['text']:
+            continue
+        yield (f"{format_timestamp(segment['start'])} --> {format_timestamp(segment['end'])}\n"
+               f"{segment['text']}\n\n")
+
+def write_json(segments):
+    """逐段输出JSON, segments 数组在前, 完整 transcript 字段以转义片段的形式随后输出"""
+    texts = []
+    yield '{"success": true, "segments": ['
+    for i, segment in enumerate(segments):
+        yield (", " if i else "") + json.dumps(segment, ensure_ascii=False)
+        if segment['text']:
+            texts.append(segment['text'])
+    yield '], "transcript": "'
+    for i, text in enumerate(texts):
+        yield json.dumps((" " if i else "") + text, ensure_ascii=False)[1:-1]
+    yield '"}\n'
+
+def write_ndjson(segments):
+    """每行一个分段的JSON, 客户端可以逐段处理, 连接中断后按分段序号续传"""
+    for segment in segments:
+        yield json.dumps(segment, ensure_ascii=False) + "\n"
+
+# 输出格式 -> (流式写入器, MIME类型)
+OUTPUT_FORMATS = {
+    'json': (write_json, 'application/json'),
+    'ndjson': (write_ndjson, 'application/x-ndjson'),
+    'srt': (write_srt, 'application/x-subrip; charset=utf-8'),
+    'vtt': (write_vtt, 'text/vtt; charset=utf-8'),
+    'txt': (write_txt, 'text/plain; charset=utf-8'),
+}
+
+# ---------------------------------------------------------------------------
+# 转录引擎: 解码 -> 分段 -> 调度 -> 合并
+# 每个阶段都是可替换的独立对象, 所有入口 (/stream, /api/transcribe, 批量API) 共用同一条流水线,
+# 各阶段也可以单独拿出来做基准测试 (见 benchmark.py)。
+# ---------------------------------------------------------------------------
+
+class FfmpegDecoder:
+    """通过ffmpeg子进程把任意ffmpeg可解码的音频解码为16kHz单声道int16 PCM
+
+    指定 start/duration (秒) 时在输入端用 -ss/-t 直接定位, 不会从文件开头解码。
+    """
+
+    def decode(self, file_path, start=None, duration=None):
+        cmd = ['ffmpeg', '-nostdin', '-hide_banner', '-loglevel', 'error']
+        if start:
+            cmd += ['-ss', f'{start:.3f}']
+        if duration is not None:
+            cmd += ['-t', f'{duration:.3f}']
+        cmd += [
+            '-i', file_path,
+            '-f', 's16le', '-ac', '1', '-ar', str(SAMPLE_RATE), '-'
+        ]
+        proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if proc.returncode != 0:
+            raise Exception(f"Failed to decode audio: {proc.stderr.decode('utf-8', errors='ignore').strip()}")
+        return np.frombuffer(proc.stdout, dtype=np.int16)
+
+class PydubDecoder:
+    """通过pydub解码 (旧实现, 保留作对照)"""
+
+    def decode(self, file_path, start=None, duration=None):
+        from pydub import AudioSegment
+        audio = AudioSegment.from_file(file_path)
+        if start or duration is not None:
+            start_ms = int((start or 0) * 1000)
+            audio = audio[start_ms:start_ms + int(duration * 1000)] if duration is not None else audio[start_ms:]
+        audio = audio.set_channels(1).set_frame_rate(SAMPLE_RATE).set_sample_width(2)
+        return np.array(audio.get_array_of_samples(), dtype=np.int16)
+
+AUDIO_DECODERS = {
+    'ffmpeg': FfmpegDecoder,
+    'pydub': PydubDecoder,
+}
+
+class FixedSegmenter:
+    """按固定时长切分PCM, 每段带有相对整段音频的起止时间 (毫秒)"""
+
+    def __init__(self, chunk_seconds=CHUNK_SECONDS):
+        self.chunk_seconds = chunk_seconds
+
+    def split(self, pcm, offset_ms=0, first_index=0):
+        chunk = int(self.chunk_seconds * SAMPLE_RATE)
+        for i, start in enumerate(range(0, len(pcm), chunk), first_index):
+            samples = pcm[start:start + chunk]
+            yield {
+                'index': i,
+                'start_ms': offset_ms + start * 1000 // SAMPLE_RATE,
+                'end_ms': offset_ms + (start + len(samples)) * 1000 // SAMPLE_RATE,
+                'pcm': samples
+            }
+
+def pcm_to_model_input(pcm):
+    """int16 PCM 转为端点期望的 [-1, 1] float16 数组"""
+    return pcm.astype(np.float16) / 32768.0
+
+# 压缩编码 -> 请求的 ContentType, 容器端由 code/payload_codec.py 解码
+PAYLOAD_CONTENT_TYPES = {
+    'int16': 'application/x-pcm-s16le',
+    'flac': 'audio/flac',
+    'opus': 'audio/ogg',
+}
+PAYLOAD_ENCODINGS = ['float16'] + list(PAYLOAD_CONTENT_TYPES)
+
+def ffmpeg_encode(pcm, output_args):
+    """通过ffmpeg把16kHz单声道int16 PCM编码为指定格式"""
+    cmd = [
+        'ffmpeg', '-nostdin', '-hide_banner', '-loglevel', 'error',
+        '-f', 's16le', '-ac', '1', '-ar', str(SAMPLE_RATE), '-i', '-'
+    ] + output_args + ['-']
+    proc = subprocess.run(cmd, input=pcm.astype('<i2').tobytes(), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if proc.returncode != 0:
+        raise Exception(f"Failed to encode audio: {proc.stderr.decode('utf-8', errors='ignore').strip()}")
+    return proc.stdout
+
+def encode_audio(pcm, encoding):
+    """把int16 PCM编码为请求体, 返回 (bytes, content_type)"""
+    if encoding == 'int16':
+        body = pcm.astype('<i2').tobytes()
+    elif encoding == 'flac':
+        if soundfile is not None:
+            buffer = io.BytesIO()
+            soundfile.write(buffer, pcm, SAMPLE_RATE, format='FLAC', subtype='PCM_16')
+            body = buffer.getvalue()
+        else:
+            body = ffmpeg_encode(pcm, ['-f', 'flac'])
+    elif encoding == 'opus':
+        body = ffmpeg_encode(pcm, ['-c:a', 'libopus', '-b:a', OPUS_BITRATE, '-f', 'ogg'])
+    else:
+        raise ValueError(f"Unsupported payload encoding: {encoding}")
+    return body, PAYLOAD_CONTENT_TYPES[encoding]
+
+def is_payload_rejection(error):
+    """端点因不支持请求体编码而拒绝请求时返回True
+
+    认为是拒绝的情况: API层的4xx ValidationError; 容器内模型服务器拒绝请求 (ModelError, 容器原始状态码400或415,
+    如未升级的推理容器不认识新的 ContentType); 新版容器明确返回的不支持内容类型消息。
+    原始状态码为5xx (或没有) 的 ModelError 是容器内的暂时性错误 (如显存不足、模型崩溃), 不说明编码不可用。
+    """
+    response = getattr(error, 'response', None) or {}
+    code = response.get('Error', {}).get('Code', '')
+    status = response.get('ResponseMetadata', {}).get('HTTPStatusCode') or 0
+    if code == 'ValidationError' and 400 <= status < 500:
+        return True
+    if code == 'ModelError':
+        # botocore 把 ModelError 的建模字段放在错误响应的顶层
+        original_status = response.get('OriginalStatusCode') or response.get('Error', {}).get('OriginalStatusCode')
+        try:
+            return int(original_status) in (400, 415)
+        except (TypeError, ValueError):
+            return False
+    return 'Unsupported content type' in str(error)
+
+class PayloadNegotiator:
+    """协商请求体编码
+
+    首选编码被端点拒绝时回退到 float16 重试, 并在 reprobe_seconds 内记住该编码不可用, 期间的调用直接使用 float16,
+    这样新版web应用可以先于推理容器上线; 过期后重新尝试首选编码, 推理容器升级后自动恢复。
+    """
+
+    def __init__(self, reprobe_seconds=PAYLOAD_REPROBE_SECONDS):
+        self.reprobe_seconds = reprobe_seconds
+        self._unsupported = {}
+        self._lock = threading.Lock()
+
+    def effective(self, encoding):
+        encoding = encoding or PAYLOAD_ENCODING
+        with self._lock:
+            until = self._unsupported.get(encoding)
+            if until is None:
+                return encoding
+            if time.time() >= until:
+                del self._unsupported[encoding]
+                return encoding
+            return 'float16'
+
+    def call(self, encoding, send):
+        """用协商后的编码调用 send(encoding), 被拒绝时回退到 float16"""
+        encoding = self.effective(encoding)
+        try:
+            return send(encoding)
+        except Exception as e:
+            if encoding == 'float16' or not is_payload_rejection(e):
+                raise
+            app.logger.warning(f"端点不支持 {encoding} 编码, 回退到 float16: {str(e)}")
+            with self._lock:
+                self._unsupported[encoding] = time.time() + self.reprobe_seconds
+            return send('float16')
+
+payload_negotiator = PayloadNegotiator()
+
+def predict_audio(predictor, pcm, encoding=None, fields=None):
+    """发送一段音频到端点
+
+    没有附加字段时直接发送音频 (float16 为npy数组, 其余为压缩后的二进制);
+    带 initial_prompt 等附加字段时发送JSON请求, 压缩音频以base64放在 audio_b64 字段中。
+    本地推理后端直接接收PCM和字段。
+    请求体的构建和端点调用分别记录为当前span的 serialize 和 invoke 子span。
+    """
+    span = current_span()
+    endpoint = getattr(predictor, 'endpoint_name', ENDPOINT_NAME)
+    transcribe = getattr(predictor, 'transcribe', None)
+    if transcribe:
+        with span.child('invoke', endpoint=endpoint, local=True):
+            return transcribe(pcm, fields)
+    
+    def build_request(encoding):
+        if encoding == 'float16':
+            data = pcm_to_model_input(pcm)
+            return (dict(fields, audio=data) if fields else data), None, data.nbytes
+        body, content_type = encode_audio(pcm, encoding)
+        if not fields:
+            return body, {'ContentType': content_type}, len(body)
+        request_data = dict(fields, audio_b64=base64.b64encode(body).decode('ascii'), audio_encoding=encoding)
+        data = json.dumps(request_data).encode('utf-8')
+        return data, {'ContentType': 'application/json'}, len(data)
+    
+    def send(encoding):
+        with span.child('serialize', encoding=encoding) as serialize_span:
+            data, initial_args, payload_bytes = build_request(encoding)
+            serialize_span.set_attribute('payload_bytes', payload_bytes)
+        with span.child('invoke', endpoint=endpoint, encoding=encoding, payload_bytes=payload_bytes) as invoke_span, \
+                use_span(invoke_span):
+            if initial_args is None:
+                return predictor.predict(data)
+            return predictor.predict(data, initial_args=initial_args)
+    return payload_negotiator.call(encoding, send)
+
+class SegmentTranscriber:
+    """分段转录阶段: 应用热词和滚动上下文调用端点, 返回分段记录
+
+    指定 language 时每次调用都带上该语言; 否则 detect_language 为真时采用第一个返回语言的分段的检测结果,
+    之后提交的分段都固定使用该语言 (已在途的分段仍由端点各自检测)。
+    """
+
+    def __init__(self, predictor, hotwords_config=None, rolling_context=None, encoding=None, language=None,
+                 detect_language=False):
+        self.predictor = predictor
+        self.hotwords_config = hotwords_config or DEFAULT_HOTWORDS_CONFIG
+        self.rolling_context = rolling_context
+        self.encoding = encoding
+        self.language = language
+        self.detect_language = detect_language and not language
+        # 分级路由时引擎选择的模型档位名称, 随队列任务传给工作线程
+        self.tier = None
+        self._lock = threading.Lock()
+
+    def __call__(self, segment, provisional=False):
+        i = segment['index']
+        pcm = segment['pcm']
+        app.logger.info(f"Processing chunk {i+1}, length: {len(pcm)} samples")
+        try:
+            context_text = self.rolling_context.prompt_for(i) if self.rolling_context else None
+            language = self.language
+            response = self.predict(pcm, context_text, language)
+            response_bytes = len(response) if isinstance(response, (str, bytes)) else None
+            with current_span().child('deserialize', response_bytes=response_bytes):
+                text, words = parse_endpoint_response(response)
+            app.logger.info(f"Transcription result: {text[:100]}...")
+            if language is None and self.detect_language:
+                self.pin_language(response_language(response, text), i)
+            if self.rolling_context:
+                self.rolling_context.record(i, text, provisional)
+            return make_segment_record(i, segment['start_ms'], segment['end_ms'], text, words)
+        except Exception as e:
+            app.logger.error(f"Error calling SageMaker endpoint: {str(e)}")
+            error_message = f"[Error in segment {i+1}: {str(e)}]"
+            return make_segment_record(i, segment['start_ms'], segment['end_ms'], error_message, error=True)
+
+    def predict(self, pcm, context_text, language):
+        return predict_with_hotwords(self.predictor, pcm, self.hotwords_config, context_text, self.encoding, language)
+
+    def pin_language(self, language, index):
+        if not language:
+            return
+        with self._lock:
+            if self.language is None:
+                self.language = language
+                app.logger.info(f"分段 {index+1} 检测到语言 {language}, 之后的分段固定使用该语言")
+
+class SegmentDispatcher:
+    """共享的分段调度器
+
+    所有请求的音频段都通过同一个线程池发送到端点, 这样多个文件的分段可以交错调度,
+    同时对端点的总并发被限制在 max_workers 以内。
+    """
+
+    def __init__(self, max_workers=SEGMENT_WORKERS):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='segment')
+
+    def submit(self, fn, *args, **kwargs):
+        """提交一个分段任务, 返回 Future"""
+        return self._executor.submit(fn, *args, **kwargs)
+
+    def map_ordered(self, fn, items, max_in_flight=JOB_MAX_IN_FLIGHT):
+        """以滑动窗口方式提交任务, 同时最多 max_in_flight 个在途, 按提交顺序产出结果"""
+        pending = deque()
+        for item in items:
+            pending.append(self.submit(fn, item))
+            if len(pending) >= max(1, max_in_flight):
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def run_in_thread(fn, *args):
+    """在独立线程中执行fn, 返回 Future (用于不应占用分段调度线程的工作, 如解码)"""
+    future = Future()
+    
+    def target():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(fn(*args))
+        except BaseException as e:
+            future.set_exception(e)
+    
+    threading.Thread(target=target, daemon=True).start()
+    return future
+
+class TranscriptMerger:
+    """合并阶段: 按顺序累积分段记录, 增量维护完整转录文本"""
+
+    def __init__(self):
+        self.segments = []
+        self.transcript = ""
+
+    def add(self, record):
+        self.segments.append(record)
+        if record['text']:
+            self.transcript = f"{self.transcript} {record['text']}" if self.transcript else record['text']
+        return self.transcript
+
+# ---------------------------------------------------------------------------
+# 分布式工作队列
+# 多副本部署时, 持有SSE连接 (或API请求) 的副本负责解码、合并和存储, 端点调用以任务的形式放入共享队列,
+# 任意副本的工作线程都可以领取。分段音频写入共享的 SPOOL_DIR, 结果按任务ID写回, 由等待该任务的副本取回。
+# ---------------------------------------------------------------------------
+
+class LocalBroker:
+    """进程内的队列实现, 与 RedisBroker 接口相同, 用于单副本和测试
+
+    领取的任务在 visibility_timeout 秒内没有写回结果时重新放回队列 (至少投递一次)。
+    """
+
+    def __init__(self, visibility_timeout=QUEUE_TASK_VISIBILITY_SECONDS):
+        self.visibility_timeout = visibility_timeout
+        self._tasks = queue.Queue()
+        self._results = {}
+        self._leases = {}
+        self._lock = threading.Lock()
+
+    def _requeue_expired(self):
+        now = time.time()
+        with self._lock:
+            expired = [task_id for task_id, (deadline, _) in self._leases.items() if deadline <= now]
+            tasks = [self._leases.pop(task_id)[1] for task_id in expired]
+        for task in tasks:
+            app.logger.warning(f"队列任务 {task['task_id']} 超过 {self.visibility_timeout:.0f} 秒未完成, 重新投递")
+            self._tasks.put(task)
+
+    def put_task(self, task):
+        # 放入任务时登记结果队列, 等待方超时离开后迟到的结果直接丢弃
+        with self._lock:
+            self._results[task['task_id']] = queue.Queue(maxsize=1)
+        self._tasks.put(task)
+
+    def get_task(self, timeout=1.0):
+        self._requeue_expired()
+        try:
+            task = self._tasks.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        with self._lock:
+            self._leases[task['task_id']] = (time.time() + self.visibility_timeout, task)
+        return task
+
+    def put_result(self, task_id, result):
+        with self._lock:
+            self._leases.pop(task_id, None)
+            results = self._results.get(task_id)
+        if results is None:
+            # 等待方已超时 (或任务不是由本队列放入的)
+            return
+        try:
+            results.put_nowait(result)
+        except queue.Full:
+            # 重新投递的任务被执行了两次, 只保留先到的结果
+            pass
+
+    def pending_tasks(self):
+        return self._tasks.qsize()
+
+    def get_result(self, task_id, timeout=QUEUE_RESULT_TIMEOUT):
+        with self._lock:
+            results = self._results.get(task_id)
+        if results is None:
+            return None
+        try:
+            return results.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        finally:
+            with self._lock:
+                self._results.pop(task_id, None)
+
+class RedisBroker:
+    """基于Redis列表的共享队列: 任务放在同一个列表中, 每个任务的结果写入以任务ID命名的列表
+
+    领取的任务记录在租约有序集合 (分数为到期时间) 中, 到期未写回结果的任务由任意副本放回任务列表。
+    """
+
+    def __init__(self, url, prefix='whisper', visibility_timeout=QUEUE_TASK_VISIBILITY_SECONDS):
+        import redis
+        self.redis = redis.Redis.from_url(url)
+        self.visibility_timeout = visibility_timeout
+        self.task_key = f"{prefix}:tasks"
+        self.lease_key = f"{prefix}:leases"
+        self.leased_key = f"{prefix}:leased"
+        self.result_prefix = f"{prefix}:result:"
+
+    def _requeue_expired(self):
+        for task_id in self.redis.zrangebyscore(self.lease_key, 0, time.time()):
+            # zrem 成功的副本负责放回, 避免多个副本重复投递
+            if not self.redis.zrem(self.lease_key, task_id):
+                continue
+            task = self.redis.hget(self.leased_key, task_id)
+            self.redis.hdel(self.leased_key, task_id)
+            if task:
+                app.logger.warning(f"队列任务 {task_id.decode()} 超过 {self.visibility_timeout:.0f} 秒未完成, 重新投递")
+                self.redis.rpush(self.task_key, task)
+
+    def put_task(self, task):
+        self.redis.rpush(self.task_key, json.dumps(task, ensure_ascii=False))
+
+    def get_task(self, timeout=1.0):
+        self._requeue_expired()
+        item = self.redis.blpop(self.task_key, timeout=max(1, int(timeout)))
+        if not item:
+            return None
+        task = json.loads(item[1])
+        pipe = self.redis.pipeline()
+        pipe.hset(self.leased_key, task['task_id'], item[1])
+        pipe.zadd(self.lease_key, {task['task_id']: time.time() + self.visibility_timeout})
+        pipe.execute()
+        return task
+
+    def pending_tasks(self):
+        return self.redis.llen(self.task_key)
+
+    def put_result(self, task_id, result):
+        key = self.result_prefix + task_id
+        pipe = self.redis.pipeline()
+        pipe.zrem(self.lease_key, task_id)
+        pipe.hdel(self.leased_key, task_id)
+        pipe.rpush(key, json.dumps(result, ensure_ascii=False))
+        # 等待方已超时的结果不会被取走, 过期后自动清理
+        pipe.expire(key, int(QUEUE_RESULT_TIMEOUT) + 60)
+        pipe.execute()
+
+    def get_result(self, task_id, timeout=QUEUE_RESULT_TIMEOUT):
+        item = self.redis.blpop(self.result_prefix + task_id, timeout=max(1, int(timeout)))
+        return json.loads(item[1]) if item else None
+
+WORK_BROKERS = {
+    'local': lambda: LocalBroker(),
+    'redis': lambda: RedisBroker(REDIS_URL),
+}
+
+def create_work_broker():
+    """按 WORK_QUEUE 创建共享队列, none 时返回None (分段在本副本的调度线程中直接调用端点)"""
+    if WORK_QUEUE == 'none':
+        return None
+    if WORK_QUEUE not in WORK_BROKERS:
+        raise ValueError(f"Unsupported WORK_QUEUE: {WORK_QUEUE}")
+    os.makedirs(SPOOL_DIR, exist_ok=True)
+    broker = WORK_BROKERS[WORK_QUEUE]()
+    app.logger.info(f"分布式模式: 队列 {WORK_QUEUE}, 共享目录 {SPOOL_DIR}")
+    return broker
+
+class QueueTranscriber(SegmentTranscriber):
+    """把端点调用放入共享队列的分段转录阶段
+
+    上下文、语言固定和记录构建仍在本副本完成, 只有端点调用由任意副本的工作线程执行。
+    """
+
+    def __init__(self, broker, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.broker = broker
+
+    def predict(self, pcm, context_text, language):
+        if getattr(self.predictor, 'local', False):
+            # 本地推理的短音频由本副本直接转录, 不经过队列
+            return super().predict(pcm, context_text, language)
+        task_id = uuid.uuid4().hex
+        spool_path = os.path.join(SPOOL_DIR, f"{task_id}.pcm")
+        pcm.astype('<i2').tofile(spool_path)
+        try:
+            with current_span().child('queue', task_id=task_id) as queue_span:
+                self.broker.put_task({
+                    'task_id': task_id,
+                    'spool_path': spool_path,
+                    'hotwords_config': self.hotwords_config,
+                    'context_text': context_text,
+                    'encoding': self.encoding,
+                    'language': language,
+                    'tier': self.tier,
+                    'trace': queue_span.context(),
+                    'queued_at': time.time()
+                })
+                result = self.broker.get_result(task_id)
+        finally:
+            try:
+                os.unlink(spool_path)
+            except OSError:
+                pass
+        if result is None:
+            raise Exception(f"Timed out waiting for queued segment after {QUEUE_RESULT_TIMEOUT:.0f}s")
+        if 'error' in result:
+            raise Exception(result['error'])
+        return result['response']
+
+class QueueWorker:
+    """从共享队列领取分段任务并调用端点的工作线程 (每个副本都运行)"""
+
+    def __init__(self, broker, threads=QUEUE_WORKERS, predictor_factory=None):
+        self.broker = broker
+        self.threads = threads
+        self.predictor_factory = predictor_factory or get_predictor
+        self._stop = threading.Event()
+
+    def start(self):
+        for i in range(self.threads):
+            threading.Thread(target=self._loop, name=f'queue-worker-{i}', daemon=True).start()
+        app.logger.info(f"启动 {self.threads} 个队列工作线程")
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        predictor = None
+        while not self._stop.is_set():
+            try:
+                task = self.broker.get_task()
+            except Exception as e:
+                app.logger.error(f"读取队列失败: {str(e)}")
+                time.sleep(1)
+                continue
+            if task is None:
+                continue
+            # 在编排副本传来的trace下记录本副本执行的部分
+            task_span = tracer.resume(task.get('trace'), 'queue.task', task_id=task.get('task_id'),
+                                      replica=socket.gethostname())
+            if task.get('queued_at'):
+                task_span.set_attribute('queue_wait_ms', round((time.time() - task['queued_at']) * 1000, 1))
+            try:
+                predictor = predictor or self.predictor_factory()
+                if not predictor:
+                    raise Exception("Failed to create SageMaker predictor")
+                pcm = np.fromfile(task['spool_path'], dtype='<i2')
+                hotwords_config = task['hotwords_config'] or DEFAULT_HOTWORDS_CONFIG
+                target = predictor
+                if task.get('tier') and isinstance(predictor, ModelTierRouter):
+                    # 编排副本已经为任务选择了模型档位
+                    target = predictor.tier(task['tier']).predictor
+                with task_span, use_span(task_span):
+                    response = predict_with_hotwords(select_predictor(target, hotwords_config), pcm,
+                                                     hotwords_config, task.get('context_text'), task.get('encoding'),
+                                                     task.get('language'))
+                if isinstance(response, bytes):
+                    response = response.decode('utf-8')
+                result = {'response': response}
+                metrics.inc('whisper_queue_tasks_total', outcome='ok')
+            except Exception as e:
+                task_span.end(e)
+                app.logger.error(f"队列任务 {task.get('task_id')} 失败: {str(e)}")
+                result = {'error': str(e)}
+                metrics.inc('whisper_queue_tasks_total', outcome='error')
+            try:
+                self.broker.put_result(task['task_id'], result)
+            except Exception as e:
+                app.logger.error(f"写回队列任务结果失败: {str(e)}")
+
+# ---------------------------------------------------------------------------
+# 异步推理
+# 超长录音不占用SSE连接: 任务在后台线程中运行, 每个分段的请求体写入对象存储后以 invoke_endpoint_async 提交,
+# 结果通过完成通知 (SNS -> SQS) 或轮询结果位置取回。进度和结果写入转录结果存储, 客户端轮询任务状态。
+# ---------------------------------------------------------------------------
+
+def split_s3_uri(uri):
+    bucket, _, key = uri[len('s3://'):].partition('/')
+    return bucket, key
+
+class S3ObjectStore:
+    """S3 (或MinIO等S3兼容服务) 上的对象存储"""
+
+    def __init__(self, bucket, prefix='', endpoint_url=None):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.s3 = boto3.client('s3', region_name=region_name, endpoint_url=endpoint_url or None,
+                               config=BotoConfig(max_pool_connections=max(10, ASYNC_MAX_IN_FLIGHT)))
+
+    def key_uri(self, key):
+        return f"s3://{self.bucket}/{self.prefix}{key}"
+
+    def put(self, uri, body, content_type=None):
+        bucket, key = split_s3_uri(uri)
+        self.s3.put_object(Bucket=bucket, Key=key, Body=body, **({'ContentType': content_type} if content_type else {}))
+        return uri
+
+    def get(self, uri):
+        """返回对象内容, 对象不存在时返回None"""
+        bucket, key = split_s3_uri(uri)
+        try:
+            return self.s3.get_object(Bucket=bucket, Key=key)['Body'].read()
+        except Exception as e:
+            if getattr(e, 'response', {}).get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+                return None
+            raise
+
+    def delete(self, uri):
+        bucket, key = split_s3_uri(uri)
+        self.s3.delete_object(Bucket=bucket, Key=key)
+
+class LocalObjectStore:
+    """本地目录中的对象存储 (file:// 位置), 与本地模拟异步端点配合用于开发和测试"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def key_uri(self, key):
+        return 'file://' + os.path.join(self.directory, key)
+
+    def put(self, uri, body, content_type=None):
+        path = uri[len('file://'):]
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 先写临时文件再改名, 轮询时不会读到写了一半的结果
+        with open(path + '.tmp', 'wb') as f:
+            f.write(body)
+        os.replace(path + '.tmp', path)
+        return uri
+
+    def get(self, uri):
+        try:
+            with open(uri[len('file://'):], 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def delete(self, uri):
+        try:
+            os.unlink(uri[len('file://'):])
+        except OSError:
+            pass
+
+def parse_async_notification(body):
+    """解析异步推理的完成通知 (SNS 封装或原始消息), 返回 (inference_id, 是否成功, 结果位置, 失败原因)"""
+    message = json.loads(body)
+    if message.get('Type') == 'Notification':
+        message = json.loads(message['Message'])
+    response = message.get('responseParameters') or {}
+    return (message.get('inferenceId'), message.get('invocationStatus') == 'Completed',
+            response.get('outputLocation'), message.get('failureReason'))
+
+class SQSNotificationSource:
+    """从订阅了端点成功/失败SNS主题的SQS队列读取完成通知"""
+
+    def __init__(self, queue_url):
+        self.queue_url = queue_url
+        self.sqs = boto3.client('sqs', region_name=region_name)
+
+    def receive(self, wait_seconds):
+        """长轮询最多 wait_seconds 秒, 返回 [(消息体, 确认函数)]"""
+        response = self.sqs.receive_message(QueueUrl=self.queue_url, MaxNumberOfMessages=10,
+                                            WaitTimeSeconds=int(min(20, max(1, wait_seconds))))
+        return [(message['Body'], lambda handle=message['ReceiptHandle']: self.sqs.delete_message(
+                    QueueUrl=self.queue_url, ReceiptHandle=handle))
+                for message in response.get('Messages', [])]
+
+class LocalNotificationSource:
+    """进程内的完成通知队列, 由本地模拟异步端点发布"""
+
+    def __init__(self):
+        self._queue = queue.Queue()
+
+    def publish(self, message):
+        self._queue.put(json.dumps(message))
+
+    def receive(self, wait_seconds):
+        try:
+            return [(self._queue.get(timeout=wait_seconds), lambda: None)]
+        except queue.Empty:
+            return []
+
+class MockAsyncRuntime:
+    """本地模拟的 SageMaker 异步推理 (invoke_endpoint_async)
+
+    从对象存储读取请求体, 由 MockPredictor 处理后把结果 (或失败原因) 写回对象存储, 并发布完成通知。
+    """
+
+    def __init__(self, object_store, predictor=None, concurrency=MOCK_ASYNC_CONCURRENCY, notifications=None):
+        self.object_store = object_store
+        self.predictor = predictor or MockPredictor()
+        self.notifications = notifications
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='mock-async')
+
+    def invoke_endpoint_async(self, EndpointName, InputLocation, ContentType=None, Accept=None, InferenceId=None,
+                              **kwargs):
+        inference_id = InferenceId or uuid.uuid4().hex
+        output_location = self.object_store.key_uri(f"output/{inference_id}.out")
+        failure_location = self.object_store.key_uri(f"failure/{inference_id}.out")
+        self._executor.submit(self._process, inference_id, InputLocation, ContentType, output_location,
+                              failure_location)
+        return {'InferenceId': inference_id, 'OutputLocation': output_location, 'FailureLocation': failure_location}
+
+    def _process(self, inference_id, input_location, content_type, output_location, failure_location):
+        message = {'inferenceId': inference_id, 'eventSource': 'aws:sagemaker', 'eventName': 'InferenceResult'}
+        try:
+            body = self.object_store.get(input_location)
+            if body is None:
+                raise Exception(f"Input not found: {input_location}")
+            result = self.predictor.predict(body, {'ContentType': content_type})
+            self.object_store.put(output_location, result.encode('utf-8'))
+            message.update(invocationStatus='Completed', responseParameters={'outputLocation': output_location})
+        except Exception as e:
+            self.object_store.put(failure_location, str(e).encode('utf-8'))
+            message.update(invocationStatus='Failed', failureReason=str(e))
+        if self.notifications:
+            self.notifications.publish(message)
+
+class AsyncResultWaiter:
+    """等待异步推理结果: 由一个后台线程读取完成通知, 未配置通知时每 poll_interval 秒检查所有在途请求的结果位置"""
+
+    def __init__(self, object_store, notifications=None, poll_interval=ASYNC_POLL_INTERVAL):
+        self.object_store = object_store
+        self.notifications = notifications
+        self.poll_interval = poll_interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def register(self, inference_id):
+        """提交请求前登记, 避免在提交返回之前到达的通知被丢弃"""
+        with self._lock:
+            self._pending[inference_id] = {'event': threading.Event(), 'output': None, 'failure': None}
+            metrics.set('whisper_async_pending', len(self._pending))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name='async-results', daemon=True)
+                self._thread.start()
+
+    def cancel(self, inference_id):
+        """提交失败时取消登记"""
+        with self._lock:
+            self._pending.pop(inference_id, None)
+            metrics.set('whisper_async_pending', len(self._pending))
+
+    def wait(self, inference_id, output_location, failure_location, timeout=ASYNC_RESULT_TIMEOUT):
+        """等待结果, 返回结果内容 (bytes); 失败或超时时抛出异常"""
+        with self._lock:
+            entry = self._pending[inference_id]
+            entry.update(output=output_location, failure=failure_location)
+        try:
+            if not entry['event'].wait(timeout):
+                raise Exception(f"Timed out waiting for async inference {inference_id} after {timeout:.0f}s")
+            if 'error' in entry:
+                raise Exception(entry['error'])
+            return entry['result']
+        finally:
+            self.cancel(inference_id)
+
+    def _resolve(self, inference_id, result=None, error=None):
+        with self._lock:
+            entry = self._pending.get(inference_id)
+        if entry is None or entry['event'].is_set():
+            return False
+        if error is not None:
+            entry['error'] = error
+        else:
+            entry['result'] = result
+        metrics.inc('whisper_async_inferences_total', outcome='error' if error is not None else 'ok')
+        entry['event'].set()
+        return True
+
+    def _loop(self):
+        while True:
+            try:
+                if self.notifications:
+                    self._receive_notifications()
+                else:
+                    time.sleep(self.poll_interval)
+                    self._poll()
+            except Exception as e:
+                app.logger.error(f"读取异步推理结果失败: {str(e)}")
+                time.sleep(self.poll_interval)
+
+    def _receive_notifications(self):
+        for body, ack in self.notifications.receive(self.poll_interval):
+            inference_id, succeeded, output_location, failure_reason = parse_async_notification(body)
+            with self._lock:
+                entry = self._pending.get(inference_id)
+            if entry is None:
+                # 其他副本或已超时的请求, 不确认, 消息在可见性超时后回到队列
+                continue
+            if succeeded:
+                self._resolve(inference_id, result=self.object_store.get(output_location or entry['output']))
+            else:
+                self._resolve(inference_id, error=f"Async inference failed: {failure_reason}")
+            ack()
+
+    def _poll(self):
+        with self._lock:
+            pending = [(inference_id, dict(entry)) for inference_id, entry in self._pending.items() if entry['output']]
+        for inference_id, entry in pending:
+            result = self.object_store.get(entry['output'])
+            if result is not None:
+                self._resolve(inference_id, result=result)
+                continue
+            failure = self.object_store.get(entry['failure']) if entry['failure'] else None
+            if failure is not None:
+                self._resolve(inference_id, error=f"Async inference failed: {failure.decode('utf-8', 'replace')}")
+
+class AsyncEndpointClient:
+    """通过异步推理调用端点, 接口与 EndpointClient.predict 相同 (调用线程阻塞到结果返回)
+
+    请求体写入对象存储, 提交后等待结果; 输入和结果对象在取回后删除。
+    """
+
+    def __init__(self, endpoint_name, runtime_client, object_store, waiter, serializer=None):
+        self.endpoint_name = f"async:{endpoint_name}"
+        self.async_endpoint = endpoint_name
+        self.runtime = runtime_client
+        self.object_store = object_store
+        self.waiter = waiter
+        self.serializer = serializer or PayloadSerializer()
+
+    def predict(self, data, initial_args=None):
+        content_type = (initial_args or {}).get('ContentType', self.serializer.CONTENT_TYPE)
+        inference_id = uuid.uuid4().hex
+        span = current_span()
+        span.set_attribute('inference_id', inference_id)
+        with span.child('async.upload') as upload_span:
+            body = self.serializer.serialize(data)
+            upload_span.set_attribute('payload_bytes', len(body))
+            input_location = self.object_store.put(self.object_store.key_uri(f"input/{inference_id}"), body,
+                                                   content_type)
+        output_location = failure_location = None
+        try:
+            self.waiter.register(inference_id)
+            try:
+                with span.child('async.submit'):
+                    response = self.runtime.invoke_endpoint_async(
+                        EndpointName=self.async_endpoint,
+                        InputLocation=input_location,
+                        ContentType=content_type,
+                        Accept=StringDeserializer.ACCEPT,
+                        InferenceId=inference_id
+                    )
+            except Exception:
+                self.waiter.cancel(inference_id)
+                raise
+            output_location, failure_location = response['OutputLocation'], response.get('FailureLocation')
+            with span.child('async.wait'):
+                result = self.waiter.wait(inference_id, output_location, failure_location)
+            return result.decode('utf-8') if isinstance(result, bytes) else result
+        finally:
+            for location in (input_location, output_location, failure_location):
+                if location:
+                    try:
+                        self.object_store.delete(location)
+                    except Exception as e:
+                        app.logger.warning(f"删除异步推理对象 {location} 失败: {str(e)}")
+
+_async_client = None
+_async_client_lock = threading.Lock()
+
+def get_async_predictor():
+    """进程内共享的异步推理客户端 (对象存储、结果等待线程只创建一次)"""
+    global _async_client
+    with _async_client_lock:
+        if _async_client is None:
+            if ASYNC_OBJECT_STORE == 'local':
+                object_store = LocalObjectStore(ASYNC_LOCAL_STORE_DIR)
+            else:
+                if not ASYNC_S3_BUCKET:
+                    raise ValueError("ASYNC_S3_BUCKET is required for async inference")
+                object_store = S3ObjectStore(ASYNC_S3_BUCKET, ASYNC_S3_PREFIX, ASYNC_S3_ENDPOINT_URL)
+            notifications = None
+            if ASYNC_NOTIFICATION_QUEUE_URL == 'mock':
+                notifications = LocalNotificationSource()
+            elif ASYNC_NOTIFICATION_QUEUE_URL:
+                notifications = SQSNotificationSource(ASYNC_NOTIFICATION_QUEUE_URL)
+            if ASYNC_ENDPOINT == 'mock':
+                runtime = MockAsyncRuntime(object_store, notifications=notifications)
+            else:
+                runtime = get_runtime_client()
+            _async_client = AsyncEndpointClient(ASYNC_ENDPOINT, runtime, object_store,
+                                                AsyncResultWaiter(object_store, notifications))
+            app.logger.info(f"异步推理: 端点 {ASYNC_ENDPOINT}, 对象存储 {ASYNC_OBJECT_STORE}, "
+                            f"{'通知 ' + ASYNC_NOTIFICATION_QUEUE_URL if notifications else '轮询'}")
+        return _async_client
+
+# ---------------------------------------------------------------------------
+# 转录结果存储
+# 任务ID由音频内容和影响结果的选项计算得出, 同一任务的重复请求直接从存储返回, 不再调用端点。
+# 分段结果在完成时逐段写入, 中断的任务重新提交时只转录缺失的分段。
+# ---------------------------------------------------------------------------
+
+def compute_job_id(file_path, options):
+    """根据上传用户、音频内容和影响转录结果的选项计算任务ID
+
+    任务记录归属于第一次创建它的用户, 不同用户上传相同的音频时使用各自的任务, 不共享记录。
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    hotwords_config = options.get('hotwords_config') or DEFAULT_HOTWORDS_CONFIG
+    key = {
+        'hotwords': hotwords_config if hotwords_config.get('words') else None,
+        'rolling_context': bool(options.get('rolling_context')),
+        'ranges': options.get('ranges'),
+        'username': options.get('username')
+    }
+    # 只在指定语言 (或质量) 时加入, 保持自动检测 (自动选择档位) 任务的ID不变
+    if options.get('language'):
+        key['language'] = options['language']
+    if options.get('quality'):
+        key['quality'] = options['quality']
+    digest.update(json.dumps(key, sort_keys=True, ensure_ascii=False).encode('utf-8'))
+    return digest.hexdigest()[:32]
+
+def job_summary(job):
+    """任务列表中返回的字段 (不含完整转录文本)"""
+    return {key: job.get(key) for key in ('job_id', 'filename', 'status', 'created_at', 'updated_at',
+                                          'duration', 'total_segments', 'timing', 'error')}
+
+class SQLiteTranscriptStore:
+    """基于SQLite的转录结果存储, 每个线程使用独立连接"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                filename TEXT,
+                username TEXT,
+                status TEXT,
+                created_at REAL,
+                updated_at REAL,
+                duration REAL,
+                total_segments INTEGER,
+                options TEXT,
+                transcript TEXT,
+                timing TEXT,
+                error TEXT
+            );
+            CREATE INDEX IF NOT EXISTS jobs_user_created ON jobs (username, created_at);
+            CREATE TABLE IF NOT EXISTS segments (
+                job_id TEXT,
+                idx INTEGER,
+                data TEXT,
+                PRIMARY KEY (job_id, idx)
+            );
+        """)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def _row_to_job(self, row):
+        job = dict(row)
+        for key in ('options', 'timing'):
+            job[key] = json.loads(job[key]) if job[key] else None
+        return job
+
+    def get(self, job_id):
+        row = self._conn().execute('SELECT * FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def start_job(self, job):
+        now = time.time()
+        with self._conn() as conn:
+            conn.execute("""
+                INSERT INTO jobs (job_id, filename, username, status, created_at, updated_at, duration, total_segments, options)
+                VALUES (?, ?, ?, 'running', ?, ?, ?, ?, ?)
+                ON CONFLICT (job_id) DO UPDATE SET status = 'running', updated_at = excluded.updated_at, error = NULL
+            """, (job['job_id'], job.get('filename'), job.get('username'), now, now, job.get('duration'),
+                  job.get('total_segments'), json.dumps(job.get('options'), ensure_ascii=False)))
+
+    def save_segment(self, job_id, record):
+        with self._conn() as conn:
+            conn.execute('INSERT OR REPLACE INTO segments (job_id, idx, data) VALUES (?, ?, ?)',
+                         (job_id, record['index'], json.dumps(record, ensure_ascii=False)))
+
+    def get_segments(self, job_id):
+        rows = self._conn().execute('SELECT data FROM segments WHERE job_id = ? ORDER BY idx', (job_id,))
+        return [json.loads(row['data']) for row in rows]
+
+    def finish_job(self, job_id, status, transcript=None, timing=None, error=None):
+        with self._conn() as conn:
+            conn.execute('UPDATE jobs SET status = ?, updated_at = ?, transcript = ?, timing = ?, error = ? WHERE job_id = ?',
+                         (status, time.time(), transcript, json.dumps(timing) if timing else None, error, job_id))
+
+    def list_jobs(self, offset=0, limit=20, username=None):
+        where, params = ('WHERE username = ?', [username]) if username else ('', [])
+        conn = self._conn()
+        total = conn.execute(f'SELECT COUNT(*) FROM jobs {where}', params).fetchone()[0]
+        rows = conn.execute(f'SELECT * FROM jobs {where} ORDER BY created_at DESC LIMIT ? OFFSET ?',
+                            params + [limit, offset]).fetchall()
+        return [job_summary(self._row_to_job(row)) for row in rows], total
+
+class DiskTranscriptStore:
+    """基于本地磁盘的转录结果存储: <job_id>.json 保存任务信息, <job_id>.segments.jsonl 逐行追加分段"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def _path(self, job_id, suffix='.json'):
+        return os.path.join(self.directory, job_id + suffix)
+
+    def _write(self, job):
+        tmp_path = self._path(job['job_id'], '.json.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(job, f, ensure_ascii=False)
+        os.replace(tmp_path, self._path(job['job_id']))
+
+    def get(self, job_id):
+        try:
+            with open(self._path(job_id), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def start_job(self, job):
+        with self._lock:
+            now = time.time()
+            existing = self.get(job['job_id']) or {}
+            record = dict(existing, **job)
+            record.update(status='running', created_at=existing.get('created_at', now), updated_at=now, error=None)
+            self._write(record)
+
+    def save_segment(self, job_id, record):
+        with self._lock:
+            with open(self._path(job_id, '.segments.jsonl'), 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def get_segments(self, job_id):
+        segments = {}
+        try:
+            with open(self._path(job_id, '.segments.jsonl'), encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        segments[record['index']] = record
+        except OSError:
+            pass
+        return [segments[i] for i in sorted(segments)]
+
+    def finish_job(self, job_id, status, transcript=None, timing=None, error=None):
+        with self._lock:
+            job = self.get(job_id)
+            if job:
+                job.update(status=status, updated_at=time.time(), transcript=transcript, timing=timing, error=error)
+                self._write(job)
+
+    def list_jobs(self, offset=0, limit=20, username=None):
+        jobs = []
+        for path in glob.glob(os.path.join(self.directory, '*.json')):
+            try:
+                with open(path, encoding='utf-8') as f:
+                    job = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if not username or job.get('username') == username:
+                jobs.append(job)
+        jobs.sort(key=lambda job: job.get('created_at') or 0, reverse=True)
+        return [job_summary(job) for job in jobs[offset:offset + limit]], len(jobs)
+
+TRANSCRIPT_STORES = {
+    'sqlite': SQLiteTranscriptStore,
+    'disk': DiskTranscriptStore,
+}
+
+def create_transcript_store():
+    """按 TRANSCRIPT_STORE 创建存储后端, none 或创建失败时返回None (不保存结果)"""
+    if TRANSCRIPT_STORE == 'none':
+        return None
+    try:
+        store = TRANSCRIPT_STORES[TRANSCRIPT_STORE](TRANSCRIPT_STORE_PATH)
+        app.logger.info(f"转录结果存储: {TRANSCRIPT_STORE} ({TRANSCRIPT_STORE_PATH})")
+        return store
+    except Exception as e:
+        app.logger.error(f"创建转录结果存储失败, 不保存转录结果: {str(e)}")
+        return None
+
+# ---------------------------------------------------------------------------
+# 全文检索
+# FTS5 自带的 unicode61 分词器会把连续的中文当成一个词, 所以写入前在每个CJK字符两侧插入空格,
+# 按单字建立倒排索引; 查询时把连续的中文转成单字短语 ("会 议"), 只匹配连续出现的字。
+# ---------------------------------------------------------------------------
+
+CJK_CHAR_PATTERN = re.compile(r'([\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af])')
+# 相邻的CJK字符、全角标点和高亮括号之间的空格在还原时去掉
+CJK_SPACING_PATTERN = re.compile(r'(?<=[\u3000-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af\uff00-\uffef\[\]]) '
+                                 r'(?=[\u3000-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af\uff00-\uffef\[\]])')
+
+def tokenize_for_index(text):
+    """在每个CJK字符两侧插入空格, 使FTS5按单字索引中文"""
+    return re.sub(r'\s+', ' ', CJK_CHAR_PATTERN.sub(r' \1 ', text)).strip()
+
+def detokenize_from_index(text):
+    """去掉 tokenize_for_index 在相邻CJK字符之间插入的空格"""
+    return CJK_SPACING_PATTERN.sub('', text)
+
+def build_fts_query(query):
+    """把用户输入转换为FTS5查询: 每个词 (中文为连续单字组成的短语) 都必须出现"""
+    terms = []
+    for term in query.split():
+        tokens = [t for t in re.split(r'[^\w]+', tokenize_for_index(term).replace(' ', '\x00')) if t]
+        if tokens:
+            terms.append('"' + ' '.join(tokens) + '"')
+    return ' AND '.join(terms)
+
+class SearchIndex:
+    """基于SQLite FTS5的转录全文索引, 任务完成时增量写入"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._conn().executescript("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS segment_fts USING fts5(
+                content,
+                text UNINDEXED,
+                job_id UNINDEXED,
+                username UNINDEXED,
+                filename UNINDEXED,
+                idx UNINDEXED,
+                start UNINDEXED,
+                end UNINDEXED,
+                tokenize = 'unicode61'
+            );
+        """)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def index_job(self, job, segments):
+        """写入 (或重新写入) 一个任务的全部分段"""
+        rows = [(tokenize_for_index(seg['text']), seg['text'], job['job_id'], job.get('username'), job.get('filename'),
+                 seg['index'], seg['start'], seg['end'])
+                for seg in segments if seg.get('text') and not seg.get('error')]
+        with self._conn() as conn:
+            conn.execute('DELETE FROM segment_fts WHERE job_id = ?', (job['job_id'],))
+            conn.executemany('INSERT INTO segment_fts (content, text, job_id, username, filename, idx, start, end) '
+                             'VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+
+    def search(self, query, username=None, offset=0, limit=20):
+        """返回 (命中列表, 总数), 按相关度排序, 每个命中带有分段的时间偏移"""
+        fts_query = build_fts_query(query)
+        if not fts_query:
+            return [], 0
+        where = 'segment_fts MATCH ?' + (' AND username = ?' if username else '')
+        params = [fts_query] + ([username] if username else [])
+        conn = self._conn()
+        total = conn.execute(f'SELECT COUNT(*) FROM segment_fts WHERE {where}', params).fetchone()[0]
+        rows = conn.execute(f"""
+            SELECT job_id, filename, idx, start, end, text,
+                   snippet(segment_fts, 0, '[', ']', '…', 32) AS snippet
+            FROM segment_fts WHERE {where}
+            ORDER BY bm25(segment_fts) LIMIT ? OFFSET ?
+        """, params + [limit, offset]).fetchall()
+        hits = [{
+            'job_id': row['job_id'],
+            'filename': row['filename'],
+            'segment_index': row['idx'],
+            'start': row['start'],
+            'end': row['end'],
+            'text': row['text'],
+            'snippet': detokenize_from_index(row['snippet'])
+        } for row in rows]
+        return hits, total
+
+def create_search_index():
+    """按 SEARCH_INDEX 创建全文索引, none 或当前SQLite不支持FTS5时返回None"""
+    if SEARCH_INDEX == 'none':
+        return None
+    try:
+        return SearchIndex(SEARCH_INDEX_PATH)
+    except Exception as e:
+        app.logger.error(f"创建全文索引失败, 检索功能不可用: {str(e)}")
+        return None
+
+# ---------------------------------------------------------------------------
+# 声学指纹
+# 采用 Haitsma-Kalker 方式: 每16ms一帧, 取300-2000Hz内33个对数频带的能量, 按相邻频带能量差
+# 在时间上的变化符号得到32位子指纹。重新编码 (mp3/m4a互转、码率变化) 只会翻转少量比特,
+# 因此用误码率判断两段音频是否为同一录音。
+# ---------------------------------------------------------------------------
+
+FP_FRAME_LENGTH = 2048
+FP_HOP = 256
+FP_BANDS = 33
+FP_MIN_FREQ = 300
+FP_MAX_FREQ = 2000
+# 比对时允许的帧偏移 (编码器延迟通常在几十毫秒以内)
+FP_MAX_OFFSET = 8
+# 索引中每隔几帧保存一个子指纹用于候选查找, 查询时使用全部帧
+FP_KEY_STRIDE = 4
+# 静音段的指纹不稳定且彼此相似, 低于该能量 (dBFS) 的分段不做指纹匹配
+FP_MIN_LEVEL_DBFS = -50.0
+
+_fp_window = np.hanning(FP_FRAME_LENGTH).astype(np.float32)
+_fp_band_bins = np.round(
+    np.geomspace(FP_MIN_FREQ, FP_MAX_FREQ, FP_BANDS + 1) * FP_FRAME_LENGTH / SAMPLE_RATE
+).astype(int)
+
+def pcm_level_dbfs(pcm):
+    """int16 PCM 的RMS电平 (dBFS)"""
+    if len(pcm) == 0:
+        return -120.0
+    rms = np.sqrt(np.mean(np.square(pcm.astype(np.float32) / 32768.0)))
+    return 20 * math.log10(max(rms, 1e-6))
+
+def compute_fingerprint(pcm):
+    """计算一段16kHz int16 PCM的声学指纹, 返回uint32子指纹数组; 过短或静音时返回None"""
+    if len(pcm) < FP_FRAME_LENGTH + 2 * FP_HOP or pcm_level_dbfs(pcm) < FP_MIN_LEVEL_DBFS:
+        return None
+    samples = pcm.astype(np.float32) / 32768.0
+    frames = np.lib.stride_tricks.sliding_window_view(samples, FP_FRAME_LENGTH)[::FP_HOP]
+    power = np.square(np.abs(np.fft.rfft(frames * _fp_window, axis=1)))
+    energies = np.add.reduceat(power, _fp_band_bins, axis=1)[:, :FP_BANDS]
+    band_diff = energies[:, :-1] - energies[:, 1:]
+    bits = (band_diff[1:] - band_diff[:-1]) > 0
+    return np.packbits(bits, axis=1).view('>u4').ravel().astype(np.uint32)
+
+def fingerprint_similarity(a, b, max_offset=FP_MAX_OFFSET):
+    """在 ±max_offset 帧范围内对齐两个指纹, 返回最高的相似度 (1 - 误码率)"""
+    best = 0.0
+    min_overlap = min(len(a), len(b)) // 2
+    for offset in range(-max_offset, max_offset + 1):
+        x = a[offset:] if offset >= 0 else a
+        y = b if offset >= 0 else b[-offset:]
+        n = min(len(x), len(y))
+        if n < min_overlap or n == 0:
+            continue
+        errors = int(np.unpackbits((x[:n] ^ y[:n]).view(np.uint8)).sum())
+        best = max(best, 1.0 - errors / (n * 32.0))
+    return best
+
+def fingerprint_keys(fingerprint, stride=1):
+    """用于候选查找的子指纹 (全0/全1的子指纹区分度太低, 不参与查找)"""
+    keys = np.unique(fingerprint[::stride])
+    return [int(k) for k in keys if k != 0 and k != 0xFFFFFFFF]
+
+def fingerprint_variant(hotwords_config, language=None, tier=None, username=None, rolling_context=False):
+    """只在相同配置之间复用: 热词配置、指定的语言、是否带滚动上下文或模型档位不同时转录结果可能不同
+
+    复用范围按上传用户隔离 (与任务ID按用户区分一致), 一个用户的转录文本不会出现在另一个用户的结果中。
+    """
+    hotwords_config = hotwords_config or DEFAULT_HOTWORDS_CONFIG
+    words = hotwords_config.get('words')
+    key = json.dumps([username, hotwords_config.get('method') if words else None, sorted(words or []), language,
+                      bool(rolling_context), tier], ensure_ascii=False)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+def reuse_segment_record(segment, source, similarity):
+    """以匹配到的已有分段结果生成当前分段的记录, 词级时间戳平移到当前分段的位置"""
+    record = make_segment_record(segment['index'], segment['start_ms'], segment['end_ms'], source['text'])
+    if source.get('words'):
+        shift = record['start'] - source['start']
+        record['words'] = [dict(w, start=round(w['start'] + shift, 3), end=round(w['end'] + shift, 3))
+                           for w in source['words']]
+    # 不返回来源任务的ID
+    record['reused'] = {
+        'segment_index': source['index'],
+        'similarity': round(similarity, 3)
+    }
+    return record
+
+class MemoryFingerprintIndex:
+    """进程内的指纹索引 (重启后丢失, 用于开发和测试)"""
+
+    def __init__(self):
+        self._entries = []
+        self._keys = {}
+        self._lock = threading.Lock()
+
+    def add(self, fingerprint, variant, record, job_id=None):
+        with self._lock:
+            entry_id = len(self._entries)
+            self._entries.append((variant, fingerprint, dict(record, job_id=job_id)))
+            for key in fingerprint_keys(fingerprint, FP_KEY_STRIDE):
+                self._keys.setdefault(key, []).append(entry_id)
+
+    def _candidates(self, fingerprint, variant, limit):
+        votes = Counter()
+        with self._lock:
+            for key in fingerprint_keys(fingerprint):
+                votes.update(self._keys.get(key, ()))
+            return [self._entries[entry_id][1:] for entry_id, _ in votes.most_common()
+                    if self._entries[entry_id][0] == variant][:limit]
+
+    def lookup(self, fingerprint, variant, threshold=FINGERPRINT_MATCH_THRESHOLD, limit=3):
+        """返回 (已有分段记录, 相似度), 没有足够相似的分段时返回None"""
+        best = None
+        for candidate, record in self._candidates(fingerprint, variant, limit):
+            similarity = fingerprint_similarity(fingerprint, candidate)
+            if similarity >= threshold and (best is None or similarity > best[1]):
+                best = (record, similarity)
+        return best
+
+class SQLiteFingerprintIndex(MemoryFingerprintIndex):
+    """持久化的指纹索引, 子指纹倒排表用于候选查找, 完整指纹用于误码率校验"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._conn().executescript("""
+            CREATE TABLE IF NOT EXISTS fingerprints (
+                id INTEGER PRIMARY KEY,
+                variant TEXT,
+                record TEXT,
+                fingerprint BLOB
+            );
+            CREATE TABLE IF NOT EXISTS fingerprint_keys (
+                key INTEGER,
+                fingerprint_id INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS fingerprint_keys_key ON fingerprint_keys (key);
+        """)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def add(self, fingerprint, variant, record, job_id=None):
+        with self._conn() as conn:
+            cursor = conn.execute('INSERT INTO fingerprints (variant, record, fingerprint) VALUES (?, ?, ?)',
+                                  (variant, json.dumps(dict(record, job_id=job_id), ensure_ascii=False),
+                                   fingerprint.astype('<u4').tobytes()))
+            conn.executemany('INSERT INTO fingerprint_keys (key, fingerprint_id) VALUES (?, ?)',
+                             [(key, cursor.lastrowid) for key in fingerprint_keys(fingerprint, FP_KEY_STRIDE)])
+
+    def _candidates(self, fingerprint, variant, limit):
+        conn = self._conn()
+        votes = Counter()
+        keys = fingerprint_keys(fingerprint)
+        # 分批查询, 避免超过SQLite的参数个数限制
+        for i in range(0, len(keys), 500):
+            batch = keys[i:i + 500]
+            rows = conn.execute(f'SELECT fingerprint_id FROM fingerprint_keys WHERE key IN ({",".join("?" * len(batch))})',
+                                batch)
+            votes.update(row[0] for row in rows)
+        candidates = []
+        for fingerprint_id, _ in votes.most_common(limit * 4):
+            row = conn.execute('SELECT variant, record, fingerprint FROM fingerprints WHERE id = ?',
+                               (fingerprint_id,)).fetchone()
+            if row and row[0] == variant:
+                candidates.append((np.frombuffer(row[2], dtype='<u4').astype(np.uint32), json.loads(row[1])))
+            if len(candidates) >= limit:
+                break
+        return candidates
+
+def create_fingerprint_index():
+    """按 FINGERPRINT_INDEX 创建指纹索引, none 时返回None"""
+    if FINGERPRINT_INDEX == 'none':
+        return None
+    try:
+        if FINGERPRINT_INDEX == 'memory':
+            return MemoryFingerprintIndex()
+        return SQLiteFingerprintIndex(FINGERPRINT_INDEX_PATH)
+    except Exception as e:
+        app.logger.error(f"创建指纹索引失败, 不做近似重复检测: {str(e)}")
+        return None
+
+# ---------------------------------------------------------------------------
+# 静音与重复分段检测
+# 等待音乐、长时间无人说话或录音结尾的空白段发送到端点后, 模型经常会凭空生成文本。
+# 调用端点前用帧级RMS能量和过零率做一次廉价的预检查, 跳过静音分段和与前一段完全相同的分段。
+# ---------------------------------------------------------------------------
+
+SILENCE_FRAME_SAMPLES = SAMPLE_RATE // 50
+# 略高于阈值但过零率很高的帧通常是底噪/嘶声, 不算有效帧
+SILENCE_NOISE_MARGIN_DB = 10.0
+SILENCE_NOISE_ZCR = 0.35
+
+def segment_activity(pcm):
+    """返回分段的帧级统计: 有效帧占比、峰值帧电平 (dBFS) 和平均过零率"""
+    n_frames = len(pcm) // SILENCE_FRAME_SAMPLES
+    if n_frames == 0:
+        return {'active_ratio': 0.0, 'peak_dbfs': -120.0, 'zcr': 0.0}
+    frames = pcm[:n_frames * SILENCE_FRAME_SAMPLES].astype(np.float32).reshape(n_frames, -1) / 32768.0
+    rms = np.sqrt(np.mean(np.square(frames), axis=1))
+    level = 20 * np.log10(np.maximum(rms, 1e-6))
+    zcr = np.mean(np.signbit(frames[:, 1:]) != np.signbit(frames[:, :-1]), axis=1)
+    noise = (level < SILENCE_THRESHOLD_DBFS + SILENCE_NOISE_MARGIN_DB) & (zcr > SILENCE_NOISE_ZCR)
+    active = (level > SILENCE_THRESHOLD_DBFS) & ~noise
+    return {
+        'active_ratio': float(np.mean(active)),
+        'peak_dbfs': float(level.max()),
+        'zcr': float(np.mean(zcr))
+    }
+
+def skip_reason(segment, previous=None):
+    """分段不需要调用端点时返回原因 (silence / duplicate), 否则返回None"""
+    pcm = segment['pcm']
+    if SKIP_SILENT_SEGMENTS and segment_activity(pcm)['active_ratio'] < SILENCE_MIN_ACTIVE_RATIO:
+        return 'silence'
+    if SKIP_DUPLICATE_SEGMENTS and previous is not None and np.array_equal(previous['pcm'], pcm):
+        return 'duplicate'
+    return None
+
+def skipped_segment_record(segment, reason):
+    """跳过的分段记录为空文本, 并带有 skipped 字段"""
+    record = make_segment_record(segment['index'], segment['start_ms'], segment['end_ms'], '')
+    record['skipped'] = reason
+    return record
+
+def duplicate_segment_record(record, previous):
+    """与前一段完全相同的分段使用前一段的文本 (词级时间戳平移到本段的位置), 仍带有 skipped 字段
+
+    同一句话说了两遍时不会从转录中消失; 前一段出错时文本为空。
+    """
+    record = dict(record, text=previous['text'])
+    if previous.get('words'):
+        shift = record['start'] - previous['start']
+        record['words'] = [dict(w, start=round(w['start'] + shift, 3), end=round(w['end'] + shift, 3))
+                           for w in previous['words']]
+    return record
+
+# ---------------------------------------------------------------------------
+# 运行指标
+# ---------------------------------------------------------------------------
+
+class MetricsRegistry:
+    """进程内的计数器和当前值, 通过 /metrics 以Prometheus文本格式输出"""
+
+    def __init__(self):
+        self._counters = {}
+        self._gauges = {}
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name, help_text):
+        self._help[name] = help_text
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def value(self, name, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            return self._counters.get(key, self._gauges.get(key, 0))
+
+    def render(self):
+        with self._lock:
+            series = [(key, value, 'counter') for key, value in self._counters.items()]
+            series += [(key, value, 'gauge') for key, value in self._gauges.items()]
+        lines = []
+        described = set()
+        for (name, labels), value, kind in sorted(series, key=lambda item: item[0]):
+            if name not in described:
+                described.add(name)
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+            label_text = ','.join(f'{k}="{v}"' for k, v in labels)
+            lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+metrics.describe('whisper_segments_total',
+                 'Segments by outcome (transcribed, error, reused, stored, silence, duplicate)')
+metrics.describe('whisper_skipped_audio_seconds_total', 'Seconds of audio not sent to the endpoint, by reason')
+metrics.describe('whisper_queue_tasks_total', 'Queued segment tasks executed by this replica, by outcome')
+metrics.describe('whisper_backlog_segments', 'Segments of open jobs waiting for (queued) or in an endpoint call (in_flight)')
+metrics.describe('whisper_backlog_audio_seconds', 'Seconds of audio waiting for (queued) or in an endpoint call (in_flight)')
+metrics.describe('whisper_open_jobs', 'Transcription jobs currently running on this replica')
+metrics.describe('whisper_async_inferences_total', 'Async inference requests completed by outcome')
+metrics.describe('whisper_async_pending', 'Async inference requests waiting for a result')
+metrics.describe('whisper_endpoint_requests_total', 'Routed endpoint calls by endpoint and outcome')
+metrics.describe('whisper_endpoint_latency_ewma_seconds', 'Exponentially weighted endpoint call latency')
+metrics.describe('whisper_endpoint_error_rate', 'Exponentially weighted endpoint error rate')
+metrics.describe('whisper_trace_spans_total', 'Spans handed to the OTLP exporter by outcome (exported, dropped, failed)')
+metrics.describe('whisper_model_tier_jobs_total', 'Jobs routed to each model tier, by requested quality and reason (requested, short, default, backlog)')
+metrics.describe('whisper_model_tier_audio_seconds_total', 'Seconds of audio routed to each model tier')
+metrics.describe('whisper_warmup_requests_total', 'Endpoint warm-up requests by endpoint, reason (startup, idle) and outcome')
+metrics.describe('whisper_warmup_latency_seconds', 'Latency of the most recent warm-up request per endpoint')
+metrics.describe('whisper_first_call_seconds_sum', 'Latency of the first endpoint call of each job, by endpoint and state (warm, cold)')
+metrics.describe('whisper_first_call_seconds_count', 'First endpoint calls of jobs, by endpoint and state (warm, cold)')
+
+endpoint_warmer = EndpointWarmer()
+
+# ---------------------------------------------------------------------------
+# 链路追踪
+# 每个转录任务一条trace: 上传保存、解码、每个分段的序列化/调用/解析以及SSE推送各为一个span。
+# 跨请求 (/transcribe -> /stream) 和跨副本 (分布式队列) 时传递 {trace_id, span_id} 上下文;
+# 分段调用链上的函数通过 current_span() 取得所在分段的span, 不需要逐层传参。
+# 按trace_id采样, 未采样的任务使用空span, 开销可以忽略。span的字段与OpenTelemetry一致。
+# ---------------------------------------------------------------------------
+
+class NoopSpan:
+    """未启用追踪或未被采样时使用的空span, 所有操作都不做任何事"""
+
+    sampled = False
+    trace_id = None
+    span_id = None
+
+    def context(self):
+        return None
+
+    def child(self, name, **attributes):
+        return self
+
+    def set_attribute(self, key, value):
+        pass
+
+    def set_attributes(self, **attributes):
+        pass
+
+    def end(self, error=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+NOOP_SPAN = NoopSpan()
+
+class Span:
+    """一个计时区间; 作为上下文管理器使用时退出即结束, 异常记录为错误状态"""
+
+    sampled = True
+
+    def __init__(self, tracer, name, trace_id, parent_id=None, attributes=None):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.start_time = time.time()
+        self.end_time = None
+        self.status = 'ok'
+
+    def context(self):
+        """传给其他请求或副本的上下文, 可以保存在会话或队列任务中"""
+        return {'trace_id': self.trace_id, 'span_id': self.span_id, 'sampled': True}
+
+    def child(self, name, **attributes):
+        return Span(self.tracer, name, self.trace_id, self.span_id, attributes)
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def set_attributes(self, **attributes):
+        self.attributes.update(attributes)
+
+    def end(self, error=None):
+        if self.end_time is not None:
+            return
+        self.end_time = time.time()
+        if error is not None:
+            self.status = 'error'
+            self.attributes['error'] = str(error)[:500]
+        self.tracer.export(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # 客户端断开 (GeneratorExit) 不算错误
+        self.end(exc if isinstance(exc, Exception) else None)
+        return False
+
+    def to_dict(self):
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start_time': self.start_time,
+            'end_time': self.end_time,
+            'duration_ms': round((self.end_time - self.start_time) * 1000, 3) if self.end_time else None,
+            'status': self.status,
+            'attributes': self.attributes
+        }
+
+class Tracer:
+    """创建trace和span, 结束的span交给导出器; exporter 为 None 时只产生空span"""
+
+    def __init__(self, exporter=None, sample_rate=TRACE_SAMPLE_RATE):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+
+    @staticmethod
+    def new_trace_id():
+        # 前8位为秒级时间戳, 与X-Ray的trace ID格式兼容 (经ADOT Collector转发到X-Ray时需要)
+        return f"{int(time.time()):08x}{secrets.token_hex(12)}"
+
+    def sampled(self, trace_id):
+        # 用随机部分决定采样, 同一trace在所有副本上的结果相同
+        return int(trace_id[-8:], 16) < self.sample_rate * 0x100000000
+
+    def start_trace(self, name, **attributes):
+        """开始一条新trace的根span"""
+        if not self.exporter:
+            return NOOP_SPAN
+        trace_id = self.new_trace_id()
+        if not self.sampled(trace_id):
+            return NOOP_SPAN
+        return Span(self, name, trace_id, None, attributes)
+
+    def resume(self, context, name, **attributes):
+        """在其他请求或副本传来的上下文下开始一个子span; 没有上下文 (未采样) 时返回空span"""
+        if not self.exporter or not context or not context.get('sampled'):
+            return NOOP_SPAN
+        return Span(self, name, context['trace_id'], context.get('span_id'), attributes)
+
+    def export(self, span):
+        try:
+            self.exporter.export(span)
+        except Exception as e:
+            app.logger.warning(f"导出span {span.name} 失败: {str(e)}")
+
+def trace_owner(username):
+    """记录在根span上的任务所有者: 用户名的带密钥哈希, 导出的span中不出现用户名本身"""
+    if not username:
+        return None
+    key = app.secret_key if isinstance(app.secret_key, bytes) else str(app.secret_key).encode('utf-8')
+    return hmac.new(key, username.encode('utf-8'), hashlib.sha256).hexdigest()[:16]
+
+_current_span = contextvars.ContextVar('current_span', default=NOOP_SPAN)
+
+def current_span():
+    """当前线程正在处理的span (分段调用链上使用), 没有时返回空span"""
+    return _current_span.get()
+
+@contextmanager
+def use_span(span):
+    """在 with 块内把 span 设为当前span (不能跨越生成器的 yield)"""
+    token = _current_span.set(span)
+    try:
+        yield span
+    finally:
+        _current_span.reset(token)
+
+class InMemorySpanExporter:
+    """在进程内保存最近结束的span, 用于测试和单副本调试 (/api/traces)"""
+
+    def __init__(self, max_spans=TRACE_MEMORY_MAX_SPANS):
+        self._spans = deque(maxlen=max_spans)
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        with self._lock:
+            self._spans.append(span.to_dict())
+
+    def spans(self, trace_id=None):
+        with self._lock:
+            return [span for span in self._spans if trace_id is None or span['trace_id'] == trace_id]
+
+    def clear(self):
+        with self._lock:
+            self._spans.clear()
+
+class LoggingSpanExporter:
+    """每个span输出一行JSON日志, 由日志系统 (如 Fluent Bit -> CloudWatch Logs) 收集"""
+
+    def __init__(self, logger=None):
+        self.logger = logger or logging.getLogger('whisper.trace')
+
+    def export(self, span):
+        self.logger.info(json.dumps(span.to_dict(), ensure_ascii=False, default=str))
+
+def otlp_attribute_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': value if isinstance(value, str) else json.dumps(value, ensure_ascii=False, default=str)}
+
+class OTLPSpanExporter:
+    """以OTLP/HTTP JSON格式批量发送到 OpenTelemetry Collector (不依赖 opentelemetry SDK)
+
+    span先放入有界队列, 由后台线程每 interval 秒或攒满 batch_size 个发送一次;
+    Collector不可用时队列满后丢弃新的span, 不阻塞转录。
+    """
+
+    def __init__(self, endpoint=TRACE_OTLP_ENDPOINT, service_name=TRACE_SERVICE_NAME, interval=2.0,
+                 batch_size=512, max_queue=8192):
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.interval = interval
+        self.batch_size = batch_size
+        self._queue = queue.Queue(maxsize=max_queue)
+        threading.Thread(target=self._loop, name='otlp-exporter', daemon=True).start()
+
+    def export(self, span):
+        try:
+            self._queue.put_nowait(span.to_dict())
+        except queue.Full:
+            metrics.inc('whisper_trace_spans_total', outcome='dropped')
+
+    def _loop(self):
+        while True:
+            batch = []
+            deadline = time.time() + self.interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get(timeout=max(0.01, deadline - time.time())))
+                except queue.Empty:
+                    break
+            if batch:
+                self.send(batch)
+
+    def send(self, spans):
+        payload = {'resourceSpans': [{
+            'resource': {'attributes': [
+                {'key': 'service.name', 'value': {'stringValue': self.service_name}},
+                {'key': 'host.name', 'value': {'stringValue': socket.gethostname()}}
+            ]},
+            'scopeSpans': [{'scope': {'name': 'whisper-webui'}, 'spans': [{
+                'traceId': span['trace_id'],
+                'spanId': span['span_id'],
+                'parentSpanId': span['parent_id'] or '',
+                'name': span['name'],
+                'kind': 1,
+                'startTimeUnixNano': str(int(span['start_time'] * 1e9)),
+                'endTimeUnixNano': str(int(span['end_time'] * 1e9)),
+                'attributes': [{'key': key, 'value': otlp_attribute_value(value)}
+                               for key, value in span['attributes'].items() if value is not None],
+                'status': {'code': 2, 'message': span['attributes'].get('error', '')}
+                          if span['status'] == 'error' else {'code': 1}
+            } for span in spans]}]
+        }]}
+        request_obj = urllib.request.Request(self.endpoint, data=json.dumps(payload).encode('utf-8'),
+                                             headers={'Content-Type': 'application/json'}, method='POST')
+        try:
+            with urllib.request.urlopen(request_obj, timeout=10) as response:
+                response.read()
+            metrics.inc('whisper_trace_spans_total', len(spans), outcome='exported')
+        except Exception as e:
+            metrics.inc('whisper_trace_spans_total', len(spans), outcome='failed')
+            app.logger.warning(f"发送 {len(spans)} 个span到 {self.endpoint} 失败: {str(e)}")
+
+SPAN_EXPORTERS = {
+    'log': LoggingSpanExporter,
+    'memory': InMemorySpanExporter,
+    'otlp': OTLPSpanExporter,
+}
+
+def create_tracer():
+    """按 TRACE_EXPORTER 创建追踪器, 未配置或未知的导出器不追踪"""
+    if not TRACE_EXPORTER or TRACE_EXPORTER == 'none':
+        return Tracer()
+    if TRACE_EXPORTER not in SPAN_EXPORTERS:
+        app.logger.error(f"未知的 TRACE_EXPORTER: {TRACE_EXPORTER}, 不启用链路追踪")
+        return Tracer()
+    app.logger.info(f"链路追踪: {TRACE_EXPORTER}, 采样比例 {TRACE_SAMPLE_RATE}")
+    return Tracer(SPAN_EXPORTERS[TRACE_EXPORTER](), TRACE_SAMPLE_RATE)
+
+tracer = create_tracer()
+
+# ---------------------------------------------------------------------------
+# 性能分析
+# 管理员可以在线上对接下来 N 个请求或 T 秒内的转录工作开启 cProfile 或调用栈采样, 不需要重新部署:
+# cProfile 只分析请求线程 (解码、合并、JSON编码和输出), 结果为pstats文件;
+# 采样器定时采集所有线程 (含分段调度线程) 的调用栈, 输出火焰图工具使用的折叠栈格式。
+# 内存增长用 tracemalloc 快照与基线的差异定位。分析结果只保存在本副本。
+# ---------------------------------------------------------------------------
+
+# 线程在这些函数中等待时不计入采样 (空闲的工作线程和服务器线程)
+IDLE_FRAMES = {
+    ('threading.py', 'wait'), ('threading.py', '_wait_for_tstate_lock'), ('queue.py', 'get'),
+    ('selectors.py', 'select'), ('socketserver.py', 'serve_forever'), ('thread.py', '_worker'),
+}
+
+def frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+class StackSampler:
+    """后台线程每 interval 秒采集一次其他所有线程的调用栈, 按折叠栈 (线程名;外层函数;...;内层函数) 计数
+
+    到达 deadline 或调用 stop 时停止采样。
+    """
+
+    def __init__(self, interval=PROFILE_SAMPLE_INTERVAL_MS / 1000.0, include_idle=False, deadline=None):
+        self.interval = interval
+        self.include_idle = include_idle
+        self.deadline = deadline
+        self.samples = Counter()
+        self.sample_count = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name='stack-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def _loop(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            if self.deadline and time.time() >= self.deadline:
+                break
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                code = frame.f_code
+                if not self.include_idle and (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(frame_label(frame))
+                    frame = frame.f_back
+                # 线程池的线程名去掉序号, 同一线程池的样本合并在一起
+                thread_name = re.sub(r'[-_]\d+\b', '', names.get(ident, 'thread')).replace(';', ':')
+                self.samples[';'.join([thread_name] + stack[::-1])] += 1
+            self.sample_count += 1
+
+    def collapsed(self):
+        """折叠栈文本, 可以直接交给 flamegraph.pl、speedscope 或 inferno"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+class ProfileSession:
+    """一次性能分析: mode 为 cprofile 或 sampler, 分析接下来 requests 个请求, 或 seconds 秒内开始的请求"""
+
+    def __init__(self, mode, requests=None, seconds=None, interval=None, include_idle=False):
+        self.mode = mode
+        self.max_requests = requests
+        self.started_at = time.time()
+        self.deadline = self.started_at + min(seconds or PROFILE_MAX_SECONDS, PROFILE_MAX_SECONDS)
+        self.requests = 0
+        self.skipped = 0
+        self.active = 0
+        self.finished_at = None
+        self.stats = None
+        self.sampler = None
+        if mode == 'sampler':
+            self.sampler = StackSampler(interval or PROFILE_SAMPLE_INTERVAL_MS / 1000.0, include_idle, self.deadline)
+            self.sampler.start()
+
+    def accepting(self, now):
+        if self.finished_at or now >= self.deadline:
+            return False
+        return self.max_requests is None or self.requests < self.max_requests
+
+    def status(self):
+        return {
+            'mode': self.mode,
+            'running': self.finished_at is None,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'deadline': self.deadline,
+            'max_requests': self.max_requests,
+            'requests': self.requests,
+            'skipped_requests': self.skipped,
+            'active_requests': self.active,
+            'samples': self.sampler.sample_count if self.sampler else None
+        }
+
+class RequestProfile:
+    """单个请求的分析句柄, 在请求线程中开始和结束"""
+
+    def __init__(self, profiler, session, name):
+        self.profiler = profiler
+        self.session = session
+        self.name = name
+        self.profile = None
+        if session.mode == 'cprofile':
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+                self.profile = profile
+            except ValueError as e:
+                # 进程中已有其他分析工具在运行, 这个请求不分析, 请求本身照常处理
+                app.logger.warning(f"无法启用cProfile: {str(e)}")
+
+    def end(self):
+        if self.profile is not None:
+            self.profile.disable()
+        self.profiler._finish_request(self)
+
+class RequestProfiler:
+    """管理当前的性能分析; 同一时间只有一个分析在进行, 结束后保留结果直到下一次开始
+
+    cprofile 模式同一时间只分析一个请求 (Python 3.12 起同时启用第二个 cProfile 会抛出 ValueError),
+    与之并发的请求不分析, 计入 skipped_requests; 需要覆盖并发请求时使用 sampler 模式。
+    """
+
+    def __init__(self):
+        self.session = None
+        self._cprofile_active = False
+        self._lock = threading.Lock()
+
+    def start(self, mode, requests=None, seconds=None, interval=None, include_idle=False):
+        if mode not in ('cprofile', 'sampler'):
+            raise ValueError("mode must be cprofile or sampler")
+        if requests is None and seconds is None:
+            raise ValueError("requests or seconds is required")
+        with self._lock:
+            if self.session and self.session.finished_at is None:
+                raise RuntimeError("A profile is already running")
+            self.session = ProfileSession(mode, requests, seconds, interval, include_idle)
+            app.logger.info(f"开始性能分析: {mode}, 请求数 {requests}, 时长 {seconds}")
+            return self.session.status()
+
+    def begin(self, name):
+        """请求开始时调用, 当前没有需要分析的请求时返回None"""
+        session = self.session
+        if session is None or session.finished_at is not None:
+            return None
+        with self._lock:
+            if not session.accepting(time.time()):
+                self._check_finished(session)
+                return None
+            if session.mode == 'cprofile':
+                if self._cprofile_active:
+                    session.skipped += 1
+                    return None
+                self._cprofile_active = True
+            session.requests += 1
+            session.active += 1
+        return RequestProfile(self, session, name)
+
+    def _finish_request(self, handle):
+        session = handle.session
+        with self._lock:
+            session.active -= 1
+            if session.mode == 'cprofile':
+                self._cprofile_active = False
+            if handle.profile is not None:
+                if session.stats is None:
+                    session.stats = pstats.Stats(handle.profile)
+                else:
+                    session.stats.add(handle.profile)
+            self._check_finished(session)
+
+    def _check_finished(self, session, force=False):
+        """请求数达到上限或超时, 且分析中的请求都已结束时结束分析 (调用方持有锁)"""
+        if session.finished_at is not None:
+            return
+        if not force and (session.active > 0 or session.accepting(time.time())):
+            return
+        session.finished_at = time.time()
+        if session.sampler:
+            session.sampler.stop()
+        app.logger.info(f"性能分析结束: {session.requests} 个请求")
+
+    def stop(self):
+        with self._lock:
+            session = self.session
+            if session:
+                self._check_finished(session, force=True)
+            return session.status() if session else None
+
+    def status(self):
+        with self._lock:
+            session = self.session
+            if session:
+                self._check_finished(session)
+            return session.status() if session else None
+
+    def result(self, output_format, limit=50):
+        """分析结果: collapsed (折叠栈, 仅采样器), pstats (marshal格式, 可用 snakeviz/flameprof 打开), text (按累计耗时排序)"""
+        session = self.session
+        if session is None:
+            return None
+        if output_format == 'collapsed':
+            if not session.sampler:
+                raise ValueError("collapsed stacks are only available in sampler mode")
+            return session.sampler.collapsed()
+        if session.stats is None:
+            raise ValueError("no cProfile data (sampler mode, or no request has finished yet)")
+        with self._lock:
+            if output_format == 'pstats':
+                return marshal.dumps(session.stats.stats)
+            stream = io.StringIO()
+            stats = pstats.Stats(stream=stream)
+            stats.add(session.stats)
+            stats.sort_stats('cumulative').print_stats(limit)
+            return stream.getvalue()
+
+request_profiler = RequestProfiler()
+
+def profiled(iterator, handle):
+    """迭代结束 (或客户端断开) 后结束请求的性能分析"""
+    try:
+        for item in iterator:
+            yield item
+    finally:
+        if handle:
+            handle.end()
+
+class MemoryProfiler:
+    """tracemalloc 快照差异: start 时记录基线, diff 返回之后增长最多的分配位置"""
+
+    def __init__(self):
+        self.baseline = None
+        self._lock = threading.Lock()
+
+    def start(self, frames=10):
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(frames)
+            self.baseline = tracemalloc.take_snapshot()
+            return self.status()
+
+    def stop(self):
+        with self._lock:
+            self.baseline = None
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+            return self.status()
+
+    def status(self):
+        current, peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+        return {'tracing': tracemalloc.is_tracing(), 'traced_bytes': current, 'peak_bytes': peak,
+                'frames': tracemalloc.get_traceback_limit() if tracemalloc.is_tracing() else None}
+
+    def diff(self, key_type='lineno', limit=30, reset=False):
+        """与基线比较, 按增长的字节数排序; reset 为真时以本次快照作为新的基线"""
+        with self._lock:
+            if self.baseline is None:
+                raise ValueError("tracemalloc is not running")
+            snapshot = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            ])
+            stats = snapshot.compare_to(self.baseline, key_type)
+            if reset:
+                self.baseline = snapshot
+        return [{
+            'size_diff': stat.size_diff,
+            'size': stat.size,
+            'count_diff': stat.count_diff,
+            'count': stat.count,
+            'traceback': [f"{frame.filename}:{frame.lineno}" for frame in stat.traceback]
+        } for stat in stats[:limit]]
+
+memory_profiler = MemoryProfiler()
+
+# ---------------------------------------------------------------------------
+# 积压与容量
+# 端点按调用次数扩缩容, 但只有web应用知道所有打开的转录任务还有多少分段等待发送。
+# 按端点统计等待中和调用中的分段数及音频时长, 通过 /metrics 和 /api/capacity (可选 CAPACITY_TOKEN 令牌) 提供给自动扩缩容。
+# ---------------------------------------------------------------------------
+
+class JobBacklog:
+    """单个转录任务尚未开始处理的分段, 任务结束时剩余的分段从积压中移除"""
+
+    def __init__(self, tracker, endpoint, segments):
+        self.tracker = tracker
+        self.endpoint = endpoint
+        self._pending = {segment['index']: len(segment['pcm']) / SAMPLE_RATE for segment in segments}
+        self._lock = threading.Lock()
+        tracker._update(endpoint, queued=len(self._pending), queued_seconds=sum(self._pending.values()), jobs=1)
+
+    def start(self, segment):
+        """分段开始处理 (调用端点、跳过或复用), 不再计入等待中"""
+        with self._lock:
+            seconds = self._pending.pop(segment['index'], None)
+        if seconds is not None:
+            self.tracker._update(self.endpoint, queued=-1, queued_seconds=-seconds)
+
+    def close(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        self.tracker._update(self.endpoint, queued=-len(pending), queued_seconds=-sum(pending.values()), jobs=-1)
+
+class CapacityTracker:
+    """按端点统计打开的任务数、等待中和调用中的分段数及音频时长"""
+
+    FIELDS = ('jobs', 'queued', 'queued_seconds', 'in_flight', 'in_flight_seconds')
+
+    def __init__(self, registry=None):
+        self.registry = registry
+        self._state = {}
+        self._lock = threading.Lock()
+
+    def _update(self, endpoint, **deltas):
+        with self._lock:
+            state = self._state.setdefault(endpoint, dict.fromkeys(self.FIELDS, 0))
+            for key, delta in deltas.items():
+                state[key] += delta
+            snapshot = dict(state)
+        if self.registry:
+            self.registry.set('whisper_open_jobs', snapshot['jobs'], endpoint=endpoint)
+            self.registry.set('whisper_backlog_segments', snapshot['queued'], endpoint=endpoint, state='queued')
+            self.registry.set('whisper_backlog_segments', snapshot['in_flight'], endpoint=endpoint, state='in_flight')
+            self.registry.set('whisper_backlog_audio_seconds', round(snapshot['queued_seconds'], 3),
+                              endpoint=endpoint, state='queued')
+            self.registry.set('whisper_backlog_audio_seconds', round(snapshot['in_flight_seconds'], 3),
+                              endpoint=endpoint, state='in_flight')
+
+    def open_job(self, endpoint, segments):
+        return JobBacklog(self, endpoint, segments)
+
+    @contextmanager
+    def in_flight(self, endpoint, seconds):
+        """包裹一次端点调用"""
+        self._update(endpoint, in_flight=1, in_flight_seconds=seconds)
+        try:
+            yield
+        finally:
+            self._update(endpoint, in_flight=-1, in_flight_seconds=-seconds)
+
+    def snapshot(self):
+        with self._lock:
+            state = {endpoint: dict(values) for endpoint, values in self._state.items()}
+        return {endpoint: {
+            'open_jobs': values['jobs'],
+            'queued_segments': values['queued'],
+            'in_flight_segments': values['in_flight'],
+            'queued_audio_seconds': round(values['queued_seconds'], 3),
+            'in_flight_audio_seconds': round(values['in_flight_seconds'], 3),
+            'backlog_audio_seconds': round(values['queued_seconds'] + values['in_flight_seconds'], 3)
+        } for endpoint, values in state.items()}
+
+capacity_tracker = CapacityTracker(metrics)
+
+class TranscriptionEngine:
+    """可复用的转录引擎, 串联解码、分段、调度、合并四个阶段
+
+    run() 产出事件字典: init -> segment (按顺序, 每段一个) -> complete。
+    options 支持 hotwords_config、rolling_context、max_in_flight、payload_encoding, 以及 ranges
+    (只解码并转录 [(start, end)] 秒范围内的音频, 分段时间仍相对于整个文件)。
+    配置了共享队列 (broker) 时, 端点调用由所有副本的队列工作线程执行, 本副本只负责编排。
+    带 job_id 时结果写入转录结果存储: 已完成的任务直接回放存储的结果, 未完成的任务只转录缺失的分段。
+    任务成功完成后依次调用 on_complete 中的回调 (job, segments), 例如更新全文索引;
+    解码完成后依次调用 on_start 中的回调 (file_path, options, duration, total_segments), 例如记录流量。
+    配置了指纹索引时, 与已转录分段声学指纹相似的分段直接复用已有结果, 不调用端点。
+    静音分段和与前一段完全相同的分段也不调用端点, 记录中带有 skipped 字段。
+    options 中 language 固定转录语言; 未指定且 PIN_LANGUAGE 开启时, 第一段有语音的分段检测出的语言用于之后的所有分段。
+    options 中 fast_start 为真时, 在完整解码的同时先转录开头几秒, 以 provisional 事件推送
+    (可能早于 init 事件), 完整的第一段完成后由其 segment 事件替换。
+    每个任务一个 transcription span (options 中 trace 为入口请求的span时作为其子span), 解码和每个分段各一个子span。
+    predictor 为分级路由器时, 解码完成后按时长、options 中的 quality 和各档位积压选择模型档位。
+    """
+
+    def __init__(self, decoder=None, segmenter=None, dispatcher=None, predictor_factory=None, store=None,
+                 fingerprint_index=None, broker=None, max_in_flight=JOB_MAX_IN_FLIGHT, capacity=None):
+        self.decoder = decoder or AUDIO_DECODERS.get(AUDIO_DECODER, FfmpegDecoder)()
+        self.segmenter = segmenter or FixedSegmenter()
+        self.dispatcher = dispatcher or segment_dispatcher
+        self.predictor_factory = predictor_factory or get_predictor
+        self.store = store
+        self.fingerprint_index = fingerprint_index
+        self.broker = broker
+        self.max_in_flight = max_in_flight
+        self.capacity = capacity or capacity_tracker
+        self.on_start = []
+        self.on_complete = []
+
+    def run(self, file_path, options=None, predictor=None):
+        options = options or {}
+        parent = options.get('trace')
+        attributes = {'job_id': options.get('job_id'), 'entry': options.get('entry')}
+        if parent:
+            span = parent.child('transcription', **attributes)
+        else:
+            span = tracer.start_trace('transcription', owner=trace_owner(options.get('username')), **attributes)
+        error = None
+        try:
+            yield from self._run(file_path, options, predictor, span)
+        except Exception as e:
+            error = e
+            raise
+        except GeneratorExit:
+            span.set_attribute('cancelled', True)
+            raise
+        finally:
+            span.end(error)
+
+    def _run(self, file_path, options, predictor, span):
+        job_id = options.get('job_id')
+        store = self.store if job_id else None
+        job = None
+        if store:
+            job = store.get(job_id)
+            if job and job['status'] == 'complete':
+                app.logger.info(f"任务 {job_id} 已完成, 直接返回存储的结果")
+                span.set_attribute('cached', True)
+                yield from self.replay(job, store.get_segments(job_id))
+                return
+        
+        started = time.time()
+        predictor = predictor or self.predictor_factory()
+        if not predictor:
+            raise Exception("Failed to create SageMaker predictor")
+        
+        hotwords_config = options.get('hotwords_config') or DEFAULT_HOTWORDS_CONFIG
+        rolling_context = RollingContext() if options.get('rolling_context') else None
+        app.logger.info(f"使用热词配置: {hotwords_config}")
+        transcriber_args = (select_predictor(predictor, hotwords_config), hotwords_config, rolling_context, options.get('payload_encoding'),
+                            options.get('language'), options.get('pin_language', PIN_LANGUAGE))
+        transcriber = QueueTranscriber(self.broker, *transcriber_args) if self.broker else SegmentTranscriber(*transcriber_args)
+        endpoint = getattr(transcriber.predictor, 'endpoint_name', ENDPOINT_NAME)
+        
+        def decode():
+            with span.child('decode', decoder=type(self.decoder).__name__,
+                            ranges=len(options.get('ranges') or [])) as decode_span:
+                segments, decoded_samples = self.decode_segments(file_path, options.get('ranges'))
+                decode_span.set_attributes(audio_seconds=round(decoded_samples / SAMPLE_RATE, 3),
+                                           total_segments=len(segments))
+                return segments, decoded_samples
+        
+        first_result_seconds = None
+        # 中断后重新提交的任务第一段可能已经存储, 不做快速首段
+        if options.get('fast_start') and FAST_START_SECONDS > 0 and job is None:
+            decoding = run_in_thread(decode)
+            with self.capacity.in_flight(endpoint, FAST_START_SECONDS), \
+                    span.child('segment', segment_index=0, provisional=True) as first_span, use_span(first_span):
+                record = self.transcribe_first_window(file_path, options.get('ranges'), transcriber)
+            if record is not None:
+                first_result_seconds = time.time() - started
+                yield {
+                    "type": "provisional",
+                    "job_id": job_id,
+                    "segment": record,
+                    "transcript": record['text']
+                }
+            segments, decoded_samples = decoding.result()
+        else:
+            segments, decoded_samples = decode()
+        total_segments = len(segments)
+        duration = round(decoded_samples / SAMPLE_RATE, 3)
+        decode_seconds = time.time() - started
+        # 解码后才知道时长, 按时长重新选择推理后端 (auto 模式下短音频本地推理, 分级路由时还按质量和积压选择档位)
+        tier = select_tier(predictor, duration, options.get('quality'), self.capacity)
+        transcriber.tier = tier.name if tier else None
+        transcriber.predictor = select_predictor(tier.predictor if tier else predictor, hotwords_config, duration)
+        endpoint = getattr(transcriber.predictor, 'endpoint_name', ENDPOINT_NAME)
+        span.set_attributes(duration=duration, total_segments=total_segments, backend=endpoint, tier=transcriber.tier,
+                            hotword_method=hotwords_config.get('method') if hotwords_config.get('words') else None,
+                            rolling_context=rolling_context is not None)
+        for callback in self.on_start:
+            try:
+                callback(file_path, options, duration, total_segments)
+            except Exception as e:
+                app.logger.error(f"任务 {job_id} 开始回调出错: {str(e)}")
+        
+        # 已存储的分段 (中断后重新提交的任务) 不再调用端点
+        stored = {}
+        if store:
+            store.start_job({
+                'job_id': job_id,
+                'filename': options.get('filename'),
+                'username': options.get('username'),
+                'duration': duration,
+                'total_segments': total_segments,
+                'options': {key: options.get(key) for key in ('hotwords_config', 'rolling_context', 'language', 'ranges',
+                                                              'quality')}
+            })
+            stored = {record['index']: record for record in store.get_segments(job_id)}
+        
+        yield {
+            "type": "init",
+            "job_id": job_id,
+            "cached": False,
+            "total_segments": total_segments,
+            "duration": duration,
+            "ranges": options.get('ranges'),
+            "hotwords_config": hotwords_config,
+            "rolling_context": rolling_context is not None,
+            "language": transcriber.language
+        }
+        
+        fingerprint_index = self.fingerprint_index
+        variant = fingerprint_variant(hotwords_config, options.get('language'), transcriber.tier, options.get('username'),
+                                      rolling_context is not None)
+        
+        def transcribe(segment):
+            with span.child('segment', segment_index=segment['index'],
+                            audio_seconds=round(len(segment['pcm']) / SAMPLE_RATE, 3)) as segment_span, \
+                    use_span(segment_span):
+                record = transcribe_segment(segment)
+                if segment['index'] in stored:
+                    outcome = 'stored'
+                else:
+                    outcome = record.get('skipped') or ('reused' if record.get('reused') else
+                                                        'error' if record.get('error') else 'transcribed')
+                segment_span.set_attribute('outcome', outcome)
+                return record
+        
+        def transcribe_segment(segment):
+            record = stored.get(segment['index'])
+            if record is not None:
+                if rolling_context:
+                    rolling_context.record(record['index'], record['text'])
+                metrics.inc('whisper_segments_total', outcome='stored')
+                return record
+            backlog.start(segment)
+            
+            # decode_segments 保证分段序号与列表位置一致
+            reason = skip_reason(segment, segments[segment['index'] - 1] if segment['index'] else None)
+            if reason:
+                app.logger.info(f"分段 {segment['index']+1} 跳过 ({reason})")
+                record = skipped_segment_record(segment, reason)
+                metrics.inc('whisper_segments_total', outcome=reason)
+                metrics.inc('whisper_skipped_audio_seconds_total', round(record['end'] - record['start'], 3),
+                            reason=reason)
+                # 重复分段在按顺序合并时从前一段复制文本后再保存
+                if store and reason != 'duplicate':
+                    store.save_segment(job_id, record)
+                return record
+            
+            fingerprint = compute_fingerprint(segment['pcm']) if fingerprint_index else None
+            match = fingerprint_index.lookup(fingerprint, variant) if fingerprint is not None else None
+            if match:
+                source, similarity = match
+                app.logger.info(f"分段 {segment['index']+1} 与已转录分段相似 ({similarity:.3f}), 复用结果")
+                record = reuse_segment_record(segment, source, similarity)
+                if rolling_context:
+                    rolling_context.record(record['index'], record['text'])
+                metrics.inc('whisper_segments_total', outcome='reused')
+            else:
+                # 任务的第一次端点调用按调用前的空闲时间区分冷/热 (分布式模式下由队列工作线程调用, 不统计)
+                first = not self.broker and first_call.acquire(blocking=False)
+                idle = endpoint_warmer.idle_for(transcriber.predictor) if first else None
+                call_started = time.time()
+                with self.capacity.in_flight(endpoint, len(segment['pcm']) / SAMPLE_RATE):
+                    record = transcriber(segment)
+                if idle is not None and not record.get('error'):
+                    endpoint_warmer.record_first_call(endpoint, idle, time.time() - call_started)
+                if fingerprint is not None and not record.get('error'):
+                    fingerprint_index.add(fingerprint, variant, record, job_id)
+                metrics.inc('whisper_segments_total', outcome='error' if record.get('error') else 'transcribed')
+            if store and not record.get('error'):
+                store.save_segment(job_id, record)
+            return record
+        
+        first_call = threading.Lock()
+        merger = TranscriptMerger()
+        max_in_flight = options.get('max_in_flight', self.max_in_flight)
+        backlog = self.capacity.open_job(endpoint, [segment for segment in segments if segment['index'] not in stored])
+        try:
+            for record in self.dispatcher.map_ordered(transcribe, segments, max_in_flight):
+                if record.get('skipped') == 'duplicate' and record['index'] not in stored and merger.segments:
+                    record = duplicate_segment_record(record, merger.segments[-1])
+                    if store:
+                        store.save_segment(job_id, record)
+                merger.add(record)
+                if first_result_seconds is None:
+                    first_result_seconds = time.time() - started
+                yield {
+                    "type": "segment",
+                    "segment": record,
+                    "skipped": record.get('skipped'),
+                    "current_segment": record['index'] + 1,
+                    "total_segments": total_segments,
+                    "progress": min(100, int(100 * (record['index'] + 1) / total_segments)),
+                    "transcript": merger.transcript
+                }
+        except Exception as e:
+            if store:
+                store.finish_job(job_id, 'failed', error=str(e))
+            raise
+        finally:
+            # 客户端断开或出错时, 未开始的分段不再计入积压
+            backlog.close()
+        
+        skipped_segments = Counter(record['skipped'] for record in merger.segments if record.get('skipped'))
+        if store:
+            failed = any(record.get('error') for record in merger.segments)
+            store.finish_job(job_id, 'failed' if failed else 'complete', merger.transcript, {
+                'decode_seconds': round(decode_seconds, 3),
+                'first_result_seconds': round(first_result_seconds or 0, 3),
+                'total_seconds': round(time.time() - started, 3),
+                'reused_segments': len(stored),
+                'fingerprint_matches': sum(1 for record in merger.segments if record.get('reused')),
+                'skipped_segments': dict(skipped_segments),
+                'language': transcriber.language,
+                'backend': endpoint,
+                'tier': transcriber.tier,
+                'trace_id': span.trace_id
+            }, error='Some segments failed' if failed else None)
+            if not failed:
+                job = {'job_id': job_id, 'filename': options.get('filename'), 'username': options.get('username'),
+                       'duration': duration}
+                for callback in self.on_complete:
+                    try:
+                        callback(job, merger.segments)
+                    except Exception as e:
+                        app.logger.error(f"任务 {job_id} 完成回调出错: {str(e)}")
+        
+        yield {
+            "type": "complete",
+            "job_id": job_id,
+            "skipped_segments": dict(skipped_segments),
+            "language": transcriber.language,
+            "transcript": merger.transcript
+        }
+
+    def transcribe_first_window(self, file_path, ranges, transcriber):
+        """只解码并转录开头 FAST_START_SECONDS 秒, 返回临时分段记录; 静音或出错时返回None"""
+        start, end = ranges[0] if ranges else (0, None)
+        window = FAST_START_SECONDS if end is None else min(FAST_START_SECONDS, end - start)
+        try:
+            pcm = self.decoder.decode(file_path, start=start or None, duration=window)
+        except Exception as e:
+            app.logger.error(f"快速首段解码失败: {str(e)}")
+            return None
+        segment = {
+            'index': 0,
+            'start_ms': int(start * 1000),
+            'end_ms': int(start * 1000) + len(pcm) * 1000 // SAMPLE_RATE,
+            'pcm': pcm
+        }
+        if skip_reason(segment):
+            return None
+        record = transcriber(segment, provisional=True)
+        if record.get('error'):
+            return None
+        record['provisional'] = True
+        return record
+
+    def replay(self, job, segments):
+        """按正常转录的事件顺序回放存储的任务结果"""
+        total_segments = len(segments)
+        yield {
+            "type": "init",
+            "job_id": job['job_id'],
+            "cached": True,
+            "total_segments": total_segments,
+            "duration": job.get('duration'),
+            "ranges": (job.get('options') or {}).get('ranges')
+        }
+        merger = TranscriptMerger()
+        for position, record in enumerate(segments, 1):
+            merger.add(record)
+            yield {
+                "type": "segment",
+                "segment": record,
+                "skipped": record.get('skipped'),
+                "current_segment": record['index'] + 1,
+                "total_segments": total_segments,
+                "progress": min(100, int(100 * position / total_segments)),
+                "transcript": merger.transcript
+            }
+        yield {
+            "type": "complete",
+            "job_id": job['job_id'],
+            "skipped_segments": dict(Counter(r['skipped'] for r in segments if r.get('skipped'))),
+            "transcript": job.get('transcript') or merger.transcript
+        }
+
+    def decode_segments(self, file_path, ranges=None):
+        """解码并切分音频, 返回 (分段列表, 解码的总采样数); 指定 ranges 时逐个范围定位解码"""
+        if not ranges:
+            pcm = self.decoder.decode(file_path)
+            return list(self.segmenter.split(pcm)), len(pcm)
+        
+        segments = []
+        decoded_samples = 0
+        for start, end in ranges:
+            pcm = self.decoder.decode(file_path, start=start, duration=None if end is None else end - start)
+            decoded_samples += len(pcm)
+            segments.extend(self.segmenter.split(pcm, offset_ms=int(start * 1000), first_index=len(segments)))
+        return segments, decoded_samples
+
+    def iter_segments(self, file_path, options=None, predictor=None):
+        """只产出分段记录, 供结构化输出格式使用"""
+        for event in self.run(file_path, options, predictor):
+            if event['type'] == 'segment':
+                yield event['segment']
+
+class TrafficRecorder:
+    """把每个进入流水线的任务的匿名元数据追加写入JSONL文件, 供 loadgen.py 按原始到达时间回放
+
+    只记录到达时间、入口、音频格式和时长、热词数量和方式等选项, 不记录文件名、用户名、热词内容和转录结果。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def record(self, file_path, options, duration, total_segments):
+        hotwords_config = options.get('hotwords_config') or {}
+        words = hotwords_config.get('words') or []
+        entry = {
+            'arrived_at': round(options.get('arrived_at') or time.time(), 3),
+            'entry': options.get('entry', 'stream'),
+            # 上传的临时文件保留原始扩展名 (secure_filename 处理后的文件名可能丢失扩展名, 批量任务没有文件名)
+            'format': os.path.splitext(file_path)[1].lower().lstrip('.') or None,
+            'duration': duration,
+            'total_segments': total_segments,
+            'hotword_count': len(words),
+            'hotword_method': hotwords_config.get('method') if words else None,
+            'rolling_context': bool(options.get('rolling_context')),
+            'fast_start': bool(options.get('fast_start')),
+            'language': options.get('language'),
+            'quality': options.get('quality'),
+            'ranges': len(options.get('ranges') or [])
+        }
+        line = json.dumps(entry) + "\n"
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+
+segment_dispatcher = SegmentDispatcher()
+transcript_store = create_transcript_store()
+search_index = create_search_index()
+fingerprint_index = create_fingerprint_index()
+work_broker = create_work_broker()
+if work_broker:
+    # 分布式模式下调度线程只等待队列结果, 不直接调用端点, 因此线程数按在途分段数配置
+    transcription_engine = TranscriptionEngine(
+        dispatcher=SegmentDispatcher(max_workers=max(SEGMENT_WORKERS, QUEUE_JOB_MAX_IN_FLIGHT * BATCH_FILE_WORKERS)),
+        store=transcript_store, fingerprint_index=fingerprint_index, broker=work_broker,
+        max_in_flight=QUEUE_JOB_MAX_IN_FLIGHT
+    )
+    queue_worker = QueueWorker(work_broker)
+    if QUEUE_WORKERS > 0:
+        queue_worker.start()
+else:
+    transcription_engine = TranscriptionEngine(store=transcript_store, fingerprint_index=fingerprint_index)
+if search_index:
+    transcription_engine.on_complete.append(search_index.index_job)
+traffic_recorder = TrafficRecorder(TRAFFIC_LOG) if TRAFFIC_LOG else None
+if traffic_recorder:
+    transcription_engine.on_start.append(traffic_recorder.record)
+    app.logger.info(f"记录流量元数据到 {TRAFFIC_LOG}")
+
+@app.before_request
+def start_endpoint_warmer():
+    """第一个请求到达时启动预热线程 (python app.py 启动时已经启动), 导入模块 (基准测试、工具脚本) 不会调用端点"""
+    endpoint_warmer.start()
+
+async_engine = None
+async_jobs = {}
+async_jobs_lock = threading.Lock()
+if ASYNC_ENDPOINT:
+    # 调度线程只等待异步结果, 线程数按所有异步任务的在途分段数配置
+    async_engine = TranscriptionEngine(
+        dispatcher=SegmentDispatcher(max_workers=ASYNC_MAX_IN_FLIGHT * ASYNC_JOB_WORKERS),
+        predictor_factory=get_async_predictor, store=transcript_store, fingerprint_index=fingerprint_index,
+        max_in_flight=ASYNC_MAX_IN_FLIGHT
+    )
+    async_executor = ThreadPoolExecutor(max_workers=ASYNC_JOB_WORKERS, thread_name_prefix='async-job')
+    if search_index:
+        async_engine.on_complete.append(search_index.index_job)
+    if traffic_recorder:
+        async_engine.on_start.append(traffic_recorder.record)
+
+def prune_async_jobs(now=None):
+    """删除保留时间已过的失败任务, 调用时需持有 async_jobs_lock"""
+    now = now or time.time()
+    for job_id in [job_id for job_id, job in async_jobs.items()
+                   if job['status'] == 'failed' and now - job['failed_at'] >= ASYNC_FAILED_TTL_SECONDS]:
+        del async_jobs[job_id]
+
+def run_async_job(file_path, options):
+    """在后台线程中运行异步转录任务, 解码完成前的状态记录在 async_jobs 中"""
+    job_id = options['job_id']
+    with async_jobs_lock:
+        async_jobs[job_id]['status'] = 'decoding'
+    try:
+        for event in async_engine.run(file_path, options):
+            if event['type'] == 'init':
+                with async_jobs_lock:
+                    async_jobs.pop(job_id, None)
     except Exception as e:
-        app.logger.error(f"Error in transcription: {str(e)}")
-        # 发送错误信息
-        yield "data: " + json.dumps({
-            "type": "error",
-            "message": str(e)
-        }) + "\n\n"
-        
-        # Delete temp file
+        app.logger.error(f"异步任务 {job_id} 失败: {str(e)}")
+        with async_jobs_lock:
+            if job_id in async_jobs:
+                async_jobs[job_id].update(status='failed', error=str(e), failed_at=time.time())
+    finally:
         try:
             os.unlink(file_path)
-        except:
+        except OSError:
             pass
 
-def get_header_html():
-    """Return the HTML header part"""
-    return f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>Whisper Language Assistant</title>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <style>
-            body {{
-                font-family: Arial, sans-serif;
-                max-width: 800px;
-                margin: 0 auto;
-                padding: 20px;
-            }}
-            .header {{
-                display: flex;
-                justify-content: space-between;
-                align-items: center;
-                margin-bottom: 20px;
-            }}
-            .form-group {{
-                margin-bottom: 15px;
-            }}
-            .btn {{
-                padding: 10px 15px;
-                background-color: #4CAF50;
-                color: white;
-                border: none;
-                cursor: pointer;
-                margin-right: 10px;
-                text-decoration: none;
-                display: inline-block;
-            }}
-            .result {{
-                margin-top: 20px;
-                padding: 15px;
-                border: 1px solid #ddd;
-                border-radius: 4px;
-            }}
-            .alert {{
-                padding: 15px;
-                margin-bottom: 20px;
-                border: 1px solid transparent;
-            }}
-            .alert-danger {{
-                color: #721c24;
-                background-color: #f8d7da;
-                border-color: #f5c6cb;
-            }}
-            .alert-success {{
-                color: #155724;
-                background-color: #d4edda;
-                border-color: #c3e6cb;
-            }}
-            .progress {{
-                height: 20px;
-                background-color: #f5f5f5;
-                border-radius: 4px;
-                overflow: hidden;
-            }}
-            .progress-bar {{
-                height: 100%;
-                background-color: #4CAF50;
-                color: white;
-                text-align: center;
-                line-height: 20px;
-            }}
-        </style>
-        <script>
-            // 添加JavaScript以处理完成后的行为
-            window.onload = function() {{
-                // 检查是否是最终结果页面
-                if (document.querySelector('.alert-success')) {{
-                    // 已完成，添加返回按钮的事件处理
-                    const backBtn = document.querySelector('a[href="{url_for('index')}"]');
-                    if (backBtn) {{
-                        backBtn.addEventListener('click', function(e) {{
-                            // 使用正常的导航，而不是表单提交
-                            // 不需要阻止默认行为
-                        }});
-                    }}
-                }}
-            }};
-        </script>
-    </head>
-    <body>
-        <div class="header">
-            <h1>Whisper Language Assistant</h1>
-            <div>
-                <a href="{url_for('index')}" class="btn">Back</a>
-                <a href="{url_for('logout')}" class="btn">Logout</a>
-            </div>
-        </div>
-    """
-
-def get_footer_html():
-    """Return the HTML footer part"""
-    return """
-    </body>
-    </html>
-    """
+def cleanup_after(iterator, file_path, span=NOOP_SPAN):
+    """迭代结束 (或客户端断开) 后删除临时文件并结束请求的span"""
+    try:
+        for item in iterator:
+            yield item
+    finally:
+        span.end()
+        try:
+            os.unlink(file_path)
+        except:
+            pass
 
 # 添加一个新的API端点，直接处理文件并返回结果 (不使用SSE)
 @app.route('/api/transcribe', methods=['POST'])
@@ -417,73 +4329,504 @@ def api_transcribe():
     
     if file.filename == '':
         return jsonify({'error': 'No file selected'}), 400
+    
+    output_format = (request.form.get('format') or request.args.get('format') or 'json').lower()
+    if output_format not in OUTPUT_FORMATS:
+        return jsonify({'error': f"Invalid format. Use one of: {', '.join(OUTPUT_FORMATS)}"}), 400
+    writer, mimetype = OUTPUT_FORMATS[output_format]
+    
+    file_ext = os.path.splitext(file.filename.lower())[1]
+    if file_ext not in SUPPORTED_FORMATS:
+        return jsonify({'error': f"Unsupported file format. Supported formats: {', '.join(SUPPORTED_FORMATS)}"}), 400
         
-    if file and file.filename.endswith('.mp3'):
-        # Save file to temp location
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.mp3') as temp:
-            file.save(temp.name)
-            temp_filename = temp.name
-            
+    try:
+        time_ranges = parse_time_ranges(request.form or request.args)
+    except (ValueError, TypeError) as e:
+        return jsonify({'error': f'Invalid time range: {str(e)}'}), 400
+    try:
+        language = parse_language_param(request.form.get('language', request.args.get('language', DEFAULT_LANGUAGE)))
+    except ValueError as e:
+        return jsonify({'error': f'Invalid language: {str(e)}'}), 400
+    try:
+        quality = parse_quality_param(request.form.get('quality', request.args.get('quality')))
+    except ValueError as e:
+        return jsonify({'error': f'Invalid quality: {str(e)}'}), 400
+        
+    span = tracer.start_trace('http.api_transcribe', format=file_ext[1:], output_format=output_format,
+                              owner=trace_owner(session.get('username')))
+    # Save file to temp location
+    with span.child('upload.save') as save_span, tempfile.NamedTemporaryFile(delete=False, suffix=file_ext) as temp:
+        file.save(temp.name)
+        temp_filename = temp.name
+        save_span.set_attribute('upload_bytes', os.path.getsize(temp_filename))
+    
+    options = {
+        'hotwords_config': resolve_hotwords_config(request),
+        'rolling_context': parse_bool_param(request.form.get('rolling_context')),
+        'language': language,
+        'quality': quality,
+        'ranges': time_ranges,
+        'filename': secure_filename(file.filename) or file.filename,
+        'username': session.get('username'),
+        'entry': 'api',
+        'trace': span
+    }
+    with span.child('upload.hash'):
+        options['job_id'] = compute_job_id(temp_filename, options)
+    span.set_attribute('job_id', options['job_id'])
+    
+    # 性能分析覆盖解码 (本请求中) 和之后流式输出的全部工作
+    profile = request_profiler.begin('api_transcribe')
+    events = transcription_engine.run(temp_filename, options)
+    try:
+        # 先完成创建predictor和解码, 这一步的错误仍可以返回500
+        next(events)
+    except Exception as e:
+        app.logger.error(f"Error in transcription: {str(e)}")
+        span.end(e)
+        if profile:
+            profile.end()
+        # 清理临时文件
         try:
-            # 直接处理音频并收集结果
-            predictor = get_predictor()
-            if not predictor:
-                return jsonify({'error': 'Failed to create SageMaker predictor'}), 500
-                
-            # Load audio file
-            audio_full = AudioSegment.from_file(temp_filename, format="mp3")
-            
-            # Whisper expects 16 kHz, mono channel, ≤30s
-            audio_full = audio_full.set_channels(1).set_frame_rate(16000)
-            
-            # Set chunk size to 30 seconds (in milliseconds)
-            chunk_ms = 30000
-            segments = list(range(0, len(audio_full), chunk_ms))
-            total_segments = len(segments)
-            
-            # Initialize empty transcript
-            transcripts = []
-            
-            # Process each chunk
-            for i, start_ms in enumerate(segments):
-                chunk = audio_full[start_ms:start_ms + chunk_ms]
-                
-                # Convert to numpy array and normalize to [-1, 1]
-                samples = np.array(chunk.get_array_of_samples(), dtype=np.float16)
-                samples = samples / 32768.0
-                
-                app.logger.info(f"Processing chunk {i+1}/{total_segments}, length: {len(samples)} samples")
-                
-                try:
-                    # 使用 predictor 而不是直接调用 boto3
-                    text = predictor.predict(samples)
-                    app.logger.info(f"Transcription result: {text[:100]}...")
-                    transcripts.append(text)
-                except Exception as e:
-                    app.logger.error(f"Error calling SageMaker endpoint: {str(e)}")
-                    error_message = f"[Error in segment {i+1}: {str(e)}]"
-                    transcripts.append(error_message)
-            
-            # Clean up the temp file
             os.unlink(temp_filename)
-            
-            # 返回完整转录结果
-            final_transcript = " ".join(transcripts).strip()
-            return jsonify({
+        except:
+            pass
+        return jsonify({'error': str(e)}), 500
+    
+    segments = (event['segment'] for event in events if event['type'] == 'segment')
+    # 按所选格式流式返回结果，避免在内存中拼接完整输出
+    body = writer(cleanup_after(segments, temp_filename, span))
+    response = Response(stream_with_context(profiled(body, profile) if profile else body), mimetype=mimetype)
+    response.headers['X-Job-Id'] = options['job_id']
+    if span.trace_id:
+        response.headers['X-Trace-Id'] = span.trace_id
+    return response
+
+# 异步转录API: 超长录音立即返回任务ID, 转录在后台通过异步推理端点完成, 客户端轮询任务状态
+@app.route('/api/transcribe/async', methods=['POST'])
+@login_required
+def api_transcribe_async():
+    if not async_engine:
+        return jsonify({'error': 'Async inference is disabled'}), 404
+    if not transcript_store:
+        return jsonify({'error': 'Async inference requires transcript storage'}), 404
+    file = request.files.get('audio_file')
+    if not file or file.filename == '':
+        return jsonify({'error': 'No file selected'}), 400
+    file_ext = os.path.splitext(file.filename.lower())[1]
+    if file_ext not in SUPPORTED_FORMATS:
+        return jsonify({'error': f"Unsupported file format. Supported formats: {', '.join(SUPPORTED_FORMATS)}"}), 400
+    try:
+        time_ranges = parse_time_ranges(request.form or request.args)
+    except (ValueError, TypeError) as e:
+        return jsonify({'error': f'Invalid time range: {str(e)}'}), 400
+    try:
+        language = parse_language_param(request.form.get('language', request.args.get('language', DEFAULT_LANGUAGE)))
+    except ValueError as e:
+        return jsonify({'error': f'Invalid language: {str(e)}'}), 400
+    try:
+        quality = parse_quality_param(request.form.get('quality', request.args.get('quality')))
+    except ValueError as e:
+        return jsonify({'error': f'Invalid quality: {str(e)}'}), 400
+    
+    span = tracer.start_trace('http.api_transcribe_async', format=file_ext[1:], owner=trace_owner(session.get('username')))
+    with span.child('upload.save') as save_span, tempfile.NamedTemporaryFile(delete=False, suffix=file_ext) as temp:
+        file.save(temp.name)
+        temp_filename = temp.name
+        save_span.set_attribute('upload_bytes', os.path.getsize(temp_filename))
+    
+    options = {
+        'hotwords_config': resolve_hotwords_config(request),
+        'rolling_context': parse_bool_param(request.form.get('rolling_context')),
+        'language': language,
+        'quality': quality,
+        'ranges': time_ranges,
+        'filename': secure_filename(file.filename) or file.filename,
+        'username': session.get('username'),
+        'entry': 'async',
+        'trace': span
+    }
+    with span.child('upload.hash'):
+        job_id = options['job_id'] = compute_job_id(temp_filename, options)
+    span.set_attribute('job_id', job_id)
+    span.end()
+    with async_jobs_lock:
+        prune_async_jobs()
+        async_jobs[job_id] = {'status': 'queued', 'username': options['username'], 'filename': options['filename'],
+                              'created_at': time.time()}
+    async_executor.submit(run_async_job, temp_filename, options)
+    app.logger.info(f"异步任务 {job_id} 已提交: {options['filename']}")
+    response = jsonify({'job_id': job_id, 'status': 'queued',
+                        'status_url': url_for('api_transcribe_async_status', job_id=job_id)})
+    if span.trace_id:
+        response.headers['X-Trace-Id'] = span.trace_id
+    return response, 202
+
+@app.route('/api/transcribe/async/<job_id>', methods=['GET'])
+@login_required
+def api_transcribe_async_status(job_id):
+    """异步任务的状态和进度; 完成后结果通过 /api/transcripts/<job_id> 获取"""
+    username = session.get('username')
+    job = transcript_store.get(job_id) if transcript_store else None
+    if not job:
+        with async_jobs_lock:
+            prune_async_jobs()
+            pending = dict(async_jobs.get(job_id) or {})
+        if not pending or pending.get('username') != username:
+            return jsonify({'error': 'Job not found'}), 404
+        return jsonify({'job_id': job_id, 'status': pending['status'], 'filename': pending.get('filename'),
+                        'error': pending.get('error')})
+    if job.get('username') != username:
+        return jsonify({'error': 'Job not found'}), 404
+    completed = len(transcript_store.get_segments(job_id))
+    total = job.get('total_segments') or 0
+    return jsonify(dict(job_summary(job), completed_segments=completed,
+                        progress=min(100, int(100 * completed / total)) if total else 0,
+                        transcript_url=url_for('api_transcript', job_id=job_id)))
+
+def extract_batch_files(request, supported_formats):
+    """将批量请求中的文件 (多个 audio_files 或一个 zip/tar 归档) 保存为临时文件
+
+    返回 [(原始文件名, 临时文件路径)]; 不支持的格式返回路径为 None 的条目。
+    """
+    entries = []
+    
+    def save_member(name, fileobj):
+        ext = os.path.splitext(name.lower())[1]
+        if ext not in supported_formats:
+            entries.append((name, None))
+            return
+        with tempfile.NamedTemporaryFile(delete=False, suffix=ext) as temp:
+            while True:
+                block = fileobj.read(1024 * 1024)
+                if not block:
+                    break
+                temp.write(block)
+            entries.append((name, temp.name))
+    
+    for file in request.files.getlist('audio_files') + request.files.getlist('audio_file'):
+        if file.filename:
+            save_member(file.filename, file.stream)
+    
+    archive = request.files.get('archive')
+    if archive and archive.filename:
+        archive_name = archive.filename.lower()
+        if archive_name.endswith('.zip'):
+            # zip 的目录位于文件末尾, 需要可随机访问的文件
+            with tempfile.TemporaryFile() as temp:
+                archive.save(temp)
+                temp.seek(0)
+                with zipfile.ZipFile(temp) as zf:
+                    for info in zf.infolist():
+                        if not info.is_dir():
+                            with zf.open(info) as member:
+                                save_member(info.filename, member)
+        else:
+            # tar/tar.gz 以流方式读取, 不需要先落盘整个归档
+            with tarfile.open(fileobj=archive.stream, mode='r|*') as tf:
+                for info in tf:
+                    if info.isfile():
+                        save_member(info.name, tf.extractfile(info))
+    return entries
+
+# 批量转录API: 一次请求处理多个文件，按完成顺序以NDJSON流式返回每个文件的结果
+@app.route('/api/transcribe/batch', methods=['POST'])
+@login_required
+def api_transcribe_batch():
+    try:
+        language = parse_language_param(request.form.get('language', DEFAULT_LANGUAGE))
+    except ValueError as e:
+        return jsonify({'error': f'Invalid language: {str(e)}'}), 400
+    try:
+        quality = parse_quality_param(request.form.get('quality'))
+    except ValueError as e:
+        return jsonify({'error': f'Invalid quality: {str(e)}'}), 400
+    try:
+        entries = extract_batch_files(request, SUPPORTED_FORMATS)
+    except (zipfile.BadZipFile, tarfile.TarError) as e:
+        return jsonify({'error': f'Invalid archive: {str(e)}'}), 400
+    
+    if not entries:
+        return jsonify({'error': 'No files provided'}), 400
+    
+    predictor = get_predictor()
+    if not predictor:
+        for _, path in entries:
+            if path:
+                os.unlink(path)
+        return jsonify({'error': 'Failed to create SageMaker predictor'}), 500
+    
+    # 所有文件的分段一次性提交给共享调度器, 由调度器的线程数限制并发
+    options = {
+        'hotwords_config': resolve_hotwords_config(request),
+        'language': language,
+        'quality': quality,
+        'max_in_flight': transcription_engine.dispatcher.max_workers,
+        'username': session.get('username'),
+        'entry': 'batch'
+    }
+    app.logger.info(f"批量转录: {len(entries)} 个文件")
+    
+    def process_entry(name, path):
+        started = time.time()
+        try:
+            file_options = dict(options, filename=name)
+            file_options['job_id'] = compute_job_id(path, file_options)
+            segments = list(transcription_engine.iter_segments(path, file_options, predictor))
+            return {
+                'filename': name,
+                'job_id': file_options['job_id'],
                 'success': True,
-                'transcript': final_transcript
-            })
-            
+                'transcript': " ".join(seg['text'] for seg in segments if seg['text']).strip(),
+                'segments': segments,
+                'elapsed': round(time.time() - started, 3)
+            }
         except Exception as e:
-            app.logger.error(f"Error in transcription: {str(e)}")
-            # 清理临时文件
+            app.logger.error(f"批量转录文件 {name} 失败: {str(e)}")
+            return {'filename': name, 'success': False, 'error': str(e)}
+        finally:
             try:
-                os.unlink(temp_filename)
+                os.unlink(path)
             except:
                 pass
-            return jsonify({'error': str(e)}), 500
+    
+    def generate():
+        started = time.time()
+        succeeded = 0
+        for name, path in entries:
+            if path is None:
+                yield json.dumps({'filename': name, 'success': False, 'error': 'Unsupported file format'},
+                                 ensure_ascii=False) + "\n"
+        with ThreadPoolExecutor(max_workers=BATCH_FILE_WORKERS, thread_name_prefix='batch') as executor:
+            futures = [executor.submit(process_entry, name, path) for name, path in entries if path]
+            for future in as_completed(futures):
+                result = future.result()
+                succeeded += 1 if result['success'] else 0
+                yield json.dumps(result, ensure_ascii=False) + "\n"
+        yield json.dumps({
+            'summary': True,
+            'total': len(entries),
+            'succeeded': succeeded,
+            'elapsed': round(time.time() - started, 3)
+        }) + "\n"
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+# 转录结果查询API
+@app.route('/api/transcripts', methods=['GET'])
+@login_required
+def api_transcripts():
+    """分页列出当前用户保存的转录任务"""
+    if not transcript_store:
+        return jsonify({'error': 'Transcript storage is disabled'}), 404
+    try:
+        page = max(1, int(request.args.get('page', 1)))
+        per_page = min(100, max(1, int(request.args.get('per_page', 20))))
+    except ValueError:
+        return jsonify({'error': 'page and per_page must be integers'}), 400
+    items, total = transcript_store.list_jobs((page - 1) * per_page, per_page, session.get('username'))
+    return jsonify({
+        'items': items,
+        'page': page,
+        'per_page': per_page,
+        'total': total
+    })
+
+@app.route('/api/transcripts/<job_id>', methods=['GET'])
+@login_required
+def api_transcript(job_id):
+    """获取单个转录任务, format 为 srt/vtt/txt 时返回对应格式的文件"""
+    if not transcript_store:
+        return jsonify({'error': 'Transcript storage is disabled'}), 404
+    job = transcript_store.get(job_id)
+    if not job or job.get('username') != session.get('username'):
+        return jsonify({'error': 'Transcript not found'}), 404
+    
+    output_format = request.args.get('format', 'json').lower()
+    if output_format == 'json':
+        job['segments'] = transcript_store.get_segments(job_id)
+        return jsonify(job)
+    if output_format not in OUTPUT_FORMATS:
+        return jsonify({'error': f"Invalid format. Use one of: {', '.join(OUTPUT_FORMATS)}"}), 400
+    writer, mimetype = OUTPUT_FORMATS[output_format]
+    return Response(writer(iter(transcript_store.get_segments(job_id))), mimetype=mimetype)
+
+# 全文检索API
+@app.route('/api/search', methods=['GET'])
+@login_required
+def api_search():
+    """在当前用户保存的转录中检索, 命中结果带有分段的起止时间, 可直接跳转到音频位置"""
+    if not search_index:
+        return jsonify({'error': 'Search index is disabled'}), 404
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'Missing query parameter q'}), 400
+    try:
+        page = max(1, int(request.args.get('page', 1)))
+        per_page = min(100, max(1, int(request.args.get('per_page', 20))))
+    except ValueError:
+        return jsonify({'error': 'page and per_page must be integers'}), 400
+    try:
+        hits, total = search_index.search(query, session.get('username'), (page - 1) * per_page, per_page)
+    except sqlite3.OperationalError as e:
+        return jsonify({'error': f'Invalid query: {str(e)}'}), 400
+    return jsonify({
+        'query': query,
+        'hits': hits,
+        'page': page,
+        'per_page': per_page,
+        'total': total
+    })
+
+@app.route('/api/capacity', methods=['GET'])
+def api_capacity():
+    """本副本各端点的积压情况, 供自动扩缩容 (或HPA/KEDA的指标适配器) 抓取
+
+    只读且不包含用户数据, 不使用浏览器会话登录; 配置了 CAPACITY_TOKEN 时需要携带对应的 Bearer 令牌。
+    """
+    if CAPACITY_TOKEN:
+        authorization = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(authorization.encode('utf-8'), f"Bearer {CAPACITY_TOKEN}".encode('utf-8')):
+            return jsonify({'error': 'Invalid or missing bearer token'}), 401
+    result = {
+        'replica': socket.gethostname(),
+        'timestamp': time.time(),
+        'endpoints': capacity_tracker.snapshot()
+    }
+    if work_broker:
+        # 共享队列中尚未被任何副本领取的分段数, 是整个集群的积压
+        try:
+            result['queue_pending_tasks'] = work_broker.pending_tasks()
+        except Exception as e:
+            app.logger.error(f"读取队列长度失败: {str(e)}")
+            result['queue_pending_tasks'] = None
+    return jsonify(result)
+
+@app.route('/api/endpoints', methods=['GET'])
+@login_required
+def api_endpoints():
+    """多端点路由的各端点统计 (延迟、错误率、在途数)"""
+    if not endpoint_router:
+        return jsonify({'router': False, 'endpoint': ENDPOINT_NAME, 'endpoints': []})
+    return jsonify({'router': True, 'endpoints': endpoint_router.stats()})
+
+@app.route('/api/tiers', methods=['GET'])
+@login_required
+def api_tiers():
+    """模型分级路由的各档位积压、积压上限和按原因统计的任务数"""
+    if not model_tier_router:
+        return jsonify({'tiers': []})
+    return jsonify({'tiers': model_tier_router.stats(), 'short_seconds': model_tier_router.short_seconds})
+
+@app.route('/api/warmup', methods=['GET'])
+@login_required
+def api_warmup():
+    """端点预热状态和任务第一次端点调用的冷/热延迟统计"""
+    return jsonify(endpoint_warmer.stats())
+
+@app.route('/api/traces', methods=['GET'])
+@login_required
+def api_traces():
+    """TRACE_EXPORTER=memory 时按 trace_id 或 job_id 返回本副本保存的span (按开始时间排序)
+
+    只返回根span的 owner 与当前用户一致的trace; 根span尚未结束或不在本副本时无法确认归属, 返回404。
+    """
+    exporter = tracer.exporter
+    if not isinstance(exporter, InMemorySpanExporter):
+        return jsonify({'error': 'In-memory tracing is disabled'}), 404
+    trace_id = request.args.get('trace_id')
+    job_id = request.args.get('job_id')
+    if not trace_id and not job_id:
+        return jsonify({'error': 'trace_id or job_id is required'}), 400
+    spans = exporter.spans()
+    if trace_id:
+        trace_ids = {trace_id}
     else:
-        return jsonify({'error': 'Only MP3 files are allowed'}), 400
+        job = transcript_store.get(job_id) if transcript_store else None
+        if job and job.get('username') != session.get('username'):
+            return jsonify({'error': 'Job not found'}), 404
+        trace_ids = {span['trace_id'] for span in spans if span['attributes'].get('job_id') == job_id}
+    owner = trace_owner(session.get('username'))
+    owned = {span['trace_id'] for span in spans
+             if span['trace_id'] in trace_ids and span['parent_id'] is None and owner
+             and span['attributes'].get('owner') == owner}
+    if not owned:
+        return jsonify({'error': 'Trace not found'}), 404
+    traces = {}
+    for span in spans:
+        if span['trace_id'] in owned:
+            traces.setdefault(span['trace_id'], []).append(span)
+    return jsonify({'traces': [{'trace_id': key, 'spans': sorted(value, key=lambda span: span['start_time'])}
+                               for key, value in traces.items()]})
+
+# 管理接口: 性能分析 (只作用于处理该请求的副本)
+@app.route('/api/admin/profile', methods=['GET', 'POST', 'DELETE'])
+@admin_required
+def api_admin_profile():
+    """POST 开始分析 (mode, requests, seconds, interval_ms, include_idle), GET 查看状态, DELETE 提前结束"""
+    if request.method == 'GET':
+        return jsonify({'profile': request_profiler.status()})
+    if request.method == 'DELETE':
+        return jsonify({'profile': request_profiler.stop()})
+    params = request.get_json(silent=True) or request.form
+    try:
+        requests_limit = int(params['requests']) if params.get('requests') else None
+        seconds = float(params['seconds']) if params.get('seconds') else None
+        interval = float(params['interval_ms']) / 1000.0 if params.get('interval_ms') else None
+        status = request_profiler.start(params.get('mode', 'sampler'), requests_limit, seconds, interval,
+                                        parse_bool_param(params.get('include_idle')))
+    except (ValueError, TypeError) as e:
+        return jsonify({'error': str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({'error': str(e), 'profile': request_profiler.status()}), 409
+    return jsonify({'profile': status}), 202
+
+@app.route('/api/admin/profile/result', methods=['GET'])
+@admin_required
+def api_admin_profile_result():
+    """分析结果: format=collapsed (采样器的折叠栈), pstats (cProfile数据文件) 或 text (按累计耗时排序的前 limit 项)"""
+    output_format = request.args.get('format', 'text')
+    if output_format not in ('collapsed', 'pstats', 'text'):
+        return jsonify({'error': 'Invalid format. Use one of: collapsed, pstats, text'}), 400
+    try:
+        result = request_profiler.result(output_format, int(request.args.get('limit', 50)))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if result is None:
+        return jsonify({'error': 'No profile has been started'}), 404
+    if output_format == 'pstats':
+        response = Response(result, mimetype='application/octet-stream')
+        response.headers['Content-Disposition'] = 'attachment; filename=whisper.prof'
+        return response
+    return Response(result, mimetype='text/plain; charset=utf-8')
+
+@app.route('/api/admin/memory', methods=['GET', 'POST', 'DELETE'])
+@admin_required
+def api_admin_memory():
+    """POST 开始 tracemalloc 并记录基线 (frames), GET 返回与基线的差异 (key_type, limit, reset), DELETE 停止"""
+    if request.method == 'POST':
+        params = request.get_json(silent=True) or request.form
+        try:
+            frames = int(params.get('frames', 10))
+        except (ValueError, TypeError):
+            return jsonify({'error': 'frames must be an integer'}), 400
+        return jsonify(memory_profiler.start(frames))
+    if request.method == 'DELETE':
+        return jsonify(memory_profiler.stop())
+    key_type = request.args.get('key_type', 'lineno')
+    if key_type not in ('lineno', 'filename', 'traceback'):
+        return jsonify({'error': 'Invalid key_type. Use one of: lineno, filename, traceback'}), 400
+    try:
+        diff = memory_profiler.diff(key_type, int(request.args.get('limit', 30)),
+                                    parse_bool_param(request.args.get('reset')))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(dict(memory_profiler.status(), diff=diff))
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus格式的运行指标 (不需要登录, 便于抓取; 不包含任何转录内容)"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 if __name__ == '__main__':
     # Create templates directory if it doesn't exist
@@ -688,13 +5031,13 @@ if __name__ == '__main__':
     {% endwith %}
     
     <div class="info">
-        <p>Upload MP3 or M4A files of any length. Long recordings will be processed in 30-second chunks with results displayed in real-time.</p>
+        <p>Upload MP3, M4A, WAV, FLAC, OGG, Opus or WebM files of any length. Long recordings will be processed in 30-second chunks with results displayed in real-time.</p>
     </div>
     
     <form method="post" action="{{ url_for('transcribe') }}" enctype="multipart/form-data">
         <div class="form-group">
             <label for="audio_file">Upload Audio File:</label>
-            <input type="file" id="audio_file" name="audio_file" accept=".mp3,.m4a" required>
+            <input type="file" id="audio_file" name="audio_file" accept=".mp3,.m4a,.wav,.flac,.ogg,.opus,.webm" required>
         </div>
         
         <div class="hotwords-section">
@@ -719,6 +5062,26 @@ if __name__ == '__main__':
             <input type="hidden" id="hotwords-data" name="hotwords" value="">
         </div>
         
+        <div class="form-group">
+            <label>时间范围 (可选, 如 40:00 至 55:00, 留空表示整个文件):</label>
+            <input type="text" name="start" placeholder="开始 (MM:SS)" size="10">
+            -
+            <input type="text" name="end" placeholder="结束 (MM:SS)" size="10">
+        </div>
+        
+        <div class="form-group">
+            <label><input type="checkbox" name="rolling_context" value="1"> 跨段上下文 (将上一段的转录结果作为下一段的提示, 适合长录音)</label>
+        </div>
+        
+        <div class="form-group">
+            <label>语言 (可选, Whisper语言代码如 zh、en, 留空自动检测):</label>
+            <input type="text" name="language" placeholder="auto" size="6">
+        </div>
+        
+        <div class="form-group">
+            <label><input type="checkbox" name="fast_start" value="1" checked> 快速首段 (先显示开头几秒的临时结果)</label>
+        </div>
+        
         <button type="submit" class="btn">转文字 (Transcribe)</button>
     </form>
     
@@ -884,6 +5247,7 @@ if __name__ == '__main__':
     <script>
         document.addEventListener('DOMContentLoaded', function() {
             const progressBar = document.getElementById('progress-bar');
+            let skippedSegments = 0;
             const transcript = document.getElementById('transcript');
             const status = document.getElementById('status');
             const controls = document.getElementById('controls');
@@ -905,11 +5269,20 @@ if __name__ == '__main__':
                         status.textContent = `Processing audio file (0/${data.total_segments} segments)`;
                         break;
                         
+                    case "provisional":
+                        // 开头几秒的临时结果, 第一段完成后被替换
+                        transcript.textContent = data.transcript;
+                        transcript.style.color = "#6c757d";
+                        break;
+                        
                     case "progress":
+                        transcript.style.color = "";
                         progressBar.style.width = data.progress + "%";
                         progressBar.textContent = data.progress + "%";
                         progressBar.setAttribute('aria-valuenow', data.progress);
-                        status.textContent = `Processing audio file (${data.current_segment}/${data.total_segments} segments)`;
+                        if (data.skipped) skippedSegments++;
+                        status.textContent = `Processing audio file (${data.current_segment}/${data.total_segments} segments)` +
+                            (skippedSegments ? `, ${skippedSegments} silent/duplicate skipped` : "");
                         transcript.textContent = data.transcript;
                         break;
                         
@@ -945,43 +5318,125 @@ if __name__ == '__main__':
 </html>
     ''')
 
-def predict_with_hotwords(predictor, samples, hotwords_config):
-    """使用热词配置进行预测"""
+def _char_token_cost(ch):
+    """估算单个字符占用的token数 (CJK等宽字符约1个token, 其余约3个字符1个token)"""
+    return 1.0 if ord(ch) >= 0x2E80 else 0.3
+
+def estimate_prompt_tokens(text):
+    """粗略估算提示文本的token数, 用于在不加载Whisper分词器的情况下控制prompt长度"""
+    return int(math.ceil(sum(_char_token_cost(ch) for ch in text)))
+
+def truncate_prompt_tail(text, max_tokens):
+    """保留文本末尾不超过max_tokens的部分 (Whisper对紧邻音频的上下文最敏感)"""
+    if max_tokens <= 0:
+        return ''
+    cost = 0.0
+    for i in range(len(text) - 1, -1, -1):
+        cost += _char_token_cost(text[i])
+        if cost > max_tokens:
+            return text[i + 1:].lstrip()
+    return text
+
+def build_hotword_prompt(hotwords, max_tokens=PROMPT_TOKEN_BUDGET):
+    """构建热词提示, 超出token预算时从列表末尾丢弃热词"""
+    words = list(hotwords)
+    while words:
+        prompt = f"以下音频可能包含这些词汇: {', '.join(words)}。请准确转录音频内容。"
+        if estimate_prompt_tokens(prompt) <= max_tokens:
+            return prompt
+        words.pop()
+    return ''
+
+def build_initial_prompt(hotwords, context_text=None, max_tokens=PROMPT_TOKEN_BUDGET):
+    """合并热词提示与滚动上下文, 并整体截断到token预算内
+
+    热词提示优先占用预算, 剩余预算留给上一段转录结果的尾部, 上下文放在最后以紧邻当前音频。
+    """
+    hotword_prompt = build_hotword_prompt(hotwords, max_tokens) if hotwords else ''
+    remaining = max_tokens - estimate_prompt_tokens(hotword_prompt)
+    context_prompt = truncate_prompt_tail(context_text, remaining) if context_text else ''
+    return " ".join(part for part in (hotword_prompt, context_prompt) if part)
+
+class RollingContext:
+    """跨音频段携带的滚动上下文
+
+    按段序号记录转录结果, prompt_for(i) 取序号小于 i 的最近一个已完成段的尾部文本。
+    并发或流水线调度时前一段可能尚未完成, 此时退回到更早的已完成段或推测性的临时结果,
+    因此调度顺序只影响上下文的新旧程度, 不影响正确性。
+    """
+
+    def __init__(self, max_chars=ROLLING_CONTEXT_CHARS):
+        self.max_chars = max_chars
+        self._texts = {}
+        self._provisional = set()
+        self._lock = threading.Lock()
+
+    def record(self, index, text, provisional=False):
+        """记录第index段的转录结果; 临时结果不会覆盖正式结果"""
+        text = (text or '').strip()
+        if not text or text.startswith('[Error in segment'):
+            return
+        with self._lock:
+            if provisional and index in self._texts and index not in self._provisional:
+                return
+            self._texts[index] = text
+            if provisional:
+                self._provisional.add(index)
+            else:
+                self._provisional.discard(index)
+
+    def prompt_for(self, index):
+        """返回第index段可用的上下文文本, 没有可用上下文时返回None"""
+        with self._lock:
+            previous = [i for i in self._texts if i < index]
+            if not previous:
+                return None
+            text = self._texts[max(previous)]
+        return text[-self.max_chars:] if self.max_chars else text
+
+def language_fields(language):
+    """固定语言时随请求发送的字段, 端点据此跳过语言检测"""
+    return {'language': language} if language else None
+
+def predict_with_hotwords(predictor, pcm, hotwords_config, context_text=None, encoding=None, language=None):
+    """使用热词配置进行预测, context_text 为滚动上下文 (上一段转录结果的尾部), language 为固定的语言"""
     method = hotwords_config.get('method', 'prompt_injection')
     words = hotwords_config.get('words', [])
+    current_span().set_attributes(hotword_method=method if words else None, hotword_count=len(words),
+                                  context_chars=len(context_text or ''))
     
     if not words:
+        if context_text:
+            # 没有热词但有上下文，仅通过initial_prompt携带上下文
+            return predict_with_prompt_injection(predictor, pcm, [], context_text, encoding, language)
         # 没有热词，使用标准预测
-        return predictor.predict(samples)
+        return predict_audio(predictor, pcm, encoding, language_fields(language))
     
     if method == 'prompt_injection':
-        return predict_with_prompt_injection(predictor, samples, words)
+        return predict_with_prompt_injection(predictor, pcm, words, context_text, encoding, language)
     elif method == 'logit_bias':
-        return predict_with_logit_bias(predictor, samples, words, hotwords_config.get('boost_factor', 1.5))
+        return predict_with_logit_bias(predictor, pcm, words, hotwords_config.get('boost_factor', 1.5), context_text,
+                                       encoding, language)
     else:
-        # 默认使用标准预测
-        return predictor.predict(samples)
+        # 未知的热词方式不使用热词, 滚动上下文仍通过initial_prompt携带
+        if context_text:
+            return predict_with_prompt_injection(predictor, pcm, [], context_text, encoding, language)
+        return predict_audio(predictor, pcm, encoding, language_fields(language))
 
-def predict_with_prompt_injection(predictor, samples, hotwords):
+def predict_with_prompt_injection(predictor, pcm, hotwords, context_text=None, encoding=None, language=None):
     """使用Prompt注入方法"""
     try:
-        # 构建包含热词的提示
-        prompt = f"以下音频可能包含这些词汇: {', '.join(hotwords)}。请准确转录音频内容。"
+        # 构建包含热词和滚动上下文的提示
+        prompt = build_initial_prompt(hotwords, context_text)
         
         # 创建包含prompt的请求数据
-        request_data = {
-            'audio': samples.tolist(),
-            'initial_prompt': prompt
-        }
-        
-        # 使用自定义序列化器发送请求
-        response = predictor.predict(request_data)
+        response = predict_audio(predictor, pcm, encoding, dict(language_fields(language) or {}, initial_prompt=prompt))
         return response
     except Exception as e:
         app.logger.warning(f"Prompt注入失败，回退到标准预测: {str(e)}")
-        return predictor.predict(samples)
+        return predict_audio(predictor, pcm, encoding, language_fields(language))
 
-def predict_with_logit_bias(predictor, samples, hotwords, boost_factor):
+def predict_with_logit_bias(predictor, pcm, hotwords, boost_factor, context_text=None, encoding=None, language=None):
     """使用Logit Bias方法"""
     try:
         # 构建logit bias配置
@@ -989,15 +5444,18 @@ def predict_with_logit_bias(predictor, samples, hotwords, boost_factor):
         logit_bias = {word: boost_factor for word in hotwords}
         
         request_data = {
-            'audio': samples.tolist(),
             'logit_bias': logit_bias
         }
+        if context_text:
+            request_data['initial_prompt'] = build_initial_prompt([], context_text)
+        if language:
+            request_data['language'] = language
         
-        response = predictor.predict(request_data)
+        response = predict_audio(predictor, pcm, encoding, request_data)
         return response
     except Exception as e:
         app.logger.warning(f"Logit Bias失败，回退到标准预测: {str(e)}")
-        return predictor.predict(samples)
+        return predict_audio(predictor, pcm, encoding, language_fields(language))
 
 # 添加热词配置API端点
 @app.route('/api/hotwords', methods=['GET', 'POST'])
@@ -1043,5 +5501,7 @@ def api_hotwords():
             return jsonify({'error': str(e)}), 500
 
 if __name__ == '__main__':
+    # 在接收请求之前开始预热
+    endpoint_warmer.start()
     # Run the application
     app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 8080)))
@@ -0,0 +1,485 @@
+"""
+转录流水线基准测试
+
+各阶段 (解码 / 分段 / 调度 / 合并) 都可以单独测量, 也可以对整条流水线做端到端测量,
+以及首个可见文本的时间 (TTFT)、固定语言前后的每段延迟、多端点路由、本地推理与端点的对比、异步推理、冷启动耗时/内存、链路追踪的开销和模型分级路由在高峰时的降级。
+默认使用本地模拟端点 (SAGEMAKER_ENDPOINT=mock), 不需要AWS环境。
+
+示例:
+    python benchmark.py --stage all --duration 600
+    python benchmark.py --stage dispatch --latency-ms 800 --workers 8 --in-flight 4
+    python benchmark.py --stage decode --file meeting.m4a > bench_output.txt
+    python benchmark.py --stage encoding --bandwidth-mbps 50
+    python benchmark.py --stage ttft --duration 1800 --latency-ms 1500
+    python benchmark.py --stage language --detect-ms 150
+    python benchmark.py --stage router --latency-ms 300
+    python benchmark.py --stage backend --latency-ms 800 --local-rtf 0.05
+    python benchmark.py --stage async --duration 3600 --latency-ms 800
+    python benchmark.py --stage startup --repeat 5
+    python benchmark.py --stage tracing --duration 3600
+    python benchmark.py --stage tiers --duration 600 --jobs 8
+"""
+import os
+import sys
+import time
+import wave
+import argparse
+import shutil
+import tempfile
+import threading
+import statistics
+import subprocess
+
+os.environ.setdefault('SAGEMAKER_ENDPOINT', 'mock')
+
+import numpy as np
+import app as whisper_app
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'code'))
+import payload_codec
+
+
+def make_synthetic_audio(seconds, sample_rate=whisper_app.SAMPLE_RATE, seed=0):
+    """生成类语音的合成音频 (调幅的多个谐波加少量噪声), 返回int16 PCM"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    pitch = 140 + 30 * np.sin(2 * np.pi * 0.3 * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / sample_rate
+    voiced = sum(np.sin(k * phase) / k for k in range(1, 6))
+    envelope = 0.5 * (1 + np.sin(2 * np.pi * 3 * t)) * (np.sin(2 * np.pi * 0.2 * t) > -0.3)
+    signal = 0.3 * voiced * envelope + 0.01 * rng.standard_normal(len(t))
+    return (np.clip(signal, -1, 1) * 32767).astype(np.int16)
+
+
+def write_wav(path, pcm, sample_rate=whisper_app.SAMPLE_RATE):
+    """把int16 PCM写成单声道WAV文件"""
+    with wave.open(path, 'wb') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(sample_rate)
+        wf.writeframes(pcm.tobytes())
+
+
+def timed(fn, repeat):
+    """重复执行fn, 返回每次耗时 (秒) 列表和最后一次的返回值"""
+    durations = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        durations.append(time.perf_counter() - started)
+    return durations, result
+
+
+def report(name, durations, extra=""):
+    median = statistics.median(durations)
+    print(f"{name:<28} median {median * 1000:9.2f} ms  min {min(durations) * 1000:9.2f} ms"
+          f"  runs {len(durations):3d}  {extra}")
+
+
+def bench_decode(path, audio_seconds, repeat):
+    for name, decoder_cls in whisper_app.AUDIO_DECODERS.items():
+        try:
+            decoder = decoder_cls()
+            durations, pcm = timed(lambda: decoder.decode(path), repeat)
+        except Exception as e:
+            print(f"decode[{name}] skipped: {e}")
+            continue
+        speed = audio_seconds / statistics.median(durations)
+        report(f"decode[{name}]", durations, f"{speed:.0f}x realtime, {len(pcm)} samples")
+
+
+def bench_segment(pcm, repeat):
+    segmenter = whisper_app.FixedSegmenter()
+    durations, segments = timed(lambda: list(segmenter.split(pcm)), repeat)
+    report("segment", durations, f"{len(segments)} segments")
+    durations, _ = timed(lambda: [whisper_app.pcm_to_model_input(s['pcm']) for s in segments], repeat)
+    report("segment[to model input]", durations)
+
+
+def bench_dispatch(n_segments, latency_ms, workers, in_flight, repeat):
+    dispatcher = whisper_app.SegmentDispatcher(max_workers=workers)
+    delay = latency_ms / 1000.0
+
+    def fake_call(i):
+        time.sleep(delay)
+        return i
+
+    durations, _ = timed(lambda: list(dispatcher.map_ordered(fake_call, range(n_segments), in_flight)), repeat)
+    ideal = n_segments * delay / max(1, min(workers, in_flight))
+    report("dispatch", durations,
+           f"{n_segments} segments, {workers} workers, {in_flight} in flight (ideal {ideal * 1000:.0f} ms)")
+
+
+def bench_merge(n_segments, repeat):
+    records = [whisper_app.make_segment_record(i, i * 30000, (i + 1) * 30000, "测试文本 " * 40)
+               for i in range(n_segments)]
+
+    def merge():
+        merger = whisper_app.TranscriptMerger()
+        for record in records:
+            merger.add(record)
+        return merger.transcript
+
+    durations, _ = timed(merge, repeat)
+    report("merge", durations, f"{n_segments} segments")
+
+
+def bench_encoding(pcm, latency_ms, bandwidth_mbps, repeat):
+    """对比各请求体编码的每段字节数、编解码耗时以及模拟网络下的端到端延迟"""
+    segments = list(whisper_app.FixedSegmenter().split(pcm))
+    bandwidth = bandwidth_mbps * 1000000 / 8
+    print(f"{'encoding':<10} {'bytes/segment':>14} {'ratio':>7} {'encode ms':>10} {'decode ms':>10}"
+          f" {'transfer ms':>12} {'end-to-end ms':>14}")
+    baseline = None
+    for encoding in whisper_app.PAYLOAD_ENCODINGS:
+        sizes, encode_times, decode_times = [], [], []
+        try:
+            for segment in segments:
+                for _ in range(repeat):
+                    started = time.perf_counter()
+                    if encoding == 'float16':
+                        array = whisper_app.pcm_to_model_input(segment['pcm'])
+                        body, content_type = whisper_app.PayloadSerializer().serialize(array), 'application/x-npy'
+                    else:
+                        body, content_type = whisper_app.encode_audio(segment['pcm'], encoding)
+                    encode_times.append(time.perf_counter() - started)
+                    started = time.perf_counter()
+                    payload_codec.decode_payload(body, content_type)
+                    decode_times.append(time.perf_counter() - started)
+                sizes.append(len(body))
+        except Exception as e:
+            print(f"{encoding:<10} skipped: {e}")
+            continue
+        size = statistics.mean(sizes)
+        baseline = baseline or size
+        encode_ms = statistics.median(encode_times) * 1000
+        decode_ms = statistics.median(decode_times) * 1000
+        transfer_ms = size / bandwidth * 1000 if bandwidth else 0
+        total_ms = encode_ms + transfer_ms + decode_ms + latency_ms
+        print(f"{encoding:<10} {size:14.0f} {baseline / size:6.1f}x {encode_ms:10.2f} {decode_ms:10.2f}"
+              f" {transfer_ms:12.2f} {total_ms:14.2f}")
+
+
+def bench_engine(path, latency_ms, workers, in_flight, repeat):
+    engine = whisper_app.TranscriptionEngine(
+        dispatcher=whisper_app.SegmentDispatcher(max_workers=workers),
+        predictor_factory=lambda: whisper_app.MockPredictor(latency_ms)
+    )
+    durations, segments = timed(lambda: list(engine.iter_segments(path, {'max_in_flight': in_flight})), repeat)
+    report("engine[end-to-end]", durations, f"{len(segments)} segments, mock latency {latency_ms:.0f} ms")
+
+
+def bench_ttft(path, latency_ms, bandwidth_mbps, repeat):
+    """首个可见文本的时间 (TTFT): 普通模式与快速首段模式对比"""
+    engine = whisper_app.TranscriptionEngine(
+        predictor_factory=lambda: whisper_app.MockPredictor(latency_ms, bandwidth_mbps)
+    )
+    for fast_start in (False, True):
+        first_texts, totals = [], []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            first_text = None
+            for event in engine.run(path, {'fast_start': fast_start}):
+                if first_text is None and event['type'] in ('provisional', 'segment'):
+                    first_text = time.perf_counter() - started
+            totals.append(time.perf_counter() - started)
+            first_texts.append(first_text if first_text is not None else totals[-1])
+        name = "ttft[fast start]" if fast_start else "ttft[full first segment]"
+        report(name, first_texts, f"total median {statistics.median(totals) * 1000:.0f} ms")
+
+
+class TimedPredictor(whisper_app.MockPredictor):
+    """记录每次调用耗时的模拟端点"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.latencies = []
+
+    def predict(self, data, initial_args=None):
+        started = time.perf_counter()
+        try:
+            return super().predict(data, initial_args)
+        finally:
+            self.latencies.append(time.perf_counter() - started)
+
+
+def bench_language(path, latency_ms, bandwidth_mbps, detect_ms, repeat):
+    """每段都由端点检测语言与检测一次后固定语言的每段延迟对比"""
+    for pin in (False, True):
+        predictor = TimedPredictor(latency_ms, bandwidth_mbps, detect_ms)
+        engine = whisper_app.TranscriptionEngine(predictor_factory=lambda: predictor)
+        for _ in range(repeat):
+            list(engine.iter_segments(path, {'pin_language': pin}))
+        name = "language[pinned]" if pin else "language[detect per segment]"
+        p90 = sorted(predictor.latencies)[int(0.9 * (len(predictor.latencies) - 1))]
+        report(name, predictor.latencies, f"p90 {p90 * 1000:.0f} ms per segment, detection {detect_ms:.0f} ms")
+
+
+class UniformRouter(whisper_app.EndpointRouter):
+    """只按权重随机选择、不考虑延迟和错误率的路由器, 作为对照"""
+
+    def _score(self, target, default_latency, now):
+        return target.weight
+
+
+def router_targets(latency_ms):
+    """三个模拟端点: 快、慢 (4倍延迟)、不稳定 (30%调用失败)"""
+    specs = [('mock-fast', latency_ms, 0.0), ('mock-slow', latency_ms * 4, 0.0), ('mock-flaky', latency_ms, 0.3)]
+    return [whisper_app.EndpointTarget(name, whisper_app.MockPredictor(latency, error_rate=error_rate, endpoint_name=name))
+            for name, latency, error_rate in specs]
+
+
+def bench_router(path, latency_ms, workers, in_flight, repeat):
+    """多端点路由: 按延迟和错误率选择端点与只按权重随机选择的端到端耗时和失败分段数对比"""
+    for name, router_class in (("router[uniform]", UniformRouter), ("router[latency-aware]", whisper_app.EndpointRouter)):
+        router = router_class(router_targets(latency_ms))
+        engine = whisper_app.TranscriptionEngine(
+            dispatcher=whisper_app.SegmentDispatcher(max_workers=workers),
+            predictor_factory=lambda: router
+        )
+        durations, failed = [], 0
+        for _ in range(repeat):
+            started = time.perf_counter()
+            segments = list(engine.iter_segments(path, {'max_in_flight': in_flight}))
+            durations.append(time.perf_counter() - started)
+            failed += sum(1 for segment in segments if segment.get('error'))
+        share = ", ".join(f"{stats['endpoint']} {stats['requests']}" for stats in router.stats())
+        report(name, durations, f"failed segments {failed}, calls: {share}")
+
+
+class SimulatedLocalPredictor(whisper_app.LocalWhisperPredictor):
+    """未安装 faster-whisper 时模拟本地推理: 耗时 = 音频时长 × 实时率, 同时只进行 concurrency 个推理"""
+
+    def __init__(self, rtf, **kwargs):
+        super().__init__(**kwargs)
+        self.rtf = rtf
+        self.endpoint_name = f"local:simulated rtf {rtf}"
+
+    def transcribe(self, pcm, fields=None):
+        with self._slots:
+            time.sleep(len(pcm) / whisper_app.SAMPLE_RATE * self.rtf)
+        return '{"text": "[local]", "language": "zh"}'
+
+
+def local_backend(rtf):
+    try:
+        import faster_whisper  # noqa: F401
+    except ImportError:
+        return SimulatedLocalPredictor(rtf)
+    return whisper_app.LocalWhisperPredictor()
+
+
+def bench_backend(latency_ms, bandwidth_mbps, local_rtf, repeat, clip_seconds=(10, 30, 60, 300)):
+    """不同长度的音频分别用本地推理和端点转录的端到端耗时, 以及 auto 模式的选择"""
+    local = local_backend(local_rtf)
+    backends = [("endpoint", whisper_app.MockPredictor(latency_ms, bandwidth_mbps)), ("local", local)]
+    router = whisper_app.BackendRouter(local, backends[0][1])
+    if not isinstance(local, SimulatedLocalPredictor):
+        # 模型加载时间不计入转录耗时
+        local.load()
+    print(f"local backend: {local.endpoint_name}, auto threshold {router.local_max_seconds:.0f}s")
+    for seconds in clip_seconds:
+        handle, path = tempfile.mkstemp(suffix='.wav')
+        os.close(handle)
+        write_wav(path, make_synthetic_audio(seconds, seed=int(seconds)))
+        try:
+            for name, predictor in backends:
+                engine = whisper_app.TranscriptionEngine(predictor_factory=lambda: predictor)
+                durations, _ = timed(lambda: list(engine.iter_segments(path)), repeat)
+                chosen = router.for_job(None, seconds) is predictor
+                report(f"backend[{seconds}s {name}]", durations, "auto" if chosen else "")
+        finally:
+            os.unlink(path)
+
+
+def bench_async(path, latency_ms, workers, in_flight, repeat, poll_interval=0.5):
+    """同步调用与异步推理 (本地对象存储 + 模拟异步端点, 轮询或完成通知) 的端到端耗时对比"""
+    engine = whisper_app.TranscriptionEngine(
+        dispatcher=whisper_app.SegmentDispatcher(max_workers=workers),
+        predictor_factory=lambda: whisper_app.MockPredictor(latency_ms)
+    )
+    durations, segments = timed(lambda: list(engine.iter_segments(path, {'max_in_flight': in_flight})), repeat)
+    report("async[sync endpoint]", durations, f"{len(segments)} segments, {workers} workers")
+    store_dir = tempfile.mkdtemp(prefix='bench_async_')
+    store = whisper_app.LocalObjectStore(store_dir)
+    try:
+        bench_async_modes(path, latency_ms, workers, repeat, poll_interval, store)
+    finally:
+        shutil.rmtree(store_dir, ignore_errors=True)
+
+
+def bench_async_modes(path, latency_ms, workers, repeat, poll_interval, store):
+    for name, notifications in (("async[poll]", None), ("async[notification]", whisper_app.LocalNotificationSource())):
+        runtime = whisper_app.MockAsyncRuntime(store, whisper_app.MockPredictor(latency_ms), concurrency=workers,
+                                               notifications=notifications)
+        client = whisper_app.AsyncEndpointClient('mock', runtime, store,
+                                                 whisper_app.AsyncResultWaiter(store, notifications, poll_interval))
+        engine = whisper_app.TranscriptionEngine(
+            dispatcher=whisper_app.SegmentDispatcher(max_workers=whisper_app.ASYNC_MAX_IN_FLIGHT),
+            predictor_factory=lambda: client
+        )
+        durations, segments = timed(
+            lambda: list(engine.iter_segments(path, {'max_in_flight': whisper_app.ASYNC_MAX_IN_FLIGHT})), repeat)
+        report(name, durations, f"{len(segments)} segments, {workers} endpoint instances")
+
+
+# ru_maxrss 在 Linux 上会继承 fork 前父进程的峰值, 因此优先读取 /proc/self/status 中当前的 VmRSS (KiB)
+STARTUP_SCRIPT = (
+    "import time, resource\n"
+    "started = time.perf_counter()\n"
+    "{imports}\n"
+    "elapsed = time.perf_counter() - started\n"
+    "try:\n"
+    "    rss = next(int(line.split()[1]) for line in open('/proc/self/status') if line.startswith('VmRSS:'))\n"
+    "except OSError:\n"
+    "    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss\n"
+    "print(elapsed, rss)\n"
+)
+
+
+def bench_tracing(path, workers, in_flight, repeat):
+    """链路追踪的开销: 零延迟模拟端点上分别关闭追踪、按10%采样和全部采样 (内存导出器) 的端到端耗时"""
+    engine = whisper_app.TranscriptionEngine(
+        dispatcher=whisper_app.SegmentDispatcher(max_workers=workers),
+        predictor_factory=lambda: whisper_app.MockPredictor(0)
+    )
+    original = whisper_app.tracer
+    baseline = None
+    list(engine.iter_segments(path, {'max_in_flight': in_flight}))  # 预热
+    try:
+        for name, tracer in [("tracing[off]", whisper_app.Tracer()),
+                             ("tracing[10% sampled]", whisper_app.Tracer(whisper_app.InMemorySpanExporter(), 0.1)),
+                             ("tracing[100% sampled]", whisper_app.Tracer(whisper_app.InMemorySpanExporter(), 1.0))]:
+            whisper_app.tracer = tracer
+            durations, segments = timed(lambda: list(engine.iter_segments(path, {'max_in_flight': in_flight})), repeat)
+            # 比较最短耗时, 减少线程调度带来的抖动
+            fastest = min(durations)
+            baseline = fastest if baseline is None else baseline
+            spans = len(tracer.exporter.spans()) / repeat if tracer.exporter else 0
+            report(name, durations,
+                   f"{spans:.0f} spans/job, overhead {(fastest - baseline) / len(segments) * 1e6:+.0f} us/segment")
+    finally:
+        whisper_app.tracer = original
+
+
+def bench_tiers(path, duration, latency_ms, workers, in_flight, jobs):
+    """模型分级路由: 同时到达 jobs 个任务时, 全部使用准确档位 (4倍延迟) 与积压超过两个任务后降级到快速档位的对比"""
+    for name, max_backlog in (("tiers[accurate only]", float('inf')), ("tiers[degrade on backlog]", duration * 2)):
+        tiers = [whisper_app.ModelTier(tier, whisper_app.EndpointRouter(
+                     [whisper_app.EndpointTarget(f"mock-{tier}", whisper_app.MockPredictor(latency, endpoint_name=f"mock-{tier}"))],
+                     name=tier), max_backlog)
+                 for tier, latency in (('fast', latency_ms), ('accurate', latency_ms * 4))]
+        router = whisper_app.ModelTierRouter(tiers, default='accurate')
+        engine = whisper_app.TranscriptionEngine(
+            dispatcher=whisper_app.SegmentDispatcher(max_workers=workers),
+            predictor_factory=lambda: router, capacity=whisper_app.CapacityTracker()
+        )
+        latencies = []
+
+        def run_job():
+            started = time.perf_counter()
+            list(engine.iter_segments(path, {'max_in_flight': in_flight}))
+            latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=run_job) for _ in range(jobs)]
+        for thread in threads:
+            thread.start()
+            # 错开到达时间, 让后到的任务看到前面任务的积压
+            time.sleep(0.05)
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - started
+        share = ", ".join(f"{stats['tier']} {sum(stats['jobs'].values())}" for stats in router.stats())
+        report(name, latencies, f"wall {wall:.2f}s for {jobs} jobs, tiers: {share}")
+
+
+def bench_startup(repeat):
+    """冷启动: 在新进程中导入应用的耗时和导入后的常驻内存 (RSS), 与同时加载 sagemaker SDK 和 pydub 的旧方式对比"""
+    variants = [
+        ("startup[python]", "pass"),
+        ("startup[app]", "import app"),
+        ("startup[app + sagemaker, pydub]", "import sagemaker, sagemaker.serializers, pydub\nimport app"),
+    ]
+    env = dict(os.environ, SAGEMAKER_ENDPOINT='mock')
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    for name, imports in variants:
+        durations, rss = [], []
+        for _ in range(repeat):
+            proc = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT.format(imports=imports)], cwd=cwd, env=env,
+                                  stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+            if proc.returncode != 0:
+                break
+            seconds, maxrss = proc.stdout.split()[-2:]
+            durations.append(float(seconds))
+            rss.append(int(maxrss) / 1024)
+        if not durations:
+            print(f"{name} skipped: {proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else 'failed'}")
+            continue
+        report(name, durations, f"RSS {statistics.median(rss):.0f} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the transcription pipeline stages")
+    parser.add_argument('--stage', default='all',
+                        choices=['all', 'decode', 'segment', 'dispatch', 'merge', 'encoding', 'engine', 'ttft', 'language', 'router',
+                                 'backend', 'async', 'startup', 'tracing', 'tiers'])
+    parser.add_argument('--file', help="audio file to decode (defaults to synthetic audio)")
+    parser.add_argument('--duration', type=float, default=300, help="synthetic audio length in seconds")
+    parser.add_argument('--latency-ms', type=float, default=200, help="mock endpoint latency per segment")
+    parser.add_argument('--bandwidth-mbps', type=float, default=100, help="simulated network bandwidth to the endpoint")
+    parser.add_argument('--detect-ms', type=float, default=150, help="mock language detection cost per unpinned call")
+    parser.add_argument('--local-rtf', type=float, default=0.05,
+                        help="simulated local inference real-time factor when faster-whisper is not installed")
+    parser.add_argument('--workers', type=int, default=whisper_app.SEGMENT_WORKERS)
+    parser.add_argument('--in-flight', type=int, default=whisper_app.JOB_MAX_IN_FLIGHT)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--jobs', type=int, default=6, help="concurrent jobs for the tiers stage")
+    args = parser.parse_args()
+
+    pcm = make_synthetic_audio(args.duration)
+    path = args.file
+    if not path:
+        handle, path = tempfile.mkstemp(suffix='.wav')
+        os.close(handle)
+        write_wav(path, pcm)
+    n_segments = int(np.ceil(args.duration / whisper_app.CHUNK_SECONDS))
+
+    print(f"python {sys.version.split()[0]}, audio {args.duration:.0f}s, {n_segments} segments")
+    try:
+        if args.stage in ('all', 'decode'):
+            bench_decode(path, args.duration, args.repeat)
+        if args.stage in ('all', 'segment'):
+            bench_segment(pcm, args.repeat)
+        if args.stage in ('all', 'dispatch'):
+            bench_dispatch(n_segments, args.latency_ms, args.workers, args.in_flight, args.repeat)
+        if args.stage in ('all', 'merge'):
+            bench_merge(n_segments, args.repeat)
+        if args.stage in ('all', 'encoding'):
+            bench_encoding(pcm, args.latency_ms, args.bandwidth_mbps, args.repeat)
+        if args.stage in ('all', 'engine'):
+            bench_engine(path, args.latency_ms, args.workers, args.in_flight, args.repeat)
+        if args.stage in ('all', 'ttft'):
+            bench_ttft(path, args.latency_ms, args.bandwidth_mbps, args.repeat)
+        if args.stage in ('all', 'router'):
+            bench_router(path, args.latency_ms, args.workers, args.in_flight, args.repeat)
+        if args.stage in ('all', 'backend'):
+            bench_backend(args.latency_ms, args.bandwidth_mbps, args.local_rtf, args.repeat)
+        if args.stage in ('all', 'async'):
+            bench_async(path, args.latency_ms, args.workers, args.in_flight, args.repeat)
+        if args.stage in ('all', 'startup'):
+            bench_startup(args.repeat)
+        if args.stage in ('all', 'tracing'):
+            bench_tracing(path, args.workers, args.in_flight, args.repeat)
+        if args.stage in ('all', 'tiers'):
+            bench_tiers(path, args.duration, args.latency_ms, args.workers, args.in_flight, args.jobs)
+        if args.stage in ('all', 'language'):
+            bench_language(path, args.latency_ms, args.bandwidth_mbps, args.detect_ms, args.repeat)
+    finally:
+        if not args.file:
+            os.unlink(path)
+
+
+if __name__ == '__main__':
+    main()
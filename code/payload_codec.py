@@ -0,0 +1,95 @@
+"""
+推理容器端的请求解码
+
+与 web 应用 (app.py) 的 PAYLOAD_ENCODING 对应, 在 inference.py 的 input_fn 中调用:
+
+    from payload_codec import decode_payload
+
+    def input_fn(request_body, request_content_type):
+        return decode_payload(request_body, request_content_type)
+
+返回字典: audio 为 16kHz 单声道 float32 数组 ([-1, 1]), 其余字段 (initial_prompt、logit_bias、language 等) 原样保留。
+language 存在时应传给 whisper 的 transcribe(language=...) 以跳过语言检测, 结果中的 language 随响应返回。
+不支持的 ContentType 抛出 ValueError, SageMaker 以 ModelError 返回给调用方, web 应用据此回退到 float16。
+"""
+import io
+import json
+import base64
+import subprocess
+
+import numpy as np
+
+try:
+    import soundfile
+except ImportError:
+    soundfile = None
+
+SAMPLE_RATE = 16000
+
+
+def _ffmpeg_decode(data):
+    """通过ffmpeg把任意压缩音频解码为16kHz单声道float32"""
+    cmd = [
+        'ffmpeg', '-nostdin', '-hide_banner', '-loglevel', 'error',
+        '-i', '-', '-f', 'f32le', '-ac', '1', '-ar', str(SAMPLE_RATE), '-'
+    ]
+    proc = subprocess.run(cmd, input=data, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if proc.returncode != 0:
+        raise ValueError(f"Failed to decode audio: {proc.stderr.decode('utf-8', errors='ignore').strip()}")
+    return np.frombuffer(proc.stdout, dtype=np.float32)
+
+
+def decode_audio(data, encoding):
+    """按编码名解码音频二进制, 返回float32数组"""
+    if encoding == 'int16':
+        return np.frombuffer(data, dtype='<i2').astype(np.float32) / 32768.0
+    if encoding == 'flac' and soundfile is not None:
+        audio, _ = soundfile.read(io.BytesIO(data), dtype='float32')
+        return audio
+    if encoding in ('flac', 'opus'):
+        return _ffmpeg_decode(data)
+    raise ValueError(f"Unsupported audio encoding: {encoding}")
+
+
+# ContentType -> 编码名
+CONTENT_TYPE_ENCODINGS = {
+    'application/x-pcm-s16le': 'int16',
+    'audio/flac': 'flac',
+    'audio/x-flac': 'flac',
+    'audio/ogg': 'opus',
+    'audio/opus': 'opus',
+}
+
+
+def _decode_json(body):
+    request = json.loads(body)
+    if 'audio_b64' in request:
+        encoding = request.pop('audio_encoding', 'int16')
+        request['audio'] = decode_audio(base64.b64decode(request.pop('audio_b64')), encoding)
+    else:
+        request['audio'] = np.asarray(request['audio'], dtype=np.float32)
+    return request
+
+
+def _decode_npy(body):
+    loaded = np.load(io.BytesIO(body), allow_pickle=True)
+    if loaded.dtype == object:
+        # 旧版web应用把带热词的请求字典直接作为npy对象数组发送
+        request = dict(loaded.item())
+        request['audio'] = np.asarray(request['audio'], dtype=np.float32)
+        return request
+    return {'audio': loaded.astype(np.float32)}
+
+
+def decode_payload(body, content_type):
+    """解码请求体, 返回包含 float32 audio 的请求字典"""
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    mime = (content_type or 'application/x-npy').split(';')[0].strip().lower()
+    if mime == 'application/x-npy':
+        return _decode_npy(body)
+    if mime == 'application/json':
+        return _decode_json(body)
+    if mime in CONTENT_TYPE_ENCODINGS:
+        return {'audio': decode_audio(body, CONTENT_TYPE_ENCODINGS[mime])}
+    raise ValueError(f"Unsupported content type: {content_type}")
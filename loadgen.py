@@ -0,0 +1,282 @@
+"""负载生成与流量回放
+
+应用设置 TRAFFIC_LOG 后会把每个任务的匿名元数据 (到达时间、入口、音频格式和时长、热词数量和方式等)
+追加写入JSONL文件。本工具按记录的到达间隔 (可加速) 用合成音频回放这些请求, 也可以按指定的时长分布生成流量,
+输出吞吐量和延迟报告, 并对比两次运行 (例如两个版本) 的报告。
+
+回放目标建议使用模拟端点, 并关闭结果存储和指纹复用, 避免相同的合成音频直接命中缓存:
+    SAGEMAKER_ENDPOINT=mock TRANSCRIPT_STORE=none FINGERPRINT_INDEX=none python app.py
+
+示例:
+    python loadgen.py generate --count 200 --rate 0.5 --durations 15:0.5,300:0.4,3600:0.1 > traffic.jsonl
+    python loadgen.py replay traffic.jsonl --speed 10 --label build-a --report a.json
+    python loadgen.py replay traffic.jsonl --speed 10 --label build-b --report b.json --url http://localhost:8081
+    python loadgen.py compare a.json b.json
+"""
+import os
+import sys
+import json
+import time
+import wave
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+
+import numpy as np
+
+from whisper_client import WhisperClient
+from whisper_client.client import SUPPORTED_FORMATS
+
+SAMPLE_RATE = 16000
+HOTWORD_METHODS = ('prompt_injection', 'logit_bias')
+
+
+def make_synthetic_audio(seconds, seed):
+    """生成类语音的合成音频, 每个种子的音高和节奏不同, 返回int16 PCM"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    base = rng.uniform(100, 220)
+    pitch = base + 30 * np.sin(2 * np.pi * rng.uniform(0.1, 0.5) * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / SAMPLE_RATE
+    voiced = sum(np.sin(k * phase) / k for k in range(1, 6))
+    envelope = 0.5 * (1 + np.sin(2 * np.pi * rng.uniform(2, 5) * t)) * (np.sin(2 * np.pi * 0.2 * t) > -0.3)
+    signal = 0.3 * voiced * envelope + 0.01 * rng.standard_normal(len(t))
+    return (np.clip(signal, -1, 1) * 32767).astype(np.int16)
+
+
+def write_audio(path, pcm, audio_format):
+    """写出音频文件; 非WAV格式用ffmpeg编码, 没有ffmpeg时退回WAV。返回实际文件路径"""
+    wav_path = os.path.splitext(path)[0] + '.wav'
+    with wave.open(wav_path, 'wb') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(SAMPLE_RATE)
+        wf.writeframes(pcm.tobytes())
+    if audio_format in (None, 'wav') or '.' + audio_format not in SUPPORTED_FORMATS or not shutil.which('ffmpeg'):
+        return wav_path
+    encoded = os.path.splitext(path)[0] + '.' + audio_format
+    result = subprocess.run(['ffmpeg', '-nostdin', '-hide_banner', '-loglevel', 'error', '-y', '-i', wav_path, encoded],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        return wav_path
+    os.unlink(wav_path)
+    return encoded
+
+
+def load_traffic(path):
+    with open(path, encoding='utf-8') as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    return sorted(records, key=lambda record: record['arrived_at'])
+
+
+def parse_mix(text, cast=float):
+    """解析 "值:权重,值:权重" 形式的分布"""
+    values, weights = [], []
+    for item in text.split(','):
+        value, _, weight = item.partition(':')
+        values.append(cast(value))
+        weights.append(float(weight or 1))
+    return values, weights
+
+
+def generate(args):
+    """按泊松到达过程和给定的时长、格式、热词分布生成流量记录"""
+    rng = random.Random(args.seed)
+    durations, duration_weights = parse_mix(args.durations)
+    formats, format_weights = parse_mix(args.formats, str)
+    arrived_at = time.time()
+    for _ in range(args.count):
+        arrived_at += rng.expovariate(args.rate)
+        hotword_count = rng.choice((3, 10, 30)) if rng.random() < args.hotword_ratio else 0
+        duration = rng.choices(durations, duration_weights)[0]
+        print(json.dumps({
+            'arrived_at': round(arrived_at, 3),
+            'entry': 'api',
+            'format': rng.choices(formats, format_weights)[0],
+            'duration': round(duration * rng.uniform(0.8, 1.2), 3),
+            'hotword_count': hotword_count,
+            'hotword_method': rng.choice(HOTWORD_METHODS) if hotword_count else None,
+            'rolling_context': rng.random() < args.rolling_context_ratio,
+            'language': None,
+            'ranges': 0
+        }))
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[int(fraction * (len(values) - 1))] if values else None
+
+
+def summarize(results, wall_seconds, label, speed):
+    ok = [result for result in results if result['success']]
+    latencies = [result['latency'] for result in ok]
+    first = [result['first_segment'] for result in ok if result['first_segment'] is not None]
+    audio = sum(result['duration'] for result in ok)
+    lateness = [result['start_lateness'] for result in results]
+    return {
+        'label': label,
+        'speed': speed,
+        'requests': len(results),
+        'succeeded': len(ok),
+        'errors': len(results) - len(ok),
+        'wall_seconds': round(wall_seconds, 3),
+        'requests_per_second': round(len(ok) / wall_seconds, 4) if wall_seconds else None,
+        'audio_seconds_per_second': round(audio / wall_seconds, 3) if wall_seconds else None,
+        'latency_p50': percentile(latencies, 0.5),
+        'latency_p90': percentile(latencies, 0.9),
+        'latency_p99': percentile(latencies, 0.99),
+        'latency_per_audio_minute_p50': round(percentile(
+            [result['latency'] / max(result['duration'] / 60, 1 / 60) for result in ok], 0.5) or 0, 3),
+        'first_segment_p50': percentile(first, 0.5),
+        'first_segment_p90': percentile(first, 0.9),
+        'max_start_lateness': round(max(lateness), 3) if lateness else None
+    }
+
+
+def replay(args):
+    """按记录的到达间隔 (除以 speed) 提交合成音频, 统计每个请求的延迟"""
+    records = load_traffic(args.traffic)[:args.limit or None]
+    if not records:
+        print("流量记录为空")
+        return 1
+    work_dir = tempfile.mkdtemp(prefix='loadgen_')
+    client = WhisperClient(args.url, args.username, args.password, pool_size=max(10, args.max_concurrency))
+    try:
+        print(f"准备 {len(records)} 个合成音频文件...", file=sys.stderr)
+        files = []
+        for i, record in enumerate(records):
+            pcm = make_synthetic_audio(record['duration'], seed=args.seed + i)
+            files.append(write_audio(os.path.join(work_dir, f"request_{i}.{record.get('format') or 'wav'}"), pcm,
+                                     record.get('format')))
+        client.login()
+
+        results = [None] * len(records)
+        slots = threading.Semaphore(args.max_concurrency)
+        origin = records[0]['arrived_at']
+
+        def run(i, record, scheduled):
+            with slots:
+                started = time.time()
+                first_segment = []
+                result = {'index': i, 'duration': record['duration'], 'hotword_count': record.get('hotword_count', 0),
+                          'hotword_method': record.get('hotword_method'), 'format': record.get('format'),
+                          'start_lateness': round(started - scheduled, 3)}
+                try:
+                    client.transcribe(
+                        files[i],
+                        on_segment=lambda segment: first_segment or first_segment.append(time.time() - started),
+                        hotwords=[f"hotword{k}" for k in range(record.get('hotword_count') or 0)],
+                        hotword_method=record.get('hotword_method') or 'prompt_injection',
+                        rolling_context=record.get('rolling_context', False),
+                        language=record.get('language'),
+                        quality=record.get('quality'))
+                    result.update(success=True)
+                except Exception as e:
+                    result.update(success=False, error=str(e))
+                result.update(latency=round(time.time() - started, 3),
+                              first_segment=round(first_segment[0], 3) if first_segment else None)
+                results[i] = result
+
+        started = time.time()
+        threads = []
+        for i, record in enumerate(records):
+            scheduled = started + (record['arrived_at'] - origin) / args.speed
+            time.sleep(max(0, scheduled - time.time()))
+            thread = threading.Thread(target=run, args=(i, record, scheduled), daemon=True)
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        summary = summarize(results, time.time() - started, args.label, args.speed)
+    finally:
+        client.close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print_summary(summary)
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump({'summary': summary, 'requests': results}, f, ensure_ascii=False, indent=2)
+        print(f"报告已保存到 {args.report}")
+    return 0 if summary['errors'] == 0 else 1
+
+
+SUMMARY_FIELDS = [
+    ('requests', "请求数", False),
+    ('errors', "失败", True),
+    ('wall_seconds', "总耗时 (s)", True),
+    ('requests_per_second', "请求/秒", False),
+    ('audio_seconds_per_second', "音频秒/秒", False),
+    ('latency_p50', "延迟 p50 (s)", True),
+    ('latency_p90', "延迟 p90 (s)", True),
+    ('latency_p99', "延迟 p99 (s)", True),
+    ('latency_per_audio_minute_p50', "每分钟音频延迟 p50 (s)", True),
+    ('first_segment_p50', "首段 p50 (s)", True),
+    ('first_segment_p90', "首段 p90 (s)", True),
+    ('max_start_lateness', "最大发送滞后 (s)", True),
+]
+
+
+def print_summary(summary):
+    print(f"== {summary['label']} (speed x{summary['speed']}) ==")
+    for key, name, _ in SUMMARY_FIELDS:
+        print(f"{name:<24} {summary[key]}")
+
+
+def compare(args):
+    """并列输出两份报告的汇总指标和变化百分比 (越小越好的指标变差时标记 !)"""
+    summaries = []
+    for path in (args.baseline, args.candidate):
+        with open(path, encoding='utf-8') as f:
+            summaries.append(json.load(f)['summary'])
+    baseline, candidate = summaries
+    print(f"{'':<24} {baseline['label']:>14} {candidate['label']:>14} {'change':>9}")
+    for key, name, lower_is_better in SUMMARY_FIELDS:
+        a, b = baseline.get(key), candidate.get(key)
+        change = f"{(b - a) / a * 100:+8.1f}%" if isinstance(a, (int, float)) and isinstance(b, (int, float)) and a else ''
+        worse = a is not None and b is not None and ((b > a) if lower_is_better else (b < a))
+        print(f"{name:<24} {str(a):>14} {str(b):>14} {change:>9}{' !' if worse and change else ''}")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Record/replay load generator for Whisper Web UI")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    gen = commands.add_parser('generate', help="write a synthetic traffic log to stdout")
+    gen.add_argument('--count', type=int, default=100)
+    gen.add_argument('--rate', type=float, default=0.5, help="mean arrivals per second")
+    gen.add_argument('--durations', default='15:0.5,300:0.4,3600:0.1', help="seconds:weight,...")
+    gen.add_argument('--formats', default='mp3:0.5,m4a:0.3,wav:0.2', help="format:weight,...")
+    gen.add_argument('--hotword-ratio', type=float, default=0.3)
+    gen.add_argument('--rolling-context-ratio', type=float, default=0.2)
+    gen.add_argument('--seed', type=int, default=0)
+
+    rep = commands.add_parser('replay', help="replay a traffic log against a running instance")
+    rep.add_argument('traffic', help="JSONL written by TRAFFIC_LOG or the generate command")
+    rep.add_argument('--url', default=os.environ.get('WHISPER_API_URL', 'http://localhost:8080'))
+    rep.add_argument('--username', default=os.environ.get('WHISPER_USERNAME', ''))
+    rep.add_argument('--password', default=os.environ.get('WHISPER_PASSWORD', ''))
+    rep.add_argument('--speed', type=float, default=1.0, help="divide recorded inter-arrival times by this factor")
+    rep.add_argument('--limit', type=int, default=0, help="only replay the first N requests")
+    rep.add_argument('--max-concurrency', type=int, default=64, help="client-side cap on open requests")
+    rep.add_argument('--label', default='run')
+    rep.add_argument('--report', help="write the summary and per-request results as JSON")
+    rep.add_argument('--seed', type=int, default=0)
+
+    cmp_parser = commands.add_parser('compare', help="compare two replay reports")
+    cmp_parser.add_argument('baseline')
+    cmp_parser.add_argument('candidate')
+
+    args = parser.parse_args(argv)
+    if args.command == 'generate':
+        return generate(args)
+    if args.command == 'replay':
+        return replay(args)
+    return compare(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
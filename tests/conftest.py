@@ -0,0 +1,90 @@
+import io
+import os
+import sys
+import tempfile
+import threading
+
+import numpy as np
+import pytest
+from werkzeug.serving import make_server
+
+# app 在导入时读取配置并创建存储和队列, 环境变量必须在导入之前设置
+TEST_DIR = tempfile.mkdtemp(prefix='whisper-tests-')
+for key, value in {
+    'SAGEMAKER_ENDPOINT': 'mock',
+    'MOCK_ENDPOINT_LATENCY_MS': '5',
+    'WARMUP_ON_STARTUP': '0',
+    'SECRET_KEY': 'test-secret',
+    'SESSION_STORE': 'memory',
+    'TRANSCRIPT_STORE_PATH': os.path.join(TEST_DIR, 'transcripts.db'),
+    'SEARCH_INDEX_PATH': os.path.join(TEST_DIR, 'search.db'),
+    'FINGERPRINT_INDEX_PATH': os.path.join(TEST_DIR, 'fingerprints.db'),
+    'SPOOL_DIR': os.path.join(TEST_DIR, 'spool'),
+    'ASYNC_ENDPOINT': 'mock',
+    'ASYNC_OBJECT_STORE': 'local',
+    'ASYNC_LOCAL_STORE_DIR': os.path.join(TEST_DIR, 'async'),
+    'ASYNC_POLL_INTERVAL': '0.05',
+}.items():
+    os.environ[key] = value
+# WORK_QUEUE=none 时不会创建共享目录, 队列测试直接使用
+os.makedirs(os.environ['SPOOL_DIR'], exist_ok=True)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as whisper_app  # noqa: E402
+
+USERS = {'alice': 'alice-pw', 'bob': 'bob-pw'}
+
+def make_pcm(seconds, seed=0):
+    """有声的随机噪声 (不会被当作静音或重复分段跳过)"""
+    rng = np.random.default_rng(seed)
+    return rng.integers(-8000, 8000, int(seconds * whisper_app.SAMPLE_RATE), dtype=np.int16)
+
+class ArrayDecoder:
+    """忽略文件内容, 返回给定PCM的对应时间范围 (测试环境没有ffmpeg)"""
+
+    def __init__(self, pcm):
+        self.pcm = pcm
+
+    def decode(self, file_path, start=None, duration=None):
+        first = int((start or 0) * whisper_app.SAMPLE_RATE)
+        last = None if duration is None else first + int(duration * whisper_app.SAMPLE_RATE)
+        return self.pcm[first:last]
+
+class FailingDecoder:
+    def decode(self, file_path, start=None, duration=None):
+        raise Exception("Failed to decode audio: corrupt file")
+
+def upload(name='meeting.wav', body=None):
+    """multipart 上传字段; 默认内容随机, 每次上传得到不同的任务ID"""
+    return {'audio_file': (io.BytesIO(body or os.urandom(2048)), name)}
+
+@pytest.fixture
+def decoder(monkeypatch):
+    """两个半分段长的音频, 同步和异步引擎都使用"""
+    decoder = ArrayDecoder(make_pcm(whisper_app.CHUNK_SECONDS * 2.5, seed=int.from_bytes(os.urandom(4), 'little')))
+    monkeypatch.setattr(whisper_app.transcription_engine, 'decoder', decoder)
+    if whisper_app.async_engine:
+        monkeypatch.setattr(whisper_app.async_engine, 'decoder', decoder)
+    return decoder
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(whisper_app, 'get_credentials', lambda: USERS)
+    # 仓库中不包含页面模板, 只测试页面路由的处理逻辑
+    monkeypatch.setattr(whisper_app, 'render_template', lambda *args, **kwargs: '')
+    return whisper_app.app.test_client()
+
+def login(client, username):
+    response = client.post('/login', data={'username': username, 'password': USERS[username]})
+    assert response.status_code == 302
+    return client
+
+@pytest.fixture
+def server(client, decoder):
+    # client 夹具已替换登录凭据和页面模板, 这里在本地端口上运行真实的HTTP服务
+    httpd = make_server('127.0.0.1', 0, whisper_app.app, threaded=True)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_port}"
+    httpd.shutdown()
+    thread.join()
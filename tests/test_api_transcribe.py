@@ -0,0 +1,58 @@
+import glob
+import os
+import tempfile
+
+import pytest
+
+import app
+from conftest import FailingDecoder, login, upload
+
+def temp_uploads():
+    return set(glob.glob(os.path.join(tempfile.gettempdir(), 'tmp*.*')))
+
+@pytest.mark.parametrize('name', ['talk.opus', 'talk.webm', 'talk.M4A'])
+def test_widened_formats_run_through_the_engine(client, decoder, name):
+    login(client, 'alice')
+    response = client.post('/api/transcribe', data=upload(name), content_type='multipart/form-data')
+    assert response.status_code == 200
+    assert len(response.get_json()['segments']) == 3
+    assert response.headers['X-Job-Id']
+
+def test_unsupported_format(client):
+    login(client, 'alice')
+    response = client.post('/api/transcribe', data=upload('talk.aiff'), content_type='multipart/form-data')
+    assert response.status_code == 400
+    assert 'Unsupported file format' in response.get_json()['error']
+
+def test_repeated_upload_is_served_from_storage(client, decoder, monkeypatch):
+    calls = []
+    factory = app.transcription_engine.predictor_factory
+    monkeypatch.setattr(app.transcription_engine, 'predictor_factory', lambda: calls.append(1) or factory())
+    login(client, 'alice')
+    audio = os.urandom(2048)
+
+    first = client.post('/api/transcribe', data=upload(body=audio), content_type='multipart/form-data')
+    first_segments = first.get_json()['segments']
+    second = client.post('/api/transcribe', data=upload(body=audio), content_type='multipart/form-data')
+
+    assert first.headers['X-Job-Id'] == second.headers['X-Job-Id']
+    assert first_segments == second.get_json()['segments']
+    assert len(calls) == 1
+
+def test_decode_failure_returns_500_and_removes_upload(client, monkeypatch):
+    monkeypatch.setattr(app.transcription_engine, 'decoder', FailingDecoder())
+    login(client, 'alice')
+    before = temp_uploads()
+
+    response = client.post('/api/transcribe', data=upload(), content_type='multipart/form-data')
+
+    assert response.status_code == 500
+    assert 'corrupt file' in response.get_json()['error']
+    assert temp_uploads() == before
+
+def test_upload_is_removed_after_streaming(client, decoder):
+    login(client, 'alice')
+    before = temp_uploads()
+    response = client.post('/api/transcribe', data=upload(), content_type='multipart/form-data')
+    response.get_data()
+    assert temp_uploads() == before
@@ -0,0 +1,168 @@
+import json
+import os
+import time
+
+import numpy as np
+import pytest
+
+import app
+from conftest import FailingDecoder, login, upload
+
+PAYLOAD = np.zeros(160, dtype=np.float16)
+
+def stored_objects(directory):
+    return sorted(os.path.relpath(os.path.join(root, name), directory)
+                  for root, _, names in os.walk(directory) for name in names)
+
+def wait_for_status(client, job_id, statuses, timeout=20):
+    deadline = time.time() + timeout
+    while True:
+        response = client.get(f'/api/transcribe/async/{job_id}')
+        if response.status_code != 200 or response.get_json()['status'] in statuses or time.time() > deadline:
+            return response
+        time.sleep(0.05)
+
+@pytest.fixture
+def store(tmp_path):
+    return app.LocalObjectStore(str(tmp_path / 'objects'))
+
+def test_local_object_store_round_trip(store):
+    uri = store.key_uri('input/abc')
+    assert uri.startswith('file://')
+    assert store.put(uri, b'payload') == uri
+    assert store.get(uri) == b'payload'
+    assert stored_objects(store.directory) == ['input/abc']
+
+    store.delete(uri)
+    assert store.get(uri) is None
+    # 删除不存在的对象不报错
+    store.delete(uri)
+
+def test_mock_runtime_completes_and_notifies(store):
+    notifications = app.LocalNotificationSource()
+    runtime = app.MockAsyncRuntime(store, app.MockPredictor(latency_ms=1), notifications=notifications)
+    input_location = store.put(store.key_uri('input/req-1'), app.PayloadSerializer().serialize(PAYLOAD))
+
+    response = runtime.invoke_endpoint_async(EndpointName='mock', InputLocation=input_location,
+                                             ContentType=app.PayloadSerializer.CONTENT_TYPE, InferenceId='req-1')
+    assert response['InferenceId'] == 'req-1'
+    [(body, ack)] = notifications.receive(5)
+    inference_id, succeeded, output_location, failure_reason = app.parse_async_notification(body)
+
+    assert (inference_id, succeeded, failure_reason) == ('req-1', True, None)
+    assert output_location == response['OutputLocation']
+    assert json.loads(store.get(output_location))['text'].startswith('[mock')
+    assert store.get(response['FailureLocation']) is None
+
+def test_mock_runtime_reports_failure(store):
+    notifications = app.LocalNotificationSource()
+    runtime = app.MockAsyncRuntime(store, app.MockPredictor(latency_ms=1, error_rate=1.0, endpoint_name='mock-async'),
+                                   notifications=notifications)
+    input_location = store.put(store.key_uri('input/req-2'), b'body')
+
+    response = runtime.invoke_endpoint_async(EndpointName='mock', InputLocation=input_location, InferenceId='req-2')
+    [(body, ack)] = notifications.receive(5)
+    inference_id, succeeded, output_location, failure_reason = app.parse_async_notification(body)
+
+    assert (inference_id, succeeded) == ('req-2', False)
+    assert failure_reason == 'mock endpoint mock-async failed'
+    assert store.get(response['FailureLocation']) == b'mock endpoint mock-async failed'
+    assert store.get(response['OutputLocation']) is None
+
+def test_mock_runtime_fails_on_missing_input(store):
+    notifications = app.LocalNotificationSource()
+    runtime = app.MockAsyncRuntime(store, app.MockPredictor(latency_ms=1), notifications=notifications)
+
+    runtime.invoke_endpoint_async(EndpointName='mock', InputLocation=store.key_uri('input/missing'), InferenceId='req-3')
+    [(body, ack)] = notifications.receive(5)
+
+    assert app.parse_async_notification(body)[3].startswith('Input not found')
+
+@pytest.mark.parametrize('notified', [False, True], ids=['poll', 'notification'])
+def test_async_client_submits_and_waits(store, notified):
+    notifications = app.LocalNotificationSource() if notified else None
+    runtime = app.MockAsyncRuntime(store, app.MockPredictor(latency_ms=1), notifications=notifications)
+    client = app.AsyncEndpointClient('mock', runtime, store,
+                                     app.AsyncResultWaiter(store, notifications, poll_interval=0.02))
+
+    result = json.loads(client.predict(PAYLOAD))
+
+    assert result['text'] == f"[mock {len(app.PayloadSerializer().serialize(PAYLOAD))} bytes]"
+    # 请求体和结果对象取回后删除
+    assert stored_objects(store.directory) == []
+
+@pytest.mark.parametrize('notified', [False, True], ids=['poll', 'notification'])
+def test_async_client_raises_failure(store, notified):
+    notifications = app.LocalNotificationSource() if notified else None
+    runtime = app.MockAsyncRuntime(store, app.MockPredictor(latency_ms=1, error_rate=1.0, endpoint_name='mock-async'),
+                                   notifications=notifications)
+    client = app.AsyncEndpointClient('mock', runtime, store,
+                                     app.AsyncResultWaiter(store, notifications, poll_interval=0.02))
+
+    with pytest.raises(Exception, match='Async inference failed: mock endpoint mock-async failed'):
+        client.predict(PAYLOAD)
+    assert stored_objects(store.directory) == []
+
+def test_async_job_status_until_complete(client, decoder):
+    login(client, 'alice')
+    response = client.post('/api/transcribe/async', data=dict(upload(), quality='fast'),
+                           content_type='multipart/form-data')
+    assert response.status_code == 202
+    submitted = response.get_json()
+    assert submitted['status'] == 'queued'
+    assert submitted['status_url'] == f"/api/transcribe/async/{submitted['job_id']}"
+
+    status = wait_for_status(client, submitted['job_id'], ('complete', 'failed')).get_json()
+    assert status['status'] == 'complete'
+    assert status['filename'] == 'meeting.wav'
+    assert (status['completed_segments'], status['total_segments'], status['progress']) == (3, 3, 100)
+
+    transcript = client.get(status['transcript_url']).get_json()
+    assert len(transcript['segments']) == 3
+
+def test_async_status_is_per_user(client, decoder):
+    audio = os.urandom(2048)
+    login(client, 'alice')
+    alice_job = client.post('/api/transcribe/async', data=upload(body=audio),
+                            content_type='multipart/form-data').get_json()['job_id']
+    assert wait_for_status(client, alice_job, ('complete',)).get_json()['status'] == 'complete'
+
+    # 另一个用户上传相同的音频得到自己的任务, 而不是对方已完成的任务
+    login(client, 'bob')
+    assert client.get(f'/api/transcribe/async/{alice_job}').status_code == 404
+    response = client.post('/api/transcribe/async', data=upload(body=audio), content_type='multipart/form-data')
+    bob_job = response.get_json()['job_id']
+    assert bob_job != alice_job
+    status = wait_for_status(client, bob_job, ('complete', 'failed'))
+    assert status.status_code == 200
+    assert status.get_json()['status'] == 'complete'
+
+    login(client, 'alice')
+    assert client.get(f'/api/transcribe/async/{bob_job}').status_code == 404
+    assert client.get(f'/api/transcribe/async/{alice_job}').status_code == 200
+
+def test_failed_async_job_expires(client, monkeypatch):
+    monkeypatch.setattr(app.async_engine, 'decoder', FailingDecoder())
+    login(client, 'alice')
+    job_id = client.post('/api/transcribe/async', data=upload(),
+                         content_type='multipart/form-data').get_json()['job_id']
+
+    status = wait_for_status(client, job_id, ('failed',)).get_json()
+    assert status['status'] == 'failed'
+    assert 'corrupt file' in status['error']
+
+    login(client, 'bob')
+    assert client.get(f'/api/transcribe/async/{job_id}').status_code == 404
+
+    login(client, 'alice')
+    monkeypatch.setattr(app, 'ASYNC_FAILED_TTL_SECONDS', 0)
+    assert client.get(f'/api/transcribe/async/{job_id}').status_code == 404
+    with app.async_jobs_lock:
+        assert job_id not in app.async_jobs
+
+def test_async_rejects_invalid_quality(client):
+    login(client, 'alice')
+    response = client.post('/api/transcribe/async', data=dict(upload(), quality='bogus'),
+                           content_type='multipart/form-data')
+    assert response.status_code == 400
+    assert 'Invalid quality' in response.get_json()['error']
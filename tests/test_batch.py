@@ -0,0 +1,71 @@
+import io
+import json
+import os
+import tarfile
+import zipfile
+
+import pytest
+
+from conftest import login
+
+def batch(client, **data):
+    response = client.post('/api/transcribe/batch', data=data, content_type='multipart/form-data')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    summary = lines.pop()
+    assert summary['summary']
+    return {line['filename']: line for line in lines}, summary
+
+def zip_archive(names):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as zf:
+        for name in names:
+            zf.writestr(name, os.urandom(2048))
+        zf.writestr('nested/', '')
+    buffer.seek(0)
+    return buffer
+
+def tar_archive(names):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz') as tf:
+        for name in names:
+            body = os.urandom(2048)
+            info = tarfile.TarInfo(name)
+            info.size = len(body)
+            tf.addfile(info, io.BytesIO(body))
+    buffer.seek(0)
+    return buffer
+
+def test_batch_of_uploaded_files(client, decoder):
+    login(client, 'alice')
+    results, summary = batch(client, audio_files=[(io.BytesIO(os.urandom(2048)), 'a.wav'),
+                                                  (io.BytesIO(os.urandom(2048)), 'b.mp3'),
+                                                  (io.BytesIO(b'notes'), 'notes.txt')])
+
+    assert (summary['total'], summary['succeeded']) == (3, 2)
+    assert results['notes.txt'] == {'filename': 'notes.txt', 'success': False, 'error': 'Unsupported file format'}
+    for name in ('a.wav', 'b.mp3'):
+        assert results[name]['success']
+        assert len(results[name]['segments']) == 3
+        assert results[name]['transcript'].count('[mock') == 3
+    assert results['a.wav']['job_id'] != results['b.mp3']['job_id']
+
+@pytest.mark.parametrize('name, build', [('recordings.zip', zip_archive), ('recordings.tar.gz', tar_archive)])
+def test_batch_of_archive_members(client, decoder, name, build):
+    login(client, 'alice')
+    results, summary = batch(client, archive=(build(['day1/a.m4a', 'day2/b.flac']), name))
+
+    assert (summary['total'], summary['succeeded']) == (2, 2)
+    assert set(results) == {'day1/a.m4a', 'day2/b.flac'}
+
+def test_batch_rejects_bad_input(client):
+    login(client, 'alice')
+    response = client.post('/api/transcribe/batch', data={'archive': (io.BytesIO(b'not a zip'), 'broken.zip')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 400
+    assert 'Invalid archive' in response.get_json()['error']
+
+    response = client.post('/api/transcribe/batch', data={}, content_type='multipart/form-data')
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'No files provided'
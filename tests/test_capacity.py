@@ -0,0 +1,41 @@
+import app
+from conftest import make_pcm
+
+def segments(*seconds):
+    return [{'index': i, 'pcm': make_pcm(length, seed=i)} for i, length in enumerate(seconds)]
+
+def test_backlog_follows_segments_through_a_job():
+    registry = app.MetricsRegistry()
+    tracker = app.CapacityTracker(registry)
+    job = tracker.open_job('whisper-a', segments(30, 30, 10))
+    assert tracker.snapshot()['whisper-a'] == {
+        'open_jobs': 1, 'queued_segments': 3, 'in_flight_segments': 0,
+        'queued_audio_seconds': 70.0, 'in_flight_audio_seconds': 0.0, 'backlog_audio_seconds': 70.0
+    }
+
+    job.start({'index': 0})
+    with tracker.in_flight('whisper-a', 30.0):
+        state = tracker.snapshot()['whisper-a']
+        assert (state['queued_segments'], state['in_flight_segments'], state['backlog_audio_seconds']) == (2, 1, 70.0)
+        assert 'whisper_backlog_segments{endpoint="whisper-a",state="in_flight"} 1' in registry.render()
+
+    # 任务中断时未开始的分段从积压中移除
+    job.close()
+    assert tracker.snapshot()['whisper-a'] == {
+        'open_jobs': 0, 'queued_segments': 0, 'in_flight_segments': 0,
+        'queued_audio_seconds': 0.0, 'in_flight_audio_seconds': 0.0, 'backlog_audio_seconds': 0.0
+    }
+    assert 'whisper_open_jobs{endpoint="whisper-a"} 0' in registry.render()
+
+def test_capacity_is_scrapable_without_login(client):
+    response = client.get('/api/capacity')
+    assert response.status_code == 200
+    assert {'replica', 'timestamp', 'endpoints'} <= set(response.get_json())
+
+def test_capacity_token_required_when_configured(client, monkeypatch):
+    monkeypatch.setattr(app, 'CAPACITY_TOKEN', 'scrape-secret')
+    assert client.get('/api/capacity').status_code == 401
+    assert client.get('/api/capacity', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+    response = client.get('/api/capacity', headers={'Authorization': 'Bearer scrape-secret'})
+    assert response.status_code == 200
+    assert 'endpoints' in response.get_json()
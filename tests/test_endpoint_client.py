@@ -0,0 +1,57 @@
+import io
+
+import numpy as np
+
+import app
+
+class FakeRuntime:
+    """记录 invoke_endpoint 的参数, 返回固定的响应体"""
+
+    def __init__(self, body=b'{"text": "\xe4\xbd\xa0\xe5\xa5\xbd"}'):
+        self.body = body
+        self.calls = []
+        self.streams = []
+
+    def invoke_endpoint(self, **kwargs):
+        self.calls.append(kwargs)
+        stream = io.BytesIO(self.body)
+        self.streams.append(stream)
+        return {'Body': stream, 'ContentType': 'application/json'}
+
+def test_predict_serializes_array_as_npy():
+    runtime = FakeRuntime()
+    pcm = np.arange(4, dtype=np.float16)
+
+    response = app.EndpointClient('whisper-a', runtime).predict(pcm)
+
+    [call] = runtime.calls
+    assert (call['EndpointName'], call['ContentType'], call['Accept']) == ('whisper-a', 'application/x-npy',
+                                                                           'application/json')
+    np.testing.assert_array_equal(np.load(io.BytesIO(call['Body'])), pcm)
+    assert response == '{"text": "你好"}'
+    assert runtime.streams[0].closed
+
+def test_initial_args_override_content_type_and_bytes_pass_through():
+    runtime = FakeRuntime()
+    app.EndpointClient('whisper-a', runtime).predict(b'RIFF....', {'ContentType': 'audio/wav', 'TargetVariant': 'v2'})
+
+    [call] = runtime.calls
+    assert call['Body'] == b'RIFF....'
+    assert (call['ContentType'], call['TargetVariant']) == ('audio/wav', 'v2')
+
+def test_runtime_client_is_shared_per_region(monkeypatch):
+    created = []
+    monkeypatch.setattr(app, '_runtime_clients', {})
+    monkeypatch.setattr(app.boto3, 'client', lambda service, region_name=None, config=None:
+                        created.append((service, region_name, config)) or object())
+
+    assert app.get_runtime_client('us-east-1') is app.get_runtime_client('us-east-1')
+    assert app.get_runtime_client('eu-west-1') is not app.get_runtime_client('us-east-1')
+    assert [(service, region) for service, region, _ in created] == [('sagemaker-runtime', 'us-east-1'),
+                                                                     ('sagemaker-runtime', 'eu-west-1')]
+    assert created[0][2].max_pool_connections >= app.SEGMENT_WORKERS
+
+    targets = app.parse_endpoint_targets('[{"name": "whisper-a", "region": "us-east-1"}, '
+                                         '{"name": "whisper-b", "region": "us-east-1"}]')
+    assert targets[0].client.runtime is targets[1].client.runtime
+    assert len(created) == 2
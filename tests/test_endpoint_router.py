@@ -0,0 +1,101 @@
+import random
+import time
+
+import numpy as np
+import pytest
+
+import app
+
+PAYLOAD = np.zeros(16, dtype=np.float16)
+
+def target(name, latency_ms=1, error_rate=0.0, weight=1.0):
+    return app.EndpointTarget(name, app.MockPredictor(latency_ms, error_rate=error_rate, endpoint_name=name), weight)
+
+@pytest.fixture(autouse=True)
+def seeded_random():
+    random.seed(1234)
+
+def test_ewma_prefers_fast_target():
+    fast, slow = target('mock-fast', latency_ms=1), target('mock-slow', latency_ms=40)
+    router = app.EndpointRouter([fast, slow])
+    predictor = router.for_job()
+    for _ in range(40):
+        predictor.predict(PAYLOAD)
+
+    assert fast.latency < slow.latency
+    assert fast.requests > 3 * slow.requests
+
+def test_failing_target_is_ejected_and_avoided():
+    healthy, broken = target('mock-healthy'), target('mock-broken', error_rate=1.0)
+    router = app.EndpointRouter([healthy, broken])
+    predictor = router.for_job()
+    # 每次失败都换到健康的端点重试, 调用方看不到错误
+    for _ in range(40):
+        assert '[mock' in predictor.predict(PAYLOAD)
+
+    assert broken.errors == broken.requests
+    assert broken.error_rate >= app.ROUTER_EJECT_ERROR_RATE
+    assert {stats['endpoint']: stats['ejected'] for stats in router.stats()} == {'mock-healthy': False,
+                                                                                'mock-broken': True}
+    assert healthy.requests == 40
+    assert broken.requests < 10
+
+def test_failed_call_is_retried_on_another_target():
+    # 权重让失败的端点总是被先选中
+    broken, healthy = target('mock-broken', error_rate=1.0, weight=1000), target('mock-healthy')
+    router = app.EndpointRouter([broken, healthy])
+
+    assert '[mock' in router.for_job().predict(PAYLOAD)
+    assert (broken.requests, broken.errors) == (1, 1)
+    assert (healthy.requests, healthy.errors) == (1, 0)
+    assert broken.in_flight == healthy.in_flight == 0
+
+def test_error_raised_after_max_attempts():
+    targets = [target(f'mock-broken-{i}', error_rate=1.0) for i in range(3)]
+    router = app.EndpointRouter(targets, max_attempts=2)
+
+    with pytest.raises(Exception, match='failed'):
+        router.for_job().predict(PAYLOAD)
+    assert sum(t.requests for t in targets) == 2
+
+def test_target_returns_after_cooldown(monkeypatch):
+    monkeypatch.setattr(app, 'ROUTER_COOLDOWN_SECONDS', 0.3)
+    flaky, healthy = target('mock-flaky', error_rate=1.0, weight=100), target('mock-healthy')
+    router = app.EndpointRouter([flaky, healthy])
+    predictor = router.for_job()
+    while flaky.ejected_until <= time.time():
+        predictor.predict(PAYLOAD)
+    flaky.client.error_rate = 0.0
+
+    # 暂停期间不会选中, 即使它的权重高得多
+    ejected_requests = flaky.requests
+    for _ in range(10):
+        predictor.predict(PAYLOAD)
+    assert flaky.requests == ejected_requests
+
+    time.sleep(0.35)
+    for _ in range(10):
+        predictor.predict(PAYLOAD)
+    assert flaky.requests > ejected_requests
+    assert not router.stats()[0]['ejected']
+    assert flaky.error_rate < app.ROUTER_EJECT_ERROR_RATE
+
+@pytest.mark.parametrize('config', ['mock-a:0,mock-b:1', 'mock-a:-1', 'mock-a:nan', 'mock-a:inf',
+                                    '[{"name": "mock-a", "weight": 0}]'])
+def test_non_positive_weights_are_rejected(config):
+    with pytest.raises(ValueError, match='weight of mock-a must be a positive number'):
+        app.parse_endpoint_targets(config)
+
+def test_parse_endpoint_targets():
+    targets = app.parse_endpoint_targets('mock-a:3,mock-b/hotwords:0.5')
+    assert [(t.name, t.variant, t.weight) for t in targets] == [('mock-a', None, 3.0), ('mock-b', 'hotwords', 0.5)]
+
+def test_choose_falls_back_to_uniform_when_all_weights_are_zero():
+    # 绕过解析直接构造的目标, 全部暂停且权重为0
+    targets = [target('mock-a', weight=0), target('mock-b', weight=0)]
+    for t in targets:
+        t.ejected_until = time.time() + 60
+    router = app.EndpointRouter(targets)
+
+    chosen = {router.choose(targets).name for _ in range(20)}
+    assert chosen == {'mock-a', 'mock-b'}
@@ -0,0 +1,34 @@
+import numpy as np
+
+import app
+from conftest import ArrayDecoder, make_pcm
+
+def run(pcm, **options):
+    engine = app.TranscriptionEngine(decoder=ArrayDecoder(pcm))
+    return list(engine.run('unused.wav', dict(options), app.MockPredictor(latency_ms=1)))
+
+def test_provisional_first_window_precedes_init():
+    events = run(make_pcm(70), fast_start=True)
+
+    assert [event['type'] for event in events[:2]] == ['provisional', 'init']
+    provisional = events[0]['segment']
+    assert provisional['provisional'] is True
+    assert (provisional['index'], provisional['start'], provisional['end']) == (0, 0.0, app.FAST_START_SECONDS)
+    # 完整的第一段以 segment 事件替换临时结果
+    first = next(event['segment'] for event in events if event['type'] == 'segment')
+    assert first['index'] == 0 and first['end'] == 30.0 and 'provisional' not in first
+    assert events[-1]['type'] == 'complete'
+
+def test_provisional_window_starts_at_first_range():
+    events = run(make_pcm(70), fast_start=True, ranges=[(40, 45)])
+    provisional = events[0]['segment']
+    assert (provisional['start'], provisional['end']) == (40.0, 45.0)
+
+def test_silent_opening_has_no_provisional_event():
+    pcm = np.concatenate([np.zeros(10 * app.SAMPLE_RATE, dtype=np.int16), make_pcm(30)])
+    events = run(pcm, fast_start=True)
+    assert events[0]['type'] == 'init'
+    assert 'provisional' not in [event['type'] for event in events]
+
+def test_without_fast_start_init_comes_first():
+    assert run(make_pcm(40))[0]['type'] == 'init'
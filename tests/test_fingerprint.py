@@ -0,0 +1,51 @@
+import app
+from conftest import ArrayDecoder, make_pcm
+
+def transcribe(pcm, index, username='alice', **options):
+    engine = app.TranscriptionEngine(decoder=ArrayDecoder(pcm), fingerprint_index=index,
+                                     predictor_factory=lambda: app.MockPredictor(latency_ms=1))
+    events = engine.run('unused.wav', dict(options, username=username, job_id=None))
+    return [event['segment'] for event in events if event['type'] == 'segment']
+
+def test_near_duplicate_audio_is_reused():
+    index = app.MemoryFingerprintIndex()
+    pcm = make_pcm(app.CHUNK_SECONDS * 2, seed=7)
+    first = transcribe(pcm, index)
+    assert not any(record.get('reused') for record in first)
+
+    # 音量变化后的同一段录音
+    quieter = (pcm * 0.7).astype(pcm.dtype)
+    second = transcribe(quieter, index)
+    assert [record['text'] for record in second] == [record['text'] for record in first]
+    for record in second:
+        assert record['reused']['segment_index'] == record['index']
+        assert record['reused']['similarity'] >= app.FINGERPRINT_MATCH_THRESHOLD
+        # 不向客户端透露来源任务
+        assert 'job_id' not in record['reused']
+
+def test_results_are_not_shared_between_users():
+    index = app.MemoryFingerprintIndex()
+    pcm = make_pcm(app.CHUNK_SECONDS, seed=8)
+    transcribe(pcm, index, username='alice')
+
+    assert not any(record.get('reused') for record in transcribe(pcm, index, username='bob'))
+    assert all(record.get('reused') for record in transcribe(pcm, index, username='alice'))
+
+def test_results_are_not_shared_across_context_settings():
+    index = app.MemoryFingerprintIndex()
+    pcm = make_pcm(app.CHUNK_SECONDS, seed=9)
+    transcribe(pcm, index)
+
+    assert not any(record.get('reused') for record in transcribe(pcm, index, rolling_context=True))
+    assert not any(record.get('reused') for record in transcribe(
+        pcm, index, hotwords_config={'method': 'prompt_injection', 'words': ['Nightingale']}))
+    assert not any(record.get('reused') for record in transcribe(pcm, index, language='en'))
+
+def test_variant_key():
+    hotwords = {'method': 'prompt_injection', 'words': ['b', 'a']}
+    assert app.fingerprint_variant(hotwords, username='alice') == app.fingerprint_variant(
+        {'method': 'prompt_injection', 'words': ['a', 'b']}, username='alice')
+    assert app.fingerprint_variant(hotwords, username='alice') != app.fingerprint_variant(hotwords, username='bob')
+    assert app.fingerprint_variant(None, username='alice') != app.fingerprint_variant(None, username='alice',
+                                                                                       rolling_context=True)
+    assert app.fingerprint_variant(None, tier='fast') != app.fingerprint_variant(None, tier='accurate')
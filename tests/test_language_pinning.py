@@ -0,0 +1,50 @@
+import json
+
+import app
+from conftest import ArrayDecoder, make_pcm
+
+class LanguagePredictor:
+    """记录每次请求指定的语言, 返回固定的检测结果"""
+
+    def __init__(self, detected='en'):
+        self.detected = detected
+        self.requested = []
+
+    def predict(self, data, initial_args=None):
+        language = None
+        if isinstance(data, dict):
+            language = data.get('language')
+        elif isinstance(data, bytes) and data.startswith(b'{'):
+            language = json.loads(data).get('language')
+        self.requested.append(language)
+        return json.dumps({'text': 'hello', 'language': language or self.detected})
+
+def run(predictor, **options):
+    engine = app.TranscriptionEngine(decoder=ArrayDecoder(make_pcm(90)), max_in_flight=1)
+    return list(engine.run('unused.wav', dict(options), predictor))
+
+def test_first_detected_language_is_pinned():
+    predictor = LanguagePredictor()
+    events = run(predictor)
+
+    assert predictor.requested == [None, 'en', 'en']
+    assert events[-1]['language'] == 'en'
+
+def test_explicit_language_is_sent_with_every_segment():
+    predictor = LanguagePredictor()
+    events = run(predictor, language='ja')
+
+    assert predictor.requested == ['ja', 'ja', 'ja']
+    assert events[0]['language'] == events[-1]['language'] == 'ja'
+
+def test_pinning_can_be_disabled():
+    predictor = LanguagePredictor()
+    events = run(predictor, pin_language=False)
+    assert predictor.requested == [None, None, None]
+    assert events[-1]['language'] is None
+
+def test_language_from_plain_text_response():
+    assert app.response_language('{"text": "hi", "language": "de"}', 'hi') == 'de'
+    assert app.response_language(b'plain', '今天的会议开始了') == 'zh'
+    assert app.response_language('plain', 'こんにちは') == 'ja'
+    assert app.response_language('plain', 'hello world') is None
@@ -0,0 +1,86 @@
+import json
+from types import SimpleNamespace
+
+import numpy as np
+
+import app
+from conftest import ArrayDecoder, make_pcm
+
+class FakeWhisperModel:
+    """模拟 faster_whisper.WhisperModel.transcribe 的返回值"""
+
+    def __init__(self):
+        self.calls = []
+
+    def transcribe(self, audio, **options):
+        self.calls.append((audio, options))
+        words = [SimpleNamespace(word=' 你好', start=0.0, end=0.4)]
+        segments = iter([SimpleNamespace(text=' 你好', words=words), SimpleNamespace(text='世界', words=None)])
+        return segments, SimpleNamespace(language='zh')
+
+def local_predictor():
+    predictor = app.LocalWhisperPredictor(model='tiny')
+    predictor._model = FakeWhisperModel()
+    return predictor
+
+def test_local_transcribe_maps_fields_and_returns_endpoint_json():
+    predictor = local_predictor()
+    response = predictor.transcribe(np.array([16384, -32768], dtype=np.int16),
+                                    {'language': 'zh', 'initial_prompt': '上文', 'logit_bias': ['热词', 'Kubernetes']})
+
+    assert json.loads(response) == {'text': '你好世界', 'language': 'zh',
+                                    'words': [{'word': ' 你好', 'start': 0.0, 'end': 0.4}]}
+    [(audio, options)] = predictor._model.calls
+    np.testing.assert_allclose(audio, [0.5, -1.0])
+    assert (options['language'], options['initial_prompt'], options['hotwords']) == ('zh', '上文', '热词 Kubernetes')
+    assert options['condition_on_previous_text'] is False
+
+def test_local_predictor_accepts_endpoint_payload():
+    predictor = local_predictor()
+    predictor.predict({'audio': np.array([0.5], dtype=np.float16), 'language': 'en'})
+    [(audio, options)] = predictor._model.calls
+    np.testing.assert_allclose(audio, [0.5])
+    assert options['language'] == 'en'
+
+def test_predict_audio_passes_pcm_to_local_backend():
+    predictor = local_predictor()
+    pcm = make_pcm(1)
+    app.predict_audio(predictor, pcm, 'flac', {'initial_prompt': '热词'})
+    [(audio, options)] = predictor._model.calls
+    np.testing.assert_allclose(audio, pcm.astype(np.float32) / 32768.0)
+    assert options['initial_prompt'] == '热词'
+
+def test_backend_router_routes_by_duration():
+    local, remote = local_predictor(), app.MockPredictor(latency_ms=1)
+    router = app.BackendRouter(local, remote, local_max_seconds=60)
+
+    assert app.select_predictor(router, None, 30) is local
+    assert app.select_predictor(router, None, 60) is local
+    assert app.select_predictor(router, None, 61) is remote
+    # 时长未知时使用端点
+    assert app.select_predictor(router) is remote
+    assert router.endpoint_name == remote.endpoint_name
+
+def test_engine_uses_local_backend_for_short_audio():
+    local, remote = local_predictor(), app.MockPredictor(latency_ms=1)
+    engine = app.TranscriptionEngine(decoder=ArrayDecoder(make_pcm(45)))
+
+    events = list(engine.run('unused.wav', {}, app.BackendRouter(local, remote, local_max_seconds=60)))
+
+    assert len(local._model.calls) == 2
+    assert events[-1]['transcript'].count('你好世界') == 2
+
+    engine = app.TranscriptionEngine(decoder=ArrayDecoder(make_pcm(90)))
+    events = list(engine.run('unused.wav', {}, app.BackendRouter(local_predictor(), remote, local_max_seconds=60)))
+    assert events[-1]['transcript'].count('[mock') == 3
+
+def test_get_predictor_by_backend(monkeypatch):
+    monkeypatch.setattr(app, '_local_predictor', None)
+    monkeypatch.setattr(app, 'INFERENCE_BACKEND', 'local')
+    assert isinstance(app.get_predictor(), app.LocalWhisperPredictor)
+    assert app.get_predictor() is app.get_local_predictor()
+
+    monkeypatch.setattr(app, 'INFERENCE_BACKEND', 'auto')
+    router = app.get_predictor()
+    assert isinstance(router, app.BackendRouter)
+    assert router.local is app.get_local_predictor()
@@ -0,0 +1,99 @@
+import pytest
+
+import app
+from conftest import ArrayDecoder, login, make_pcm, upload
+
+class CountingPredictor(app.MockPredictor):
+    def __init__(self, endpoint_name):
+        super().__init__(latency_ms=1, endpoint_name=endpoint_name)
+        self.calls = 0
+
+    def predict(self, data, initial_args=None):
+        self.calls += 1
+        return super().predict(data, initial_args)
+
+class FixedCapacity:
+    """固定的积压快照"""
+
+    def __init__(self, backlog):
+        self.backlog = backlog
+
+    def snapshot(self):
+        return {label: {'backlog_audio_seconds': seconds} for label, seconds in self.backlog.items()}
+
+def make_router(**kwargs):
+    tiers = [app.ModelTier(name, CountingPredictor(f"mock-{name}"), max_backlog_seconds=600)
+             for name in ('small', 'turbo', 'large')]
+    return app.ModelTierRouter(tiers, **kwargs)
+
+def test_parse_model_tiers():
+    tiers = app.parse_model_tiers('fast=local:tiny,accurate=mock-large/v2')
+    assert [tier.name for tier in tiers] == ['fast', 'accurate']
+    assert isinstance(tiers[0].predictor, app.LocalWhisperPredictor)
+    assert tiers[0].labels == {'local:tiny'}
+    assert [target.label for target in tiers[1].predictor.targets] == ['mock-large/v2']
+    assert tiers[1].labels == {'accurate:default', 'accurate:hotwords'}
+
+    tiers = app.parse_model_tiers('[{"tier": "turbo", "endpoints": "mock-a:2,mock-b"}, '
+                                  '{"tier": "gpu", "endpoints": [{"name": "mock-gpu"}], "max_backlog_seconds": 60}]')
+    assert [target.weight for target in tiers[0].predictor.targets] == [2.0, 1.0]
+    assert tiers[1].max_backlog_seconds == 60
+
+    for config in ('', 'a=mock-1,a=mock-2'):
+        with pytest.raises(ValueError):
+            app.parse_model_tiers(config)
+
+def test_choose_by_duration_and_quality():
+    router = make_router(short_seconds=60)
+    idle = FixedCapacity({})
+    assert router.choose_tier(30, None, idle).name == 'small'
+    assert router.choose_tier(3600, None, idle).name == 'turbo'
+    assert router.choose_tier(None, None, idle).name == 'turbo'
+    assert router.choose_tier(30, 'accurate', idle).name == 'large'
+    assert router.choose_tier(3600, 'fast', idle).name == 'small'
+    assert router.choose_tier(3600, 'large', idle).name == 'large'
+    assert make_router(default='large').choose_tier(3600, None, idle).name == 'large'
+    with pytest.raises(ValueError):
+        router.choose_tier(30, 'medium', idle)
+
+def test_backlog_downgrades_to_faster_tier():
+    router = make_router()
+    busy = FixedCapacity({'mock-large': 900, 'mock-turbo': 600, 'mock-small': 10000})
+    # 最快的档位不再降级
+    assert router.choose_tier(3600, 'accurate', busy).name == 'small'
+    assert router.choose_tier(3600, None, FixedCapacity({'mock-turbo': 599})).name == 'turbo'
+
+    jobs = {stats['tier']: stats['jobs'] for stats in router.stats()}
+    assert jobs['small'] == {'backlog': 1}
+    assert jobs['turbo'] == {'default': 1}
+
+def test_engine_transcribes_with_chosen_tier():
+    router = make_router(short_seconds=60)
+    engine = app.TranscriptionEngine(decoder=ArrayDecoder(make_pcm(90)), capacity=app.CapacityTracker())
+    list(engine.run('unused.wav', {'quality': 'accurate'}, router))
+    assert [tier.predictor.calls for tier in router.tiers] == [0, 0, 3]
+
+    engine = app.TranscriptionEngine(decoder=ArrayDecoder(make_pcm(45)), capacity=app.CapacityTracker())
+    list(engine.run('unused.wav', {}, router))
+    assert [tier.predictor.calls for tier in router.tiers] == [2, 0, 3]
+
+def test_api_quality_parameter(client, decoder, monkeypatch):
+    router = make_router()
+    monkeypatch.setattr(app, 'MODEL_TIERS', 'configured')
+    monkeypatch.setattr(app, 'model_tier_router', router)
+    login(client, 'alice')
+
+    response = client.post('/api/transcribe', data=dict(upload(), quality='large'), content_type='multipart/form-data')
+    assert response.status_code == 200
+    response.get_data()
+    assert router.tiers[2].predictor.calls == 3
+    assert [stats['jobs'] for stats in client.get('/api/tiers').get_json()['tiers']][2] == {'requested': 1}
+
+    response = client.post('/api/transcribe', data=dict(upload(), quality='medium'), content_type='multipart/form-data')
+    assert response.status_code == 400
+
+def test_quality_without_tiers(client):
+    login(client, 'alice')
+    assert client.get('/api/tiers').get_json() == {'tiers': []}
+    response = client.post('/api/transcribe', data=dict(upload(), quality='large'), content_type='multipart/form-data')
+    assert response.status_code == 400
@@ -0,0 +1,70 @@
+import json
+
+import pytest
+
+import app
+from conftest import login, upload
+
+SEGMENTS = [
+    {'index': 0, 'start': 0.0, 'end': 30.0, 'text': '第一段 "引号"'},
+    {'index': 1, 'start': 30.0, 'end': 60.0, 'text': '', 'skipped': 'silence'},
+    {'index': 2, 'start': 60.0, 'end': 3725.5, 'text': 'third',
+     'words': [{'word': 'third', 'start': 60.2, 'end': 60.6}]},
+]
+
+def render(writer, segments=SEGMENTS):
+    return ''.join(writer(iter(segments)))
+
+def test_format_timestamp():
+    assert app.format_timestamp(3725.5) == '01:02:05.500'
+    assert app.format_timestamp(0.001, ',') == '00:00:00,001'
+
+def test_srt_numbers_cues_and_skips_empty_segments():
+    assert render(app.write_srt) == ('1\n00:00:00,000 --> 00:00:30,000\n第一段 "引号"\n\n'
+                                     '2\n00:01:00,000 --> 01:02:05,500\nthird\n\n')
+
+def test_vtt():
+    assert render(app.write_vtt) == ('WEBVTT\n\n'
+                                     '00:00:00.000 --> 00:00:30.000\n第一段 "引号"\n\n'
+                                     '00:01:00.000 --> 01:02:05.500\nthird\n\n')
+
+def test_txt():
+    assert render(app.write_txt) == '第一段 "引号" third\n'
+
+def test_json_is_valid_and_escapes_transcript():
+    result = json.loads(render(app.write_json))
+    assert result == {'success': True, 'segments': SEGMENTS, 'transcript': '第一段 "引号" third'}
+    assert json.loads(render(app.write_json, [])) == {'success': True, 'segments': [], 'transcript': ''}
+
+def test_ndjson_one_segment_per_line():
+    lines = render(app.write_ndjson).splitlines()
+    assert [json.loads(line) for line in lines] == SEGMENTS
+    assert '第一段' in lines[0]
+
+@pytest.mark.parametrize('output_format, mimetype', [
+    ('json', 'application/json'), ('ndjson', 'application/x-ndjson'), ('srt', 'application/x-subrip'),
+    ('vtt', 'text/vtt'), ('txt', 'text/plain'),
+])
+def test_api_transcribe_formats(client, decoder, output_format, mimetype):
+    login(client, 'alice')
+    response = client.post('/api/transcribe', data=dict(upload(), format=output_format),
+                           content_type='multipart/form-data')
+    assert response.status_code == 200
+    assert response.mimetype == mimetype
+    body = response.get_data(as_text=True)
+    if output_format == 'json':
+        assert len(json.loads(body)['segments']) == 3
+    elif output_format == 'ndjson':
+        assert [json.loads(line)['index'] for line in body.splitlines()] == [0, 1, 2]
+    elif output_format == 'srt':
+        assert body.startswith('1\n00:00:00,000 --> 00:00:30,000\n[mock')
+    elif output_format == 'vtt':
+        assert body.startswith('WEBVTT\n\n00:00:00.000 --> 00:00:30.000\n[mock')
+    else:
+        assert body.count('[mock') == 3
+
+def test_api_transcribe_rejects_unknown_format(client):
+    login(client, 'alice')
+    response = client.post('/api/transcribe', data=dict(upload(), format='docx'), content_type='multipart/form-data')
+    assert response.status_code == 400
+    assert 'Invalid format' in response.get_json()['error']
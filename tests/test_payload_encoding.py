@@ -0,0 +1,125 @@
+import io
+import json
+import os
+import shutil
+import sys
+import time
+
+import numpy as np
+import pytest
+from botocore.exceptions import ClientError
+
+import app
+from conftest import make_pcm
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'code'))
+from payload_codec import decode_payload  # noqa: E402
+
+needs_flac = pytest.mark.skipif(app.soundfile is None and not shutil.which('ffmpeg'),
+                                reason='flac encoding needs soundfile or ffmpeg')
+
+def client_error(code, http_status, original_status=None, message='error'):
+    response = {'Error': {'Code': code, 'Message': message}, 'ResponseMetadata': {'HTTPStatusCode': http_status}}
+    if original_status is not None:
+        response.update(OriginalStatusCode=original_status, OriginalMessage=message)
+    return ClientError(response, 'InvokeEndpoint')
+
+class ContainerPredictor:
+    """模拟推理容器: 用 payload_codec 解码请求体; legacy 容器只认识npy请求, 其他 ContentType 以 ModelError 415 拒绝"""
+
+    def __init__(self, legacy=False):
+        self.legacy = legacy
+        self.requests = []
+
+    def predict(self, data, initial_args=None):
+        content_type = (initial_args or {}).get('ContentType', 'application/x-npy')
+        if self.legacy and content_type != 'application/x-npy':
+            raise client_error('ModelError', 424, 415, f"Content type {content_type} is not supported by this server")
+        if isinstance(data, bytes):
+            request = decode_payload(data, content_type)
+        else:
+            buffer = io.BytesIO()
+            np.save(buffer, data if isinstance(data, np.ndarray) else np.array(data))
+            request = decode_payload(buffer.getvalue(), 'application/x-npy')
+        self.requests.append((content_type, request))
+        return json.dumps({'text': 'ok', 'language': request.get('language') or 'zh'})
+
+@pytest.fixture(autouse=True)
+def negotiator(monkeypatch):
+    negotiator = app.PayloadNegotiator(reprobe_seconds=0.2)
+    monkeypatch.setattr(app, 'payload_negotiator', negotiator)
+    return negotiator
+
+@pytest.mark.parametrize('error, rejected', [
+    (client_error('ValidationError', 400, message='Invalid ContentType'), True),
+    (client_error('ModelError', 424, 415, "Content type audio/flac is not supported"), True),
+    (client_error('ModelError', 424, 400, "Failed to parse request body"), True),
+    (client_error('ModelError', 424, 500, "CUDA out of memory"), False),
+    (client_error('ModelError', 424, 503, "Worker died"), False),
+    (client_error('ModelError', 424), False),
+    (client_error('ValidationError', 500), False),
+    (client_error('ThrottlingException', 400), False),
+    (Exception("Unsupported content type: audio/flac"), True),
+    (Exception("Read timeout on endpoint URL"), False),
+], ids=['validation-400', 'model-415', 'model-400', 'model-500', 'model-503', 'model-no-status', 'validation-500',
+        'throttling', 'codec-message', 'timeout'])
+def test_is_payload_rejection(error, rejected):
+    assert app.is_payload_rejection(error) is rejected
+
+def test_int16_round_trip():
+    pcm = make_pcm(1)
+    body, content_type = app.encode_audio(pcm, 'int16')
+    assert content_type == 'application/x-pcm-s16le'
+    assert len(body) == pcm.nbytes
+    np.testing.assert_array_equal(decode_payload(body, content_type)['audio'], pcm.astype(np.float32) / 32768.0)
+
+@needs_flac
+def test_flac_round_trip_is_lossless():
+    pcm = make_pcm(1)
+    body, content_type = app.encode_audio(pcm, 'flac')
+    assert content_type == 'audio/flac'
+    assert len(body) < pcm.nbytes * 1.1
+    audio = decode_payload(body, content_type)['audio']
+    np.testing.assert_array_equal(np.round(audio * 32768.0).astype(np.int16), pcm)
+
+def test_json_request_carries_fields_and_compressed_audio():
+    pcm = make_pcm(1)
+    container = ContainerPredictor()
+    app.predict_audio(container, pcm, 'int16', {'initial_prompt': '热词', 'language': 'zh'})
+
+    [(content_type, request)] = container.requests
+    assert content_type == 'application/json'
+    assert (request['initial_prompt'], request['language']) == ('热词', 'zh')
+    np.testing.assert_array_equal(request['audio'], pcm.astype(np.float32) / 32768.0)
+
+def test_unsupported_content_type_raises():
+    with pytest.raises(ValueError, match='Unsupported content type'):
+        decode_payload(b'', 'audio/mpeg')
+
+def test_legacy_container_falls_back_to_float16_and_recovers(negotiator):
+    pcm = make_pcm(1)
+    container = ContainerPredictor(legacy=True)
+
+    # 未升级的容器拒绝压缩编码, 本次调用以 float16 重试成功
+    assert json.loads(app.predict_audio(container, pcm, 'int16'))['text'] == 'ok'
+    assert [content_type for content_type, _ in container.requests] == ['application/x-npy']
+    assert negotiator.effective('int16') == 'float16'
+    # 回退期间直接发送 float16, 不再先被拒绝一次
+    app.predict_audio(container, pcm, 'int16')
+    assert len(container.requests) == 2
+
+    # 容器升级后, 过了重新探测时间恢复使用压缩编码
+    container.legacy = False
+    time.sleep(0.25)
+    app.predict_audio(container, pcm, 'int16')
+    assert container.requests[-1][0] == 'application/x-pcm-s16le'
+    assert negotiator.effective('int16') == 'int16'
+
+def test_transient_model_error_does_not_fall_back(negotiator):
+    class BrokenPredictor:
+        def predict(self, data, initial_args=None):
+            raise client_error('ModelError', 424, 500, "CUDA out of memory")
+
+    with pytest.raises(ClientError):
+        app.predict_audio(BrokenPredictor(), make_pcm(1), 'int16')
+    assert negotiator.effective('int16') == 'int16'
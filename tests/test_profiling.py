@@ -0,0 +1,97 @@
+import marshal
+import threading
+import time
+
+import pytest
+
+import app
+from conftest import login, upload
+
+@pytest.fixture
+def profiler(monkeypatch):
+    profiler = app.RequestProfiler()
+    monkeypatch.setattr(app, 'request_profiler', profiler)
+    monkeypatch.setattr(app, 'ADMIN_USERS', {'alice'})
+    yield profiler
+    profiler.stop()
+
+def test_admin_endpoints_require_admin(client, monkeypatch):
+    monkeypatch.setattr(app, 'ADMIN_USERS', set())
+    login(client, 'alice')
+    assert client.get('/api/admin/profile').status_code == 404
+
+    monkeypatch.setattr(app, 'ADMIN_USERS', {'alice'})
+    login(client, 'bob')
+    assert client.get('/api/admin/profile').status_code == 403
+    assert client.get('/api/admin/memory').status_code == 403
+
+def test_cprofile_next_request(client, decoder, profiler):
+    login(client, 'alice')
+    assert client.post('/api/admin/profile', json={'mode': 'cprofile', 'requests': 1}).status_code == 202
+    assert client.post('/api/admin/profile', json={'mode': 'sampler', 'seconds': 5}).status_code == 409
+
+    client.post('/api/transcribe', data=upload(), content_type='multipart/form-data').get_data()
+
+    status = client.get('/api/admin/profile').get_json()['profile']
+    assert (status['running'], status['requests'], status['skipped_requests']) == (False, 1, 0)
+    text = client.get('/api/admin/profile/result?format=text&limit=200').get_data(as_text=True)
+    assert 'decode_segments' in text
+    stats = marshal.loads(client.get('/api/admin/profile/result?format=pstats').get_data())
+    assert any(name == 'decode_segments' for _, _, name in stats)
+    assert client.get('/api/admin/profile/result?format=collapsed').status_code == 400
+
+def test_cprofile_analyzes_one_request_at_a_time(profiler):
+    profiler.start('cprofile', requests=3)
+    first = profiler.begin('a')
+    # 与正在分析的请求并发的请求不分析
+    assert profiler.begin('b') is None
+    first.end()
+    second = profiler.begin('c')
+    assert second is not None
+    second.end()
+
+    status = profiler.status()
+    assert (status['requests'], status['skipped_requests'], status['running']) == (2, 1, True)
+    profiler.stop()
+    assert profiler.begin('d') is None
+
+def test_sampler_collects_worker_stacks(profiler):
+    stop = threading.Event()
+
+    def busy_loop():
+        while not stop.is_set():
+            sum(range(1000))
+
+    worker = threading.Thread(target=busy_loop, name='busy-worker_3')
+    worker.start()
+    try:
+        profiler.start('sampler', seconds=5, interval=0.005)
+        time.sleep(0.2)
+    finally:
+        profiler.stop()
+        stop.set()
+        worker.join()
+
+    collapsed = profiler.result('collapsed')
+    assert any(line.startswith('busy-worker;') and 'busy_loop' in line for line in collapsed.splitlines())
+    with pytest.raises(ValueError, match='no cProfile data'):
+        profiler.result('text')
+
+def test_start_validates_parameters(client, profiler):
+    login(client, 'alice')
+    assert client.post('/api/admin/profile', json={'mode': 'perf', 'requests': 1}).status_code == 400
+    assert client.post('/api/admin/profile', json={'mode': 'cprofile'}).status_code == 400
+    assert client.get('/api/admin/profile/result').status_code == 404
+
+def test_memory_diff(client, monkeypatch):
+    monkeypatch.setattr(app, 'ADMIN_USERS', {'alice'})
+    login(client, 'alice')
+    try:
+        assert client.post('/api/admin/memory', json={'frames': 2}).get_json()['tracing'] is True
+        retained = [bytearray(1024) for _ in range(200)]
+        diff = client.get('/api/admin/memory?limit=5').get_json()['diff']
+        assert diff and diff[0]['size_diff'] >= 200 * 1024
+    finally:
+        assert client.delete('/api/admin/memory').get_json()['tracing'] is False
+    assert client.get('/api/admin/memory').status_code == 400
+    del retained
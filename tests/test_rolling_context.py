@@ -0,0 +1,56 @@
+import json
+
+import pytest
+
+import app
+from conftest import make_pcm
+
+class RecordingPredictor:
+    """记录每次请求的附加字段"""
+
+    def __init__(self):
+        self.fields = []
+
+    def predict(self, data, initial_args=None):
+        self.fields.append({key: value for key, value in data.items() if key != 'audio'} if isinstance(data, dict) else {})
+        return json.dumps({'text': 'ok'})
+
+@pytest.mark.parametrize('method', ['prompt_injection', 'logit_bias', 'no_such_method'])
+def test_context_is_sent_for_every_hotword_method(method):
+    predictor = RecordingPredictor()
+    app.predict_with_hotwords(predictor, make_pcm(1), {'method': method, 'words': ['Kubernetes']},
+                              context_text='上一段的结尾', encoding='float16')
+
+    [fields] = predictor.fields
+    assert fields['initial_prompt'].endswith('上一段的结尾')
+
+def test_unknown_method_without_context_sends_plain_request():
+    predictor = RecordingPredictor()
+    app.predict_with_hotwords(predictor, make_pcm(1), {'method': 'no_such_method', 'words': ['Kubernetes']},
+                              encoding='float16')
+    assert predictor.fields == [{}]
+
+def test_rolling_context_uses_latest_finished_segment():
+    context = app.RollingContext(max_chars=5)
+    assert context.prompt_for(0) is None
+    context.record(0, 'first segment')
+    context.record(2, 'third segment')
+    assert context.prompt_for(1) == 'gment'
+    assert context.prompt_for(3) == 'gment'
+    # 出错的分段不作为上下文
+    context.record(1, '[Error in segment 2]')
+    assert context.prompt_for(2) == context.prompt_for(1)
+
+def test_provisional_text_does_not_replace_final_text():
+    context = app.RollingContext(max_chars=0)
+    context.record(0, 'provisional', provisional=True)
+    assert context.prompt_for(1) == 'provisional'
+    context.record(0, 'final')
+    context.record(0, 'late provisional', provisional=True)
+    assert context.prompt_for(1) == 'final'
+
+def test_initial_prompt_keeps_context_tail_within_budget():
+    prompt = app.build_initial_prompt(['热词'], '很长的上下文' * 100, max_tokens=40)
+    assert app.estimate_prompt_tokens(prompt) <= 40
+    assert prompt.startswith(app.build_hotword_prompt(['热词']))
+    assert prompt.endswith('很长的上下文')
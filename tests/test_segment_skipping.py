@@ -0,0 +1,44 @@
+import uuid
+
+import numpy as np
+
+import app
+from conftest import ArrayDecoder, make_pcm
+
+def run(pcm, **options):
+    engine = app.TranscriptionEngine(decoder=ArrayDecoder(pcm), store=app.transcript_store,
+                                     predictor_factory=lambda: app.MockPredictor(latency_ms=1))
+    events = list(engine.run('unused.wav', dict(options, job_id=uuid.uuid4().hex)))
+    return [event['segment'] for event in events if event['type'] == 'segment'], events[-1]
+
+def test_repeated_segment_keeps_previous_text():
+    chunk = make_pcm(app.CHUNK_SECONDS, seed=11)
+    records, complete = run(np.concatenate([chunk, chunk, make_pcm(app.CHUNK_SECONDS, seed=12)]))
+
+    first, repeated, last = records
+    assert repeated['skipped'] == 'duplicate'
+    assert repeated['text'] == first['text'] != ''
+    assert (repeated['start'], repeated['end']) == (app.CHUNK_SECONDS, 2 * app.CHUNK_SECONDS)
+    assert complete['transcript'] == ' '.join(record['text'] for record in records)
+    assert complete['skipped_segments'] == {'duplicate': 1}
+    # 存储的记录同样带有复制的文本
+    assert app.transcript_store.get_segments(complete['job_id'])[1]['text'] == first['text']
+
+def test_repeated_segment_shifts_word_timestamps():
+    previous = {'index': 0, 'start': 0.0, 'end': 30.0, 'text': 'hello again',
+                'words': [{'word': 'hello', 'start': 1.0, 'end': 1.5}, {'word': 'again', 'start': 1.5, 'end': 2.0}]}
+    skipped = dict(app.make_segment_record(1, 30000, 60000, ''), skipped='duplicate')
+
+    record = app.duplicate_segment_record(skipped, previous)
+    assert record['text'] == 'hello again'
+    assert record['words'] == [{'word': 'hello', 'start': 31.0, 'end': 31.5},
+                               {'word': 'again', 'start': 31.5, 'end': 32.0}]
+    assert record['skipped'] == 'duplicate'
+
+def test_silent_segment_is_skipped_with_empty_text():
+    silence = np.zeros(app.CHUNK_SECONDS * app.SAMPLE_RATE, dtype=np.int16)
+    records, complete = run(np.concatenate([make_pcm(app.CHUNK_SECONDS, seed=13), silence]))
+
+    assert records[1]['skipped'] == 'silence'
+    assert records[1]['text'] == ''
+    assert complete['skipped_segments'] == {'silence': 1}
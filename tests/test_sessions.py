@@ -0,0 +1,67 @@
+import time
+
+import pytest
+
+import app
+from conftest import login
+
+def session_id(client):
+    cookie = client.get_cookie(app.app.config['SESSION_COOKIE_NAME'])
+    return app.app.session_interface._signer(app.app).unsign(cookie.value).decode('ascii') if cookie else None
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def backend(request, tmp_path):
+    if request.param == 'memory':
+        return app.MemorySessionBackend()
+    return app.SQLiteSessionBackend(str(tmp_path / 'sessions.db'))
+
+def test_backend_round_trip_and_expiry(backend):
+    backend.save('a', {'username': '张三'}, ttl=60)
+    backend.save('b', {'username': 'bob'}, ttl=-1)
+    assert backend.get('a') == {'username': '张三'}
+    assert backend.get('b') is None
+    backend.delete('a')
+    assert backend.get('a') is None
+
+def test_cookie_only_carries_signed_session_id(client):
+    login(client, 'alice')
+    cookie = client.get_cookie(app.app.config['SESSION_COOKIE_NAME'])
+    assert len(cookie.value) < 64
+    assert 'alice' not in cookie.value
+    assert app.app.session_interface.backend.get(session_id(client))['username'] == 'alice'
+
+def test_login_regenerates_session_id(client):
+    backend = app.app.session_interface.backend
+    # 登录失败的提示消息会创建登录前的会话
+    client.post('/login', data={'username': 'alice', 'password': 'wrong'})
+    before = session_id(client)
+    assert before and backend.get(before) is not None
+
+    login(client, 'alice')
+    after = session_id(client)
+    assert after != before
+    assert backend.get(before) is None
+    assert backend.get(after)['logged_in'] is True
+
+def test_fixated_session_id_is_not_logged_in(client):
+    client.post('/login', data={'username': 'alice', 'password': 'wrong'})
+    planted = client.get_cookie(app.app.config['SESSION_COOKIE_NAME']).value
+    login(client, 'alice')
+
+    # 攻击者持有登录前的会话ID, 登录后仍然无法访问
+    attacker = app.app.test_client()
+    attacker.set_cookie(app.app.config['SESSION_COOKIE_NAME'], planted)
+    assert attacker.get('/api/transcripts').status_code == 302
+
+def test_logout_deletes_server_side_session(client):
+    login(client, 'alice')
+    sid = session_id(client)
+    client.get('/logout')
+    assert app.app.session_interface.backend.get(sid) is None
+    assert client.get('/api/transcripts').status_code == 302
+
+def test_tampered_cookie_starts_new_session(client):
+    login(client, 'alice')
+    cookie = client.get_cookie(app.app.config['SESSION_COOKIE_NAME']).value
+    client.set_cookie(app.app.config['SESSION_COOKIE_NAME'], cookie[:-2] + 'xx')
+    assert client.get('/api/transcripts').status_code == 302
@@ -0,0 +1,42 @@
+import pytest
+
+import app
+from conftest import login, upload
+
+def test_parse_time_value():
+    assert app.parse_time_value('90.5') == 90.5
+    assert app.parse_time_value('40:00') == 2400
+    assert app.parse_time_value('1:10:00.250') == 4200.25
+    for value in ('-5', '1:2:3:4', 'abc'):
+        with pytest.raises(ValueError):
+            app.parse_time_value(value)
+
+def test_parse_time_ranges_sorts_and_merges():
+    assert app.parse_time_ranges({}) is None
+    assert app.parse_time_ranges({'start': '40:00'}) == [(2400, None)]
+    assert app.parse_time_ranges({'start': '10', 'end': '1:00'}) == [(10, 60)]
+    assert app.parse_time_ranges({'ranges': '1:10:00-1:12:30, 40:00-55:00, 50:00-56:00'}) == [(2400, 3360), (4200, 4350)]
+    assert app.parse_time_ranges({'ranges': '[[100, null], [0, 10], [200, 300]]'}) == [(0, 10), (100, None)]
+
+def test_parse_time_ranges_rejects_empty_range():
+    with pytest.raises(ValueError, match='must be greater than start'):
+        app.parse_time_ranges({'start': '60', 'end': '30'})
+
+def test_engine_offsets_segments_to_original_timeline(decoder):
+    segments = list(app.transcription_engine.iter_segments('unused.wav', {'ranges': [(10, 20), (60, None)]},
+                                                          app.MockPredictor(latency_ms=1)))
+
+    assert [segment['index'] for segment in segments] == [0, 1]
+    assert (segments[0]['start'], segments[0]['end']) == (10, 20)
+    assert (segments[1]['start'], segments[1]['end']) == (60, 75)
+
+def test_api_transcribe_with_range(client, decoder):
+    login(client, 'alice')
+    response = client.post('/api/transcribe', data=dict(upload(), ranges='0:30-'), content_type='multipart/form-data')
+    segments = response.get_json()['segments']
+    assert [(segment['start'], segment['end']) for segment in segments] == [(30, 60), (60, 75)]
+
+    response = client.post('/api/transcribe', data=dict(upload(), start='1:00', end='0:30'),
+                           content_type='multipart/form-data')
+    assert response.status_code == 400
+    assert 'Invalid time range' in response.get_json()['error']
@@ -0,0 +1,92 @@
+import json
+
+import pytest
+
+import app
+from conftest import login, upload
+
+@pytest.fixture
+def exporter(monkeypatch):
+    exporter = app.InMemorySpanExporter()
+    monkeypatch.setattr(app, 'tracer', app.Tracer(exporter, sample_rate=1.0))
+    return exporter
+
+def children(spans, parent, name=None):
+    return [span for span in spans if span['parent_id'] == parent['span_id'] and name in (None, span['name'])]
+
+def only(spans):
+    assert len(spans) == 1, [span['name'] for span in spans]
+    return spans[0]
+
+def test_stream_job_trace_tree(client, decoder, exporter):
+    login(client, 'alice')
+    response = client.post('/transcribe', data=dict(upload('board-meeting-alice.wav'),
+                                                    hotwords=json.dumps(['ProjectNightingale'])),
+                           content_type='multipart/form-data')
+    assert response.status_code == 200
+    events = [json.loads(line[len('data: '):]) for line in client.get('/stream').get_data(as_text=True).split('\n\n')
+              if line]
+    assert [event['type'] for event in events] == ['init', 'progress', 'progress', 'progress', 'complete']
+
+    spans = exporter.spans()
+    assert len({span['trace_id'] for span in spans}) == 1
+    assert all(span['end_time'] and span['status'] == 'ok' for span in spans)
+
+    # 上传请求 -> 保存/哈希, /stream 在同一条trace下继续
+    root = only([span for span in spans if span['parent_id'] is None])
+    assert root['name'] == 'http.transcribe'
+    assert {span['name'] for span in children(spans, root)} == {'upload.save', 'upload.hash', 'http.stream'}
+    stream = only(children(spans, root, 'http.stream'))
+
+    # 转录 -> 解码 + 每个分段 (请求体序列化、端点调用、响应解析)
+    transcription = only(children(spans, stream, 'transcription'))
+    decode = only(children(spans, transcription, 'decode'))
+    assert decode['attributes']['total_segments'] == 3
+    segments = sorted(children(spans, transcription, 'segment'), key=lambda span: span['attributes']['segment_index'])
+    assert [span['attributes']['segment_index'] for span in segments] == [0, 1, 2]
+    for segment in segments:
+        assert segment['attributes']['outcome'] == 'transcribed'
+        assert segment['attributes']['hotword_count'] == 1
+        names = [span['name'] for span in children(spans, segment)]
+        assert {'serialize', 'invoke', 'deserialize'} <= set(names)
+        assert segment['start_time'] >= decode['end_time']
+
+    # 每个推送的事件一个 sse.emit, 分段事件在对应分段完成之后
+    emits = sorted(children(spans, stream, 'sse.emit'), key=lambda span: span['start_time'])
+    assert [span['attributes']['event_type'] for span in emits] == ['init', 'segment', 'segment', 'segment', 'complete']
+    for emit in emits[1:4]:
+        segment = segments[emit['attributes']['segment_index']]
+        assert emit['start_time'] >= segment['end_time']
+
+def test_span_attributes_are_anonymized(client, decoder, exporter):
+    login(client, 'alice')
+    client.post('/transcribe', data=dict(upload('board-meeting-alice.wav'), hotwords=json.dumps(['ProjectNightingale'])),
+                content_type='multipart/form-data')
+    events = client.get('/stream').get_data(as_text=True)
+    assert '[mock' in events
+
+    attributes = json.dumps([span['attributes'] for span in exporter.spans()], ensure_ascii=False)
+    # 不包含文件名、用户名、热词和转录文本
+    for secret in ('board-meeting', 'alice', 'ProjectNightingale', '[mock'):
+        assert secret not in attributes
+
+def test_traces_are_only_visible_to_their_owner(client, decoder, exporter, monkeypatch):
+    login(client, 'alice')
+    client.post('/transcribe', data=upload(), content_type='multipart/form-data')
+    job_id = json.loads(client.get('/stream').get_data(as_text=True).split('\n\n')[0][len('data: '):])['job_id']
+    trace_id = only(list({span['trace_id'] for span in exporter.spans()}))
+    root = only([span for span in exporter.spans() if span['parent_id'] is None])
+    assert root['attributes']['owner'] == app.trace_owner('alice') != app.trace_owner('bob')
+
+    for query in (f'trace_id={trace_id}', f'job_id={job_id}'):
+        response = client.get(f'/api/traces?{query}')
+        assert response.status_code == 200
+        assert only(response.get_json()['traces'])['trace_id'] == trace_id
+
+    login(client, 'bob')
+    assert client.get(f'/api/traces?trace_id={trace_id}').status_code == 404
+    assert client.get(f'/api/traces?job_id={job_id}').status_code == 404
+    # 没有转录结果存储 (无法通过任务记录确认归属) 时同样按根span的所有者判断
+    monkeypatch.setattr(app, 'transcript_store', None)
+    assert client.get(f'/api/traces?job_id={job_id}').status_code == 404
+    assert client.get('/api/traces?trace_id=unknown').status_code == 404
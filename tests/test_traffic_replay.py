@@ -0,0 +1,82 @@
+import json
+
+import pytest
+
+import app
+import loadgen
+from conftest import login, upload
+
+def test_recorder_writes_anonymized_metadata(client, decoder, tmp_path, monkeypatch):
+    recorder = app.TrafficRecorder(str(tmp_path / 'logs' / 'traffic.jsonl'))
+    monkeypatch.setattr(app.transcription_engine, 'on_start', [recorder.record])
+    login(client, 'alice')
+
+    response = client.post('/api/transcribe', data=dict(upload('客户会议.M4A'), hotwords='["机密项目", "Kubernetes"]',
+                                                        hotword_method='logit_bias', ranges='0:10-0:40'),
+                           content_type='multipart/form-data')
+    response.get_data()
+
+    with open(recorder.path, encoding='utf-8') as f:
+        line = f.read()
+    for private in ('客户会议', 'alice', '机密项目', 'Kubernetes', '[mock'):
+        assert private not in line
+    record = json.loads(line)
+    assert {key: record[key] for key in ('entry', 'format', 'duration', 'total_segments', 'hotword_count',
+                                         'hotword_method', 'ranges')} == {
+        'entry': 'api', 'format': 'm4a', 'duration': 30.0, 'total_segments': 1, 'hotword_count': 2,
+        'hotword_method': 'logit_bias', 'ranges': 1}
+
+def generated(argv, capsys):
+    loadgen.main(argv)
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    # 到达时间从当前时间开始, 只比较到达间隔
+    origin = records[0]['arrived_at']
+    return [dict(record, arrived_at=round(record['arrived_at'] - origin, 3)) for record in records]
+
+def test_generate_is_reproducible(tmp_path, capsys):
+    argv = ['generate', '--count', '20', '--durations', '15:1,300:1', '--formats', 'mp3', '--seed', '7']
+    first, second = generated(argv, capsys), generated(argv, capsys)
+    assert [dict(r, arrived_at=None) for r in first] == [dict(r, arrived_at=None) for r in second]
+    assert [r['arrived_at'] for r in first] == pytest.approx([r['arrived_at'] for r in second], abs=0.002)
+
+    path = tmp_path / 'traffic.jsonl'
+    # 乱序写入的记录按到达时间读取
+    path.write_text(''.join(json.dumps(record) + '\n' for record in reversed(first)) + '\n')
+    records = loadgen.load_traffic(str(path))
+    assert records == first
+    assert {r['format'] for r in records} == {'mp3'}
+    assert all(12 <= r['duration'] <= 18 or 240 <= r['duration'] <= 360 for r in records)
+
+def test_parse_mix_and_percentile():
+    assert loadgen.parse_mix('15:0.5,300') == ([15.0, 300.0], [0.5, 1.0])
+    assert loadgen.parse_mix('mp3:2,wav:1', str) == (['mp3', 'wav'], [2.0, 1.0])
+    assert loadgen.percentile([3, 1, 2], 0.5) == 2
+    assert loadgen.percentile([], 0.5) is None
+
+def test_replay_and_compare(server, tmp_path, capsys):
+    traffic = tmp_path / 'traffic.jsonl'
+    traffic.write_text(''.join(json.dumps({'arrived_at': 100 + i, 'entry': 'stream', 'format': 'mp3', 'duration': 1.5,
+                                           'hotword_count': 2 * i, 'hotword_method': 'logit_bias' if i else None,
+                                           'rolling_context': bool(i)}) + '\n' for i in range(3)))
+    reports = []
+    for label in ('a', 'b'):
+        report = tmp_path / f'{label}.json'
+        assert loadgen.main(['replay', str(traffic), '--url', server, '--username', 'alice', '--password', 'alice-pw',
+                             '--speed', '100', '--label', label, '--report', str(report)]) == 0
+        reports.append(str(report))
+
+    with open(reports[0], encoding='utf-8') as f:
+        result = json.load(f)
+    assert (result['summary']['requests'], result['summary']['errors']) == (3, 0)
+    assert all(request['first_segment'] is not None for request in result['requests'])
+
+    capsys.readouterr()
+    assert loadgen.main(['compare'] + reports) == 0
+    output = capsys.readouterr().out
+    assert output.splitlines()[0].split() == ['a', 'b', 'change']
+    assert '请求数' in output
+
+def test_replay_of_empty_log(tmp_path):
+    traffic = tmp_path / 'empty.jsonl'
+    traffic.write_text('')
+    assert loadgen.main(['replay', str(traffic)]) == 1
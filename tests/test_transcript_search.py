@@ -0,0 +1,94 @@
+import uuid
+
+import pytest
+
+import app
+from conftest import login, upload
+
+def segments(*texts):
+    return [{'index': i, 'start': i * 30.0, 'end': (i + 1) * 30.0, 'text': text} for i, text in enumerate(texts)]
+
+@pytest.fixture
+def search_index(tmp_path):
+    return app.SearchIndex(str(tmp_path / 'search.db'))
+
+@pytest.fixture(params=['sqlite', 'disk'])
+def store(request, tmp_path):
+    path = tmp_path / ('transcripts.db' if request.param == 'sqlite' else 'transcripts')
+    return app.TRANSCRIPT_STORES[request.param](str(path))
+
+def test_tokenize_round_trip():
+    assert app.tokenize_for_index('下季度budget会议') == '下 季 度 budget 会 议'
+    assert app.detokenize_from_index('下 季 度 budget [会 议]') == '下季度 budget [会议]'
+
+def test_build_fts_query():
+    assert app.build_fts_query('会议 budget') == '"会 议" AND "budget"'
+    # FTS5 语法字符不会进入查询
+    assert app.build_fts_query('"会议" OR*') == '"会 议" AND "OR"'
+    assert app.build_fts_query('  *** ') == ''
+
+def test_cjk_search_matches_consecutive_characters(search_index):
+    search_index.index_job({'job_id': 'j1', 'username': 'alice', 'filename': 'a.wav'},
+                           segments('我们讨论一下季度预算', '会后再议'))
+
+    hits, total = search_index.search('季度预算')
+    assert total == 1
+    assert (hits[0]['segment_index'], hits[0]['start'], hits[0]['end']) == (0, 0.0, 30.0)
+    assert hits[0]['snippet'] == '我们讨论一下[季度预算]'
+    # 单字都出现但不连续时不匹配
+    assert search_index.search('预议')[1] == 0
+    assert search_index.search('会议')[1] == 0
+
+def test_search_is_scoped_to_user_and_reindexing_replaces(search_index):
+    search_index.index_job({'job_id': 'j1', 'username': 'alice'}, segments('预算会议'))
+    search_index.index_job({'job_id': 'j2', 'username': 'bob'}, segments('预算会议', '', '预算'))
+
+    assert search_index.search('预算', 'alice')[1] == 1
+    assert search_index.search('预算', 'bob')[1] == 2
+    search_index.index_job({'job_id': 'j2', 'username': 'bob'}, segments('没有了'))
+    assert search_index.search('预算', 'bob')[1] == 0
+
+def test_store_resumes_and_lists_per_user(store):
+    store.start_job({'job_id': 'j1', 'username': 'alice', 'filename': 'a.wav', 'total_segments': 2})
+    store.save_segment('j1', segments('a', 'b')[1])
+    store.save_segment('j1', segments('a')[0])
+    assert [seg['text'] for seg in store.get_segments('j1')] == ['a', 'b']
+
+    store.finish_job('j1', 'completed', transcript='a b')
+    store.start_job({'job_id': 'j2', 'username': 'bob'})
+    assert store.get('j1')['status'] == 'completed'
+    items, total = store.list_jobs(username='alice')
+    assert total == 1 and items[0]['job_id'] == 'j1'
+    assert store.list_jobs()[1] == 2
+
+def test_api_search_and_transcripts_per_user(client):
+    job_id = uuid.uuid4().hex
+    app.search_index.index_job({'job_id': job_id, 'username': 'bob', 'filename': 'b.wav'}, segments('保密的季度预算'))
+    app.transcript_store.start_job({'job_id': job_id, 'username': 'bob', 'filename': 'b.wav'})
+
+    login(client, 'alice')
+    assert client.get('/api/search?q=季度预算').get_json()['total'] == 0
+    assert client.get(f'/api/transcripts/{job_id}').status_code == 404
+    assert client.get('/api/search').status_code == 400
+
+    client.get('/logout')
+    login(client, 'bob')
+    result = client.get('/api/search?q=季度预算').get_json()
+    assert [hit['job_id'] for hit in result['hits']] == [job_id]
+    assert client.get(f'/api/transcripts/{job_id}').get_json()['filename'] == 'b.wav'
+
+def test_completed_job_is_listed_and_searchable(client, decoder, search_index, monkeypatch):
+    # 使用独立的索引, 其他测试写入的命中不影响分页结果
+    monkeypatch.setattr(app, 'search_index', search_index)
+    monkeypatch.setattr(app.transcription_engine, 'on_complete', [search_index.index_job])
+    login(client, 'alice')
+    response = client.post('/api/transcribe', data=upload('listed.wav'), content_type='multipart/form-data')
+    job_id = response.headers['X-Job-Id']
+    response.get_data()
+
+    items = client.get('/api/transcripts?per_page=100').get_json()['items']
+    assert job_id in [item['job_id'] for item in items]
+    hits = client.get('/api/search?q=mock').get_json()['hits']
+    assert [hit['job_id'] for hit in hits] == [job_id] * 3
+    srt = client.get(f'/api/transcripts/{job_id}?format=srt').get_data(as_text=True)
+    assert srt.startswith('1\n00:00:00,000 --> 00:00:30,000\n[mock')
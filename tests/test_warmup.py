@@ -0,0 +1,93 @@
+import time
+
+import pytest
+
+import app
+from conftest import ArrayDecoder, login, make_pcm
+
+class CountingPredictor(app.MockPredictor):
+    def __init__(self, **kwargs):
+        super().__init__(latency_ms=1, **kwargs)
+        self.calls = 0
+
+    def predict(self, data, initial_args=None):
+        self.calls += 1
+        return super().predict(data, initial_args)
+
+@pytest.fixture
+def warmer(monkeypatch):
+    warmer = app.EndpointWarmer(predictor_factory=CountingPredictor, idle_seconds=0, cold_seconds=300, connections=3)
+    # 端点调用成功时更新的是全局的预热器
+    monkeypatch.setattr(app, 'endpoint_warmer', warmer)
+    yield warmer
+    warmer.stop()
+
+def test_warmup_targets():
+    router = app.EndpointRouter(app.parse_endpoint_targets('mock-a,mock-b/v2'))
+    assert [label for label, _ in app.warmup_targets(router)] == ['mock-a', 'mock-b/v2']
+    assert [label for label, _ in app.warmup_targets(router.for_job())] == ['mock-a', 'mock-b/v2']
+
+    local = app.LocalWhisperPredictor(model='tiny')
+    backend = app.BackendRouter(local, CountingPredictor(endpoint_name='mock-remote'))
+    assert [label for label, _ in app.warmup_targets(backend)] == ['local:tiny', 'mock-remote']
+    assert app.warmup_targets(None) == []
+
+def test_warm_sends_connections_requests_and_marks_activity(warmer):
+    predictor = CountingPredictor(endpoint_name='mock-warm')
+    assert warmer.idle_for(predictor) == float('inf')
+
+    assert warmer.warm('mock-warm', predictor, 'startup') is not None
+    assert predictor.calls == 3
+    assert warmer.idle_for(predictor) < 1
+    assert warmer.stats()['warmups']['mock-warm']['reason'] == 'startup'
+
+def test_failed_warmup_is_not_activity(warmer):
+    predictor = CountingPredictor(endpoint_name='mock-down', error_rate=1.0)
+    assert warmer.warm('mock-down', predictor, 'idle') is None
+    assert warmer.idle_for(predictor) == float('inf')
+    assert 'mock-down' not in warmer.stats()['warmups']
+
+def test_start_only_when_configured(warmer, monkeypatch):
+    started = []
+    monkeypatch.setattr(warmer, '_loop', lambda on_startup: started.append(on_startup))
+    warmer.start(on_startup=False)
+    assert started == []
+
+    warmer.start(on_startup=True)
+    warmer.start(on_startup=True)
+    time.sleep(0.05)
+    assert started == [True]
+
+def test_startup_warms_every_target(monkeypatch):
+    predictor = CountingPredictor(endpoint_name='mock-startup')
+    warmer = app.EndpointWarmer(predictor_factory=lambda: predictor, idle_seconds=0, connections=1)
+    monkeypatch.setattr(app, 'endpoint_warmer', warmer)
+    warmer.start(on_startup=True)
+
+    deadline = time.time() + 5
+    while 'mock-startup' not in warmer.stats()['warmups'] and time.time() < deadline:
+        time.sleep(0.01)
+    assert predictor.calls == 1
+
+def test_engine_records_cold_and_warm_first_calls(warmer):
+    predictor = CountingPredictor(endpoint_name='mock-first')
+    engine = app.TranscriptionEngine(decoder=ArrayDecoder(make_pcm(60)))
+
+    list(engine.run('unused.wav', {}, predictor))
+    list(engine.run('unused.wav', {}, predictor))
+
+    # 每个任务只统计第一次端点调用
+    first_calls = warmer.stats()['first_calls']['mock-first']
+    assert (first_calls['cold']['count'], first_calls['warm']['count']) == (1, 1)
+    samples = warmer.stats()['recent_first_calls']
+    assert [sample['state'] for sample in samples] == ['cold', 'warm']
+    assert samples[0]['idle_seconds'] is None
+
+def test_first_request_starts_warmer(client, monkeypatch):
+    calls = []
+    monkeypatch.setattr(app.endpoint_warmer, 'start', lambda: calls.append(1))
+    assert client.get('/api/warmup').status_code == 302
+    assert calls
+
+    login(client, 'alice')
+    assert set(client.get('/api/warmup').get_json()) >= {'warmups', 'first_calls', 'idle_seconds'}
@@ -0,0 +1,75 @@
+import asyncio
+
+import pytest
+
+import app
+from whisper_client import AsyncWhisperClient, AuthenticationError, WhisperClient, WhisperClientError, find_audio_files
+
+@pytest.fixture
+def audio_files(tmp_path):
+    paths = []
+    for name in ('a.wav', 'b.mp3', 'c.m4a'):
+        path = tmp_path / name
+        path.write_bytes(name.encode() * 512)
+        paths.append(str(path))
+    (tmp_path / 'notes.txt').write_text('notes')
+    return paths
+
+def test_find_audio_files(audio_files, tmp_path):
+    assert find_audio_files([str(tmp_path)]) == audio_files
+    assert find_audio_files(['x.txt']) == ['x.txt']
+
+def test_transcribe_streams_segments(server, audio_files):
+    received = []
+    with WhisperClient(server, 'alice', 'alice-pw') as client:
+        result = client.transcribe(audio_files[0], on_segment=received.append, rolling_context=True)
+        srt = client.get_transcript(result['job_id'], 'srt')
+
+    assert [segment['index'] for segment in received] == [0, 1, 2]
+    assert result['segments'] == received
+    assert result['audio_seconds'] == 75.0
+    assert result['transcript'].count('[mock') == 3
+    assert srt.startswith('1\n00:00:00,000 --> 00:00:30,000\n[mock')
+
+def test_relogin_after_session_expires(server, audio_files):
+    with WhisperClient(server, 'alice', 'alice-pw') as client:
+        client.transcribe(audio_files[0])
+        # 服务端会话被清除 (过期或重启)
+        app.app.session_interface.backend._data.clear()
+        result = client.transcribe(audio_files[1])
+        assert client._login_generation == 2
+    assert len(result['segments']) == 3
+
+def test_errors(server, audio_files, tmp_path):
+    with WhisperClient(server, 'alice', 'wrong') as client:
+        with pytest.raises(AuthenticationError):
+            client.login()
+    with WhisperClient(server, 'alice', 'alice-pw') as client:
+        with pytest.raises(WhisperClientError, match='Unsupported file format'):
+            client.transcribe(str(tmp_path / 'notes.txt'))
+        with pytest.raises(WhisperClientError, match='HTTP 404'):
+            client.get_transcript('missing')
+
+@pytest.mark.parametrize('batch_size', [1, 2])
+def test_transcribe_many(server, audio_files, batch_size):
+    with WhisperClient(server, 'alice', 'alice-pw') as client:
+        results = list(client.transcribe_many(audio_files, concurrency=3, batch_size=batch_size))
+
+    assert sorted(result['filename'] for result in results) == audio_files
+    assert all(result['success'] and result['audio_seconds'] == 75.0 for result in results)
+
+def test_async_client(server, audio_files):
+    segments = []
+
+    async def on_segment(path, segment):
+        segments.append((path, segment['index']))
+
+    async def main():
+        async with AsyncWhisperClient(server, 'alice', 'alice-pw', concurrency=2) as client:
+            results = [result async for result in client.transcribe_many(audio_files, on_segment=on_segment)]
+            await asyncio.sleep(0.05)
+            return results
+
+    results = asyncio.run(main())
+    assert sorted(result['filename'] for result in results) == audio_files
+    assert sorted(segments) == sorted((path, index) for path in audio_files for index in range(3))
@@ -0,0 +1,113 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import app
+from conftest import make_pcm
+
+def spool_files():
+    return sorted(name for name in os.listdir(app.SPOOL_DIR) if name.endswith('.pcm'))
+
+def queue_transcriber(broker, predictor=None):
+    return app.QueueTranscriber(broker, predictor or app.MockPredictor(latency_ms=1), app.DEFAULT_HOTWORDS_CONFIG)
+
+@pytest.fixture
+def worker():
+    workers = []
+
+    def start(broker, predictor):
+        queue_worker = app.QueueWorker(broker, threads=1, predictor_factory=lambda: predictor)
+        queue_worker.start()
+        workers.append(queue_worker)
+        return queue_worker
+
+    yield start
+    for queue_worker in workers:
+        queue_worker.stop()
+
+def test_local_broker_enqueue_dequeue():
+    broker = app.LocalBroker()
+    broker.put_task({'task_id': 'a'})
+    broker.put_task({'task_id': 'b'})
+    assert broker.pending_tasks() == 2
+    assert broker.get_task(timeout=0.1)['task_id'] == 'a'
+    assert broker.get_task(timeout=0.1)['task_id'] == 'b'
+    assert broker.get_task(timeout=0.05) is None
+
+    broker.put_result('a', {'response': 'ok'})
+    assert broker.get_result('a', timeout=0.1) == {'response': 'ok'}
+    assert broker.get_result('b', timeout=0.05) is None
+
+def test_local_broker_redelivers_unfinished_task():
+    broker = app.LocalBroker(visibility_timeout=0.2)
+    broker.put_task({'task_id': 'a'})
+    # 领取任务的工作线程没有写回结果就退出
+    assert broker.get_task(timeout=0.1)['task_id'] == 'a'
+    assert broker.get_task(timeout=0.05) is None
+    time.sleep(0.25)
+    assert broker.get_task(timeout=0.1)['task_id'] == 'a'
+
+    broker.put_result('a', {'response': 'ok'})
+    time.sleep(0.25)
+    assert broker.get_task(timeout=0.05) is None
+    assert broker.get_result('a', timeout=0.1) == {'response': 'ok'}
+
+def test_local_broker_keeps_first_result_of_redelivered_task():
+    broker = app.LocalBroker(visibility_timeout=0.05)
+    broker.put_task({'task_id': 'a'})
+    broker.get_task(timeout=0.1)
+    time.sleep(0.1)
+    broker.get_task(timeout=0.1)
+    # 慢的工作线程和重新领取的工作线程都写回结果, 不会阻塞
+    broker.put_result('a', {'response': 'first'})
+    broker.put_result('a', {'response': 'second'})
+    assert broker.get_result('a', timeout=0.1) == {'response': 'first'}
+
+def test_local_broker_drops_results_nobody_waits_for():
+    broker = app.LocalBroker(visibility_timeout=0.05)
+    broker.put_task({'task_id': 'a'})
+    broker.get_task(timeout=0.1)
+    # 等待方超时离开后, 慢的工作线程 (或重新投递后的工作线程) 才写回结果
+    assert broker.get_result('a', timeout=0.05) is None
+    broker.put_result('a', {'response': 'late'})
+    broker.put_result('unknown', {'response': 'stray'})
+
+    assert broker._results == {} and broker._leases == {}
+    assert broker.get_result('a', timeout=0.05) is None
+
+def test_queued_segment_round_trip_removes_spool_file(worker):
+    broker = app.LocalBroker()
+    worker(broker, app.MockPredictor(latency_ms=1))
+    before = spool_files()
+
+    response = queue_transcriber(broker).predict(make_pcm(1), None, 'zh')
+
+    assert '[mock' in response
+    assert spool_files() == before
+
+def test_worker_error_is_returned_and_spool_file_removed(worker):
+    broker = app.LocalBroker()
+    worker(broker, app.MockPredictor(latency_ms=1, error_rate=1.0, endpoint_name='mock-broken'))
+    before = spool_files()
+
+    with pytest.raises(Exception, match='mock endpoint mock-broken failed'):
+        queue_transcriber(broker).predict(make_pcm(1), None, 'zh')
+
+    assert spool_files() == before
+
+def test_segment_redelivered_when_worker_dies(worker):
+    broker = app.LocalBroker(visibility_timeout=0.2)
+    before = spool_files()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        pending = executor.submit(queue_transcriber(broker).predict, make_pcm(1), None, 'zh')
+        # 第一个工作线程领取任务后崩溃, 分段音频仍留在共享目录中
+        task = broker.get_task(timeout=5)
+        assert os.path.exists(task['spool_path'])
+        worker(broker, app.MockPredictor(latency_ms=1))
+        response = pending.result(timeout=10)
+
+    assert '[mock' in response
+    assert not os.path.exists(task['spool_path'])
+    assert spool_files() == before
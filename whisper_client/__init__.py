@@ -0,0 +1,17 @@
+"""Whisper Web UI 的Python客户端
+
+    from whisper_client import WhisperClient
+
+    with WhisperClient("http://localhost:8080", "user", "password") as client:
+        result = client.transcribe("meeting.m4a", on_segment=lambda segment: print(segment['text']))
+        for result in client.transcribe_many(paths, concurrency=8):
+            ...
+
+asyncio 程序使用 AsyncWhisperClient, 命令行使用 python -m whisper_client。
+"""
+from .client import (WhisperClient, WhisperClientError, AuthenticationError, SUPPORTED_FORMATS,
+                     find_audio_files)
+from .aio import AsyncWhisperClient
+
+__all__ = ['WhisperClient', 'AsyncWhisperClient', 'WhisperClientError', 'AuthenticationError', 'SUPPORTED_FORMATS',
+           'find_audio_files']
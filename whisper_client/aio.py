@@ -0,0 +1,69 @@
+"""asyncio 接口
+
+requests 是阻塞的, 每个转录在线程池中运行, 所有转录共享同一个 WhisperClient 的连接池和登录状态;
+回调通过事件循环调用, 可以是普通函数或协程函数。
+"""
+import asyncio
+import inspect
+from concurrent.futures import ThreadPoolExecutor
+
+from .client import WhisperClient
+
+
+class AsyncWhisperClient:
+    """WhisperClient 的 asyncio 封装, concurrency 为同时进行的转录数"""
+
+    def __init__(self, base_url, username, password, concurrency=4, **kwargs):
+        kwargs.setdefault('pool_size', max(10, concurrency))
+        self.client = WhisperClient(base_url, username, password, **kwargs)
+        self.concurrency = concurrency
+        self._executor = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix='whisper-async')
+
+    async def close(self):
+        self._executor.shutdown(wait=False)
+        self.client.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def login(self):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self.client.login)
+
+    def _threadsafe(self, loop, callback, *prefix):
+        """把回调转交给事件循环线程执行"""
+        if callback is None:
+            return None
+
+        def invoke(*args):
+            def run():
+                result = callback(*prefix, *args)
+                if inspect.isawaitable(result):
+                    loop.create_task(result)
+            loop.call_soon_threadsafe(run)
+        return invoke
+
+    async def transcribe(self, path, on_segment=None, **options):
+        """转录一个文件, 返回与 WhisperClient.transcribe 相同的结果字典"""
+        loop = asyncio.get_running_loop()
+        segment_callback = self._threadsafe(loop, on_segment)
+        return await loop.run_in_executor(
+            self._executor, lambda: self.client.transcribe(path, on_segment=segment_callback, **options))
+
+    async def transcribe_many(self, paths, on_segment=None, **options):
+        """并发转录多个文件, 按完成顺序产出结果字典 (异步生成器); 失败的文件产出 success 为 False 的结果"""
+        semaphore = asyncio.Semaphore(max(1, self.concurrency))
+
+        async def run(path):
+            async with semaphore:
+                try:
+                    callback = (lambda segment: on_segment(path, segment)) if on_segment else None
+                    return dict(await self.transcribe(path, on_segment=callback, **options), success=True)
+                except Exception as e:
+                    return {'filename': path, 'success': False, 'error': str(e)}
+
+        for future in asyncio.as_completed([run(path) for path in paths]):
+            yield await future
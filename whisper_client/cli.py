@@ -0,0 +1,116 @@
+"""命令行: 并发转录文件或目录, 结果保存到同名文本文件, 结束时输出吞吐量统计
+
+    python -m whisper_client meetings/ --concurrency 8 --hotwords "术语A,术语B"
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import statistics
+
+from .client import WhisperClient, WhisperClientError, find_audio_files
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='whisper_client', description="Transcribe audio files with Whisper Web UI")
+    parser.add_argument('paths', nargs='+', help="audio files or directories")
+    parser.add_argument('--url', default=os.environ.get('WHISPER_API_URL', 'http://localhost:8080'))
+    parser.add_argument('--username', default=os.environ.get('WHISPER_USERNAME', ''))
+    parser.add_argument('--password', default=os.environ.get('WHISPER_PASSWORD', ''))
+    parser.add_argument('--concurrency', type=int, default=int(os.environ.get('WHISPER_CONCURRENCY', '4')),
+                        help="files (or batch requests) transcribed at the same time")
+    parser.add_argument('--batch-size', type=int, default=1,
+                        help="files per /api/transcribe/batch request (1 streams each file separately)")
+    parser.add_argument('--hotwords', default=os.environ.get('WHISPER_HOTWORDS', ''), help="comma separated")
+    parser.add_argument('--hotword-method', default=os.environ.get('WHISPER_HOTWORD_METHOD', 'prompt_injection'),
+                        choices=['prompt_injection', 'logit_bias'])
+    parser.add_argument('--language', help="Whisper language code, detected once per file when omitted")
+    parser.add_argument('--quality', help="fast, accurate or a server model tier name (chosen by duration when omitted)")
+    parser.add_argument('--rolling-context', action='store_true')
+    parser.add_argument('--ranges', help="only transcribe these ranges, e.g. 40:00-55:00,1:10:00-1:12:00")
+    parser.add_argument('--output-dir', help="where to write results (defaults to next to each audio file)")
+    parser.add_argument('--save', choices=['txt', 'json', 'none'], default='txt',
+                        help="save the transcript text or the full segment list")
+    parser.add_argument('--verbose', action='store_true')
+    return parser
+
+
+def save_result(result, output_dir, save):
+    base = os.path.splitext(os.path.basename(result['filename']))[0]
+    directory = output_dir or os.path.dirname(os.path.abspath(result['filename']))
+    if save == 'json':
+        output_file = os.path.join(directory, f"{base}_transcript.json")
+        with open(output_file, 'w', encoding='utf-8') as f:
+            json.dump({key: result.get(key) for key in ('job_id', 'filename', 'transcript', 'segments')}, f,
+                      ensure_ascii=False, indent=2)
+    else:
+        output_file = os.path.join(directory, f"{base}_transcript.txt")
+        with open(output_file, 'w', encoding='utf-8') as f:
+            f.write(result['transcript'])
+    return output_file
+
+
+def report_throughput(results, wall_seconds, concurrency):
+    """输出吞吐量: 文件数、音频时长、墙钟时间、每秒处理的音频秒数以及单文件耗时分布"""
+    succeeded = [result for result in results if result.get('success')]
+    audio = sum(result.get('audio_seconds', 0) for result in succeeded)
+    print("-" * 50)
+    print(f"文件: {len(succeeded)}/{len(results)} 成功, 并发 {concurrency}, 耗时 {wall_seconds:.1f}s")
+    if not succeeded or wall_seconds <= 0:
+        return
+    print(f"吞吐量: {len(succeeded) / wall_seconds:.2f} 文件/秒, 音频 {audio / 60:.1f} 分钟, "
+          f"{audio / wall_seconds:.1f} 音频秒/秒")
+    latencies = sorted(result['elapsed'] for result in succeeded if 'elapsed' in result)
+    if latencies:
+        p90 = latencies[int(0.9 * (len(latencies) - 1))]
+        print(f"单文件耗时: 中位数 {statistics.median(latencies):.1f}s, p90 {p90:.1f}s, 最长 {latencies[-1]:.1f}s")
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if not args.username or not args.password:
+        print("错误: 请通过 --username/--password 或 WHISPER_USERNAME/WHISPER_PASSWORD 环境变量提供登录信息")
+        return 2
+    paths = find_audio_files(args.paths)
+    if not paths:
+        print("错误: 没有可转录的音频文件")
+        return 2
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+    options = {
+        'hotwords': [word.strip() for word in args.hotwords.split(',') if word.strip()],
+        'hotword_method': args.hotword_method,
+        'rolling_context': args.rolling_context,
+        'language': args.language,
+        'ranges': args.ranges,
+        'quality': args.quality
+    }
+
+    results = []
+    started = time.time()
+    with WhisperClient(args.url, args.username, args.password, pool_size=max(10, args.concurrency)) as client:
+        try:
+            client.login()
+        except WhisperClientError as e:
+            print(f"登录失败: {str(e)}")
+            return 1
+        print(f"共 {len(paths)} 个文件, 并发 {args.concurrency}")
+        for result in client.transcribe_many(paths, concurrency=args.concurrency, batch_size=args.batch_size,
+                                             **options):
+            results.append(result)
+            if not result.get('success'):
+                print(f"失败: {result['filename']}: {result.get('error')}")
+                continue
+            output = save_result(result, args.output_dir, args.save) if args.save != 'none' else '-'
+            print(f"完成 [{len(results)}/{len(paths)}]: {result['filename']} "
+                  f"({result.get('elapsed', 0):.1f}s) -> {output}")
+    report_throughput(results, time.time() - started, args.concurrency)
+    return 0 if all(result.get('success') for result in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
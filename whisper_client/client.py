@@ -0,0 +1,269 @@
+"""Whisper Web UI 的同步客户端
+
+一个客户端对象复用同一个带连接池的会话: 只登录一次, 会话过期 (服务端重定向到登录页) 时自动重新登录并重试。
+转录结果通过 /api/transcribe?format=ndjson 逐段返回, 连接中断时重新提交同一个文件续传:
+服务端按任务ID跳过已存储的分段, 客户端按分段序号跳过已收到的分段。
+"""
+import os
+import json
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger('whisper_client')
+
+# 服务端支持的音频格式
+SUPPORTED_FORMATS = ('.mp3', '.m4a', '.wav', '.flac', '.ogg', '.opus', '.webm')
+
+
+class WhisperClientError(Exception):
+    """请求失败或服务端返回错误"""
+
+
+class AuthenticationError(WhisperClientError):
+    """用户名或密码错误"""
+
+
+def find_audio_files(paths):
+    """展开文件和目录参数, 返回所有支持格式的音频文件 (目录按文件名排序)"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(os.path.join(path, name) for name in os.listdir(path)
+                                if name.lower().endswith(SUPPORTED_FORMATS)))
+        else:
+            files.append(path)
+    return files
+
+
+def transcribe_form(hotwords=None, hotword_method='prompt_injection', rolling_context=False, language=None,
+                    ranges=None, quality=None):
+    """转录选项对应的表单字段"""
+    data = {}
+    if hotwords:
+        data['hotwords'] = json.dumps(list(hotwords))
+        data['hotword_method'] = hotword_method
+    if rolling_context:
+        data['rolling_context'] = '1'
+    if language:
+        data['language'] = language
+    if ranges:
+        data['ranges'] = ranges
+    if quality:
+        data['quality'] = quality
+    return data
+
+
+def audio_seconds(segments):
+    """分段覆盖的音频时长 (秒)"""
+    return round(sum(segment['end'] - segment['start'] for segment in segments), 3)
+
+
+def transcript_text(segments):
+    """按服务端的拼接方式把分段文本合并为完整转录"""
+    return " ".join(segment['text'] for segment in segments if segment.get('text')).strip()
+
+
+class WhisperClient:
+    """Whisper Web UI 客户端, 可在多个线程中共享
+
+    pool_size 为连接池大小, 应不小于并发数; resume_attempts 为单个文件转录中断后的最大续传次数。
+    """
+
+    def __init__(self, base_url, username, password, pool_size=10, timeout=(10, 600), resume_attempts=3):
+        self.base_url = base_url.rstrip('/')
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self.resume_attempts = resume_attempts
+        self.session = requests.Session()
+        # 只对幂等的GET请求在连接错误和网关错误时自动重试, 上传请求的重试由续传逻辑处理
+        retry = Retry(total=3, backoff_factor=0.5, status_forcelist=(502, 503, 504), allowed_methods=('GET',))
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._login_lock = threading.Lock()
+        self._login_generation = 0
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def login(self):
+        """登录并保存会话cookie; 成功时服务端重定向到首页, 失败时返回登录页"""
+        with self._login_lock:
+            self._login(self._login_generation)
+
+    def _login(self, generation):
+        if generation != self._login_generation:
+            # 其他线程已经重新登录
+            return
+        response = self.session.post(f"{self.base_url}/login",
+                                     data={'username': self.username, 'password': self.password},
+                                     allow_redirects=False, timeout=self.timeout)
+        if response.status_code != 302 or response.headers.get('Location', '').rstrip('/').endswith('/login'):
+            raise AuthenticationError(f"Login failed (status {response.status_code})")
+        self._login_generation += 1
+        logger.info(f"已登录 {self.base_url}")
+
+    def request(self, method, path, build_kwargs=None, **kwargs):
+        """发送请求, 未登录或会话过期时登录后重试一次
+
+        上传文件的请求通过 build_kwargs 在每次发送前重新构造参数 (文件需要从头读取)。
+        """
+        for attempt in range(2):
+            generation = self._login_generation
+            if generation == 0:
+                with self._login_lock:
+                    self._login(generation)
+                generation = self._login_generation
+            request_kwargs = dict(kwargs, **(build_kwargs() if build_kwargs else {}))
+            request_kwargs.setdefault('timeout', self.timeout)
+            response = self.session.request(method, f"{self.base_url}{path}", allow_redirects=False,
+                                            **request_kwargs)
+            if response.status_code in (301, 302) and '/login' in response.headers.get('Location', ''):
+                response.close()
+                logger.info("会话已过期, 重新登录")
+                with self._login_lock:
+                    self._login(generation)
+                continue
+            return response
+        raise WhisperClientError(f"Still redirected to login after re-authenticating: {path}")
+
+    def transcribe(self, path, on_segment=None, **options):
+        """转录一个文件, 返回结果字典 (job_id, filename, segments, transcript, audio_seconds, elapsed)
+
+        on_segment(segment) 在每个新分段到达时调用; options 见 transcribe_form。
+        """
+        if not path.lower().endswith(SUPPORTED_FORMATS):
+            raise WhisperClientError(f"Unsupported file format: {path}")
+        started = time.time()
+        data = transcribe_form(**options)
+        segments = {}
+        job_id = None
+        for attempt in range(self.resume_attempts + 1):
+            try:
+                with open(path, 'rb') as f:
+                    def build_kwargs():
+                        f.seek(0)
+                        return {'files': {'audio_file': (os.path.basename(path), f, 'application/octet-stream')},
+                                'data': data}
+
+                    response = self.request('POST', '/api/transcribe', params={'format': 'ndjson'}, stream=True,
+                                            build_kwargs=build_kwargs)
+                    if response.status_code != 200:
+                        raise WhisperClientError(self._error_message(response))
+                    job_id = response.headers.get('X-Job-Id', job_id)
+                    for line in response.iter_lines(decode_unicode=True):
+                        if not line:
+                            continue
+                        segment = json.loads(line)
+                        if segment['index'] in segments:
+                            continue
+                        segments[segment['index']] = segment
+                        if on_segment:
+                            on_segment(segment)
+                break
+            except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError) as e:
+                if attempt >= self.resume_attempts:
+                    raise WhisperClientError(f"Transcription of {path} interrupted: {str(e)}") from e
+                logger.warning(f"{path} 转录中断 ({str(e)}), 已收到 {len(segments)} 个分段, 续传第 {attempt + 1} 次")
+                time.sleep(min(2 ** attempt, 10))
+        ordered = [segments[index] for index in sorted(segments)]
+        return {
+            'job_id': job_id,
+            'filename': path,
+            'segments': ordered,
+            'transcript': transcript_text(ordered),
+            'audio_seconds': audio_seconds(ordered),
+            'elapsed': round(time.time() - started, 3)
+        }
+
+    def transcribe_batch(self, paths, **options):
+        """通过 /api/transcribe/batch 在一个请求中转录多个文件, 按服务端完成顺序逐个产出结果"""
+        data = transcribe_form(**options)
+        handles = []
+
+        def build_kwargs():
+            for f in handles:
+                f.close()
+            handles[:] = [open(path, 'rb') for path in paths]
+            return {'files': [('audio_files', (os.path.basename(path), f, 'application/octet-stream'))
+                              for path, f in zip(paths, handles)], 'data': data}
+
+        try:
+            response = self.request('POST', '/api/transcribe/batch', build_kwargs=build_kwargs, stream=True)
+            if response.status_code != 200:
+                raise WhisperClientError(self._error_message(response))
+            by_name = {os.path.basename(path): path for path in paths}
+            for line in response.iter_lines(decode_unicode=True):
+                if not line:
+                    continue
+                result = json.loads(line)
+                if result.get('summary'):
+                    continue
+                result['filename'] = by_name.get(result['filename'], result['filename'])
+                if result.get('success'):
+                    result['audio_seconds'] = audio_seconds(result['segments'])
+                yield result
+        finally:
+            for f in handles:
+                f.close()
+
+    def transcribe_many(self, paths, concurrency=4, batch_size=1, on_segment=None, on_result=None, **options):
+        """并发转录多个文件, 按完成顺序产出结果字典; 失败的文件产出 success 为 False 的结果
+
+        batch_size 大于1时每 batch_size 个文件合并为一个批量请求; on_segment(path, segment) 和
+        on_result(result) 在工作线程中调用。
+        """
+        def run_file(path):
+            segment_callback = (lambda segment: on_segment(path, segment)) if on_segment else None
+            try:
+                return [dict(self.transcribe(path, on_segment=segment_callback, **options), success=True)]
+            except Exception as e:
+                logger.error(f"{path} 转录失败: {str(e)}")
+                return [{'filename': path, 'success': False, 'error': str(e)}]
+
+        def run_batch(batch):
+            try:
+                return list(self.transcribe_batch(batch, **options))
+            except Exception as e:
+                logger.error(f"批量请求失败: {str(e)}")
+                return [{'filename': path, 'success': False, 'error': str(e)} for path in batch]
+
+        if batch_size > 1:
+            work = [(run_batch, paths[i:i + batch_size]) for i in range(0, len(paths), batch_size)]
+        else:
+            work = [(run_file, path) for path in paths]
+        with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix='whisper-client') as executor:
+            futures = [executor.submit(fn, item) for fn, item in work]
+            for future in as_completed(futures):
+                for result in future.result():
+                    if on_result:
+                        on_result(result)
+                    yield result
+
+    def get_transcript(self, job_id, output_format='json'):
+        """获取已保存的转录结果"""
+        response = self.request('GET', f"/api/transcripts/{job_id}", params={'format': output_format})
+        if response.status_code != 200:
+            raise WhisperClientError(self._error_message(response))
+        return response.json() if output_format == 'json' else response.text
+
+    @staticmethod
+    def _error_message(response):
+        try:
+            message = response.json().get('error')
+        except ValueError:
+            message = response.text[:200]
+        return f"HTTP {response.status_code}: {message}"